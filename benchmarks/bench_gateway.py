@@ -0,0 +1,112 @@
+"""
+Several sessions (separate processes) running the same market data
+workload, first each with its own TestClient, then all through one
+gateway. Reports the requests the mock API served, including token
+refreshes, and the wall time. Run from the repo root:
+
+    python benchmarks/bench_gateway.py --sessions 4
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+BASILISK_DIR = os.path.join(SRC_DIR, "basilisk")
+CLIENT_DIR = os.path.join(BASILISK_DIR, "clients")
+
+for path in [THISDIR, SRC_DIR, BASILISK_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from gateway import Gateway
+from mock_server import MockConfig, MockTDServer
+from td.gateway_client import GatewayClient
+from td.scheduler import RequestScheduler
+from td.test_client import TestClient
+
+def unlimited():
+    return RequestScheduler(rate=10**9, period=1, burst=10**9)
+
+def workload(client, symbols, rounds, threads):
+    """
+    A session's strategies: each thread polls quotes and pulls the same
+    minute history and account info.
+    """
+    def strategy(i):
+        for _ in range(rounds):
+            client.get_quote(*symbols)
+            client.get_price_history(symbols[i % len(symbols)], output="array")
+            client.get_account_info()
+
+    workers = [threading.Thread(target=strategy, args=(i,)) for i in range(threads)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+def own_client_session(url, symbols, rounds, threads, start):
+    client = TestClient(url, cache=False, scheduler=unlimited(), coalesce_window=0.005,
+            pool_maxsize=threads)
+    start.wait()
+    workload(client, symbols, rounds, threads)
+    client.tokens.stop()
+    client._transport.close()
+
+def gateway_session(socket_path, symbols, rounds, threads, start):
+    client = GatewayClient(socket_path)
+    start.wait()
+    workload(client, symbols, rounds, threads)
+    client.close()
+
+def run_sessions(n, target, args):
+    start = multiprocessing.Event()
+    processes = [multiprocessing.Process(target=target, args=args + (start,)) for _ in range(n)]
+    for process in processes:
+        process.start()
+    # Give every process time to import and connect before the clock starts.
+    time.sleep(1.0)
+    began = time.perf_counter()
+    start.set()
+    for process in processes:
+        process.join()
+    return time.perf_counter() - began
+
+def report(mode, server, elapsed):
+    stats = dict(server.stats)
+    print(f"{mode:>12}: {sum(stats.values()):4d} API requests {stats}  {elapsed:.2f}s")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sessions", type=int, default=4)
+    parser.add_argument("--threads", type=int, default=4)
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--symbols", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.02)
+    args = parser.parse_args()
+
+    symbols = [f"S{i:04d}" for i in range(args.symbols)]
+    with MockTDServer(MockConfig(latency=args.latency)) as server:
+        server.reset_stats()
+        elapsed = run_sessions(args.sessions, own_client_session,
+                (server.url, symbols, args.rounds, args.threads))
+        report("own clients", server, elapsed)
+
+        socket_path = os.path.join(tempfile.mkdtemp(), "gateway.sock")
+        client = TestClient(server.url, scheduler=unlimited(), coalesce_window=0.005,
+                pool_maxsize=32)
+        with Gateway(client, socket_path) as gateway:
+            server.reset_stats()
+            elapsed = run_sessions(args.sessions, gateway_session,
+                    (socket_path, symbols, args.rounds, args.threads))
+            report("gateway", server, elapsed)
+            stats = gateway.stats()
+            print(f"gateway: {stats['sent']} calls sent, {stats['deduplicated']} deduplicated, "
+                  f"{stats['cached']} from its result cache")
+        client.tokens.stop()
+        client._transport.close()
@@ -0,0 +1,72 @@
+"""
+Cost of the market calendar: the requests a refresh takes, how fast the
+hot-path checks are, and the quote polls a 1s feed skips over a week of
+closed hours. Run from the repo root:
+
+    python benchmarks/bench_market_hours.py
+"""
+import argparse
+import os
+import sys
+import timeit
+from datetime import timedelta
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+BASILISK_DIR = os.path.join(SRC_DIR, "basilisk")
+CLIENT_DIR = os.path.join(BASILISK_DIR, "clients")
+
+for path in [THISDIR, SRC_DIR, BASILISK_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.market_calendar import MarketCalendar, market_date
+from mock_server import MockConfig, MockTDServer
+from td.scheduler import RequestScheduler
+from td.test_client import TestClient
+
+class PerMarketClient():
+    """
+    Hides get_markets_hours, so the calendar fetches one market at a time.
+    """
+
+    def __init__(self, client):
+        self.client = client
+
+    def get_market_hours(self, market, date):
+        return self.client.get_market_hours(market, date)
+
+def refresh_requests(server, client):
+    server.reset_stats()
+    calendar = MarketCalendar(client, path=None)
+    calendar.refresh()
+    return sum(server.stats.values()), calendar
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--quote-interval", type=float, default=1.0)
+    args = parser.parse_args()
+
+    with MockTDServer(MockConfig(latency=0.002)) as server:
+        client = TestClient(server.url, cache=False,
+                scheduler=RequestScheduler(rate=10**9, period=1, burst=10**9))
+        per_market, _ = refresh_requests(server, PerMarketClient(client))
+        batched, calendar = refresh_requests(server, client)
+        print(f"refresh ({calendar.days} days): {batched} requests batched, {per_market} per market")
+
+        n = 100000
+        seconds = timeit.timeit(lambda : calendar.is_open("EQUITY"), number=n)
+        print(f"is_open: {seconds / n * 1e6:.1f}us")
+        seconds = timeit.timeit(lambda : calendar.next_open("EQUITY"), number=n // 10)
+        print(f"next_open: {seconds / (n // 10) * 1e6:.1f}us")
+
+        today = market_date()
+        open_seconds = sum(end - start for i in range(7)
+                for start, end in calendar.sessions("EQUITY", today + timedelta(days=i))) / 1000
+        closed_seconds = 7 * 24 * 3600 - open_seconds
+        print(f"week: equity open {open_seconds / 3600:.1f}h, "
+              f"{closed_seconds / args.quote_interval:.0f} of "
+              f"{7 * 24 * 3600 / args.quote_interval:.0f} quote polls skipped")
+        client.tokens.stop()
+        client._transport.close()
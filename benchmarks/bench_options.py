@@ -0,0 +1,103 @@
+"""
+Parses a full-size option chain (30 expiries x 300 strikes x 2, like SPY)
+from the mock API into an OptionChain, and compares lookups and greeks on
+its columns with the same work done on the nested JSON. Run from the repo
+root:
+
+    python benchmarks/bench_options.py
+"""
+import argparse
+import json
+import math
+import os
+import sys
+import time
+import tracemalloc
+from urllib.parse import parse_qs
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+
+for path in [THISDIR, SRC_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.options import DAYS_PER_YEAR, OptionChain, black_scholes
+from mock_server import option_chain
+
+def scalar_black_scholes(spot, strike, years, rate, volatility, is_call):
+    """
+    Per-contract reference using math.erf, for timing and accuracy.
+    """
+    cdf = lambda x : 0.5 * (1.0 + math.erf(x / math.sqrt(2.0)))
+    sqrt_t = math.sqrt(years)
+    d1 = (math.log(spot / strike) + (rate + 0.5 * volatility * volatility) * years) / (volatility * sqrt_t)
+    d2 = d1 - volatility * sqrt_t
+    if is_call:
+        return spot * cdf(d1) - strike * math.exp(-rate * years) * cdf(d2), cdf(d1)
+    return strike * math.exp(-rate * years) * cdf(-d2) - spot * cdf(-d1), cdf(d1) - 1.0
+
+def timed(fn, repeat=5):
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def allocated(fn):
+    tracemalloc.start()
+    result = fn()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return size, result
+
+def nested_contracts(payload):
+    for key in ("callExpDateMap", "putExpDateMap"):
+        for strikes in payload[key].values():
+            for options in strikes.values():
+                yield from options
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--symbol", default="SPY")
+    args = parser.parse_args()
+
+    body = json.dumps(option_chain(args.symbol, parse_qs(""))).encode()
+    payload_bytes, payload = allocated(lambda : json.loads(body))
+    parse_time, chain = timed(lambda : OptionChain.from_payload(payload))
+    chain_bytes, _ = allocated(lambda : OptionChain.from_payload(payload))
+    print(f"contracts: {len(chain)}  response: {len(body) / 1e6:.1f} MB")
+    print(f"parse: {parse_time * 1e3:.1f} ms")
+    print(f"memory: nested dicts {payload_bytes / 1e6:.1f} MB, OptionChain {chain_bytes / 1e6:.1f} MB")
+
+    expiry = chain.expiries()[len(chain.expiries()) // 2]
+    strikes = chain.strikes(expiry)
+    targets = strikes[::7]
+    lookup_time, _ = timed(lambda : [chain.find(expiry, strike, "PUT") for strike in targets])
+    key = str(expiry)
+
+    def nested_lookup():
+        side = payload["putExpDateMap"]
+        entry = next(v for k, v in side.items() if k.startswith(key))
+        return [entry[str(float(strike))][0] for strike in targets]
+
+    nested_time, _ = timed(nested_lookup)
+    print(f"lookup by expiry/strike: {lookup_time / len(targets) * 1e6:.2f} us (chain), "
+            f"{nested_time / len(targets) * 1e6:.2f} us (nested, string keys)")
+
+    spot = chain.underlying_price
+    rate = chain.interest_rate
+    vector_time, greeks = timed(lambda : chain.analytical())
+    contracts = list(nested_contracts(payload))
+    scalar_time, reference = timed(lambda : [scalar_black_scholes(spot, c["strikePrice"],
+            c["daysToExpiration"] / DAYS_PER_YEAR, rate, c["volatility"] / 100.0,
+            c["putCall"] == "CALL") for c in contracts], repeat=1)
+    print(f"greeks for the whole chain: {vector_time * 1e3:.1f} ms vectorized, "
+            f"{scalar_time * 1e3:.1f} ms per contract ({scalar_time / vector_time:.0f}x)")
+
+    order = {c["symbol"] : i for i, c in enumerate(contracts)}
+    rows = [order[symbol] for symbol in chain.symbols]
+    error = max(abs(greeks["price"][i] - reference[j][0]) for i, j in enumerate(rows))
+    print(f"max price difference vs math.erf: {error:.2e}")
@@ -0,0 +1,112 @@
+"""
+Measures the local order path against the mock API: pre-trade risk checks
+and order book updates per call, placing a batch of orders one at a
+time versus concurrently with place_orders, and the time from a streamed
+ACCT_ACTIVITY fill to the order book showing it. Run from the repo root:
+
+    python benchmarks/bench_orders.py -n 40 --latency 0.02
+"""
+import argparse
+import os
+import sys
+import threading
+import time
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+CLIENT_DIR = os.path.join(SRC_DIR, "basilisk", "clients")
+
+for path in [THISDIR, SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from mock_server import MockConfig, MockTDServer
+from mock_stream import MockStreamServer
+from td.orders import Order, OrderBook, RiskChecker, RiskLimits, order_spec
+from td.scheduler import RequestScheduler
+from td.streamer import TDStreamer
+from td.test_client import TestClient
+
+LIMITS = RiskLimits(max_order_quantity=1000, max_order_notional=10**6, max_position=10**6,
+        max_open_orders=10**6, price_band=0.5)
+
+def per_call(fn, n):
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n
+
+def bench_local(n=100000):
+    book = OrderBook()
+    risk = RiskChecker(LIMITS, book, lambda symbol : 100.0)
+    order = Order("bench", order_spec("AAPL", 10, "BUY", "LIMIT", price=100.0))
+    check = per_call(lambda : risk.check(order), n)
+    orders = [Order(f"bench-{i}", order.spec) for i in range(n)]
+    it = iter(orders)
+    reserve = per_call(lambda : book.reserve(next(it), risk), n)
+    it = iter(orders)
+    fill = per_call(lambda : book.fill(next(it), 10, 100.0), n)
+    return check, reserve, fill
+
+def bench_submit(server, n):
+    client = TestClient(server.url, scheduler=RequestScheduler(rate=10**9, period=1, burst=10**9),
+            risk_limits=LIMITS, pool_maxsize=16)
+    client.access_token()
+    client.get_quote("AAPL")
+    batch = [{"symbol" : "AAPL", "quantity" : 1, "order_type" : "LIMIT", "price" : 440.0}
+            for _ in range(n)]
+    start = time.perf_counter()
+    for kwargs in batch:
+        client.place_order(**kwargs)
+    sequential = time.perf_counter() - start
+    start = time.perf_counter()
+    client.place_orders(batch)
+    concurrent = time.perf_counter() - start
+    client.tokens.stop()
+    client._transport.close()
+    return sequential, concurrent
+
+def bench_stream_fills(server, n):
+    """
+    Mean seconds from the mock streamer sending an OrderFill to the
+    client's on_fill callback, over `n` orders.
+    """
+    client = TestClient(server.url, scheduler=RequestScheduler(rate=10**9, period=1, burst=10**9),
+            risk_limits=LIMITS)
+    client.get_quote("AAPL")
+    filled = threading.Event()
+    client.on_fill = lambda client_order_id, order : filled.set()
+    total = 0.0
+    with MockStreamServer(interval=1) as stream:
+        streamer = TDStreamer(url=stream.url, orders=client.orders).start()
+        for _ in range(n):
+            order = client.orders.get(client.place_order("AAPL", 1, order_type="LIMIT", price=440.0))
+            filled.clear()
+            start = time.perf_counter()
+            stream.send_fill(order.order_id, "AAPL", 1, 440.0)
+            if not filled.wait(5) or order.status != "FILLED":
+                raise RuntimeError(f"Streamed fill for {order.order_id} was not applied")
+            total += time.perf_counter() - start
+        streamer.stop()
+    client.tokens.stop()
+    client._transport.close()
+    return total / n
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=40, help="orders per batch")
+    parser.add_argument("--latency", type=float, default=0.02,
+            help="mock server latency per request in seconds")
+    args = parser.parse_args()
+
+    check, reserve, fill = bench_local()
+    print(f"risk check: {check * 1e6:.2f} us")
+    print(f"risk check + book insert: {reserve * 1e6:.2f} us")
+    print(f"fill update: {fill * 1e6:.2f} us")
+    with MockTDServer(MockConfig(latency=args.latency)) as server:
+        sequential, concurrent = bench_submit(server, args.n)
+        stream_fill = bench_stream_fills(server, args.n)
+    print(f"{args.n} orders: {sequential:.3f}s one at a time, {concurrent:.3f}s with place_orders "
+            f"({sequential / concurrent:.1f}x)")
+    print(f"streamed fill to on_fill: {stream_fill * 1e3:.3f} ms")
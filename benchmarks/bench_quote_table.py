@@ -0,0 +1,104 @@
+"""
+N strategy processes reading quotes for the same symbols every tick,
+first each with its own client, then through one SharedQuoteTable kept
+current by a single writer. Reports the requests the mock API served and
+the time a strategy waits for its quotes. Run from the repo root:
+
+    python benchmarks/bench_quote_table.py --processes 8
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+CLIENT_DIR = os.path.join(SRC_DIR, "basilisk", "clients")
+
+for path in [THISDIR, SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.quote_table import QuoteTableWriter, SharedQuoteTable
+from mock_server import MockConfig, MockTDServer
+from td.scheduler import RequestScheduler
+from td.test_client import TestClient
+
+TABLE_NAME = "basilisk_bench_quotes"
+
+def unlimited():
+    return RequestScheduler(rate=10**9, period=1, burst=10**9)
+
+def symbols(n):
+    return [f"S{i:04d}" for i in range(n)]
+
+def client_strategy(url, names, ticks, interval, results):
+    client = TestClient(url, cache=False, scheduler=unlimited())
+    waits = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        client.get_quote(*names)
+        waits.append(time.perf_counter() - start)
+        time.sleep(interval)
+    client.tokens.stop()
+    client._transport.close()
+    results.put(waits)
+
+def table_strategy(names, ticks, interval, results):
+    table = SharedQuoteTable.attach(TABLE_NAME)
+    waits = []
+    for _ in range(ticks):
+        start = time.perf_counter()
+        table.get_quote(*names)
+        waits.append(time.perf_counter() - start)
+        time.sleep(interval)
+    table.close()
+    results.put(waits)
+
+def run_processes(n, target, args):
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=target, args=args + (results,)) for _ in range(n)]
+    for process in processes:
+        process.start()
+    waits = [wait for _ in processes for wait in results.get()]
+    for process in processes:
+        process.join()
+    return sorted(waits)
+
+def report(mode, server, waits):
+    requests = sum(server.stats.values())
+    print(f"{mode:>12}: {requests:4d} API requests  "
+          f"wait p50 {waits[len(waits) // 2] * 1e6:8.1f} us  p99 {waits[int(len(waits) * 0.99)] * 1e6:8.1f} us")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--processes", type=int, default=8)
+    parser.add_argument("--symbols", type=int, default=50)
+    parser.add_argument("--ticks", type=int, default=20)
+    parser.add_argument("--interval", type=float, default=0.05)
+    parser.add_argument("--latency", type=float, default=0.01)
+    args = parser.parse_args()
+
+    names = symbols(args.symbols)
+    with MockTDServer(MockConfig(latency=args.latency)) as server:
+        server.reset_stats()
+        waits = run_processes(args.processes, client_strategy,
+                (server.url, names, args.ticks, args.interval))
+        report("per process", server, waits)
+
+        client = TestClient(server.url, cache=False, scheduler=unlimited())
+        client.access_token()
+        table = SharedQuoteTable.create(TABLE_NAME, symbols=names)
+        writer = QuoteTableWriter(client, names, table, args.interval)
+        server.reset_stats()
+        writer.start()
+        while not table.updated:
+            time.sleep(0.001)
+        waits = run_processes(args.processes, table_strategy, (names, args.ticks, args.interval))
+        writer.stop()
+        report("shared table", server, waits)
+        table.close()
+        client.tokens.stop()
+        client._transport.close()
@@ -0,0 +1,106 @@
+"""
+Builds 5min, 15min, 30min, 1h, 2h, daily, weekly and monthly bars from
+60 trading days of extended-hours 1-minute bars, and compares resample
+with a pandas groupby on local bar starts and with feeding the same
+minutes one at a time through a BarAggregator. Run from the repo root:
+
+    python benchmarks/bench_resample.py
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+
+for path in [THISDIR, SRC_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.candles import CANDLE_DTYPE, MINUTE_IN_MS
+from data.resample import EXTENDED_SESSION, BarAggregator, parse_timeframe, resample
+
+TIMEFRAMES = ["5min", "15min", "30min", "1h", "2h", "1d", "1w", "1mo"]
+
+def timed(fn, repeat=5):
+    best = math.inf
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+def minute_bars(days, seed=0):
+    """
+    Random walk minute bars for every extended session minute of `days`
+    weekdays, starting 2024-03-04 (so the March DST switch is included).
+    """
+    sessions = pd.bdate_range("2024-03-04", periods=days, tz="America/New_York")
+    open_minute, close_minute = EXTENDED_SESSION
+    offsets = np.arange(open_minute, close_minute) * MINUTE_IN_MS
+    times = np.concatenate([int(day.timestamp() * 1000) + offsets for day in sessions])
+    rng = np.random.default_rng(seed)
+    price = 100 + np.cumsum(rng.normal(0, 0.05, len(times)))
+    candles = np.zeros(len(times), dtype=CANDLE_DTYPE)
+    candles["datetime"] = times
+    candles["open"] = price
+    candles["close"] = price + rng.normal(0, 0.02, len(times))
+    candles["high"] = np.maximum(candles["open"], candles["close"]) + 0.01
+    candles["low"] = np.minimum(candles["open"], candles["close"]) - 0.01
+    candles["volume"] = rng.integers(100, 10000, len(times))
+    return candles
+
+def pandas_resample(frame, minutes):
+    """
+    Same bars with a pandas groupby. frame.resample can't be used: its bins
+    are fixed lengths of UTC time, so they drift off the session open by an
+    hour across a DST switch.
+    """
+    open_minute = EXTENDED_SESSION[0]
+    index = frame.index
+    minute = index.hour * 60 + index.minute
+    start = open_minute + (minute - open_minute) // minutes * minutes
+    keys = index.normalize() + pd.to_timedelta(start, unit="min")
+    return frame.groupby(keys).agg({"open" : "first", "high" : "max", "low" : "min",
+            "close" : "last", "volume" : "sum"})
+
+def streamed(candles, timeframe):
+    aggregator = BarAggregator(timeframe)
+    bars = [bar for candle in candles for bar in aggregator.update(candle)]
+    bars.extend(aggregator.flush())
+    return np.array(bars, dtype=CANDLE_DTYPE)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--days", type=int, default=60)
+    args = parser.parse_args()
+
+    candles = minute_bars(args.days)
+    print(f"minute bars: {len(candles)} over {args.days} days")
+    frame = pd.DataFrame({name : candles[name] for name in CANDLE_DTYPE.names[1:]},
+            index=pd.to_datetime(candles["datetime"], unit="ms", utc=True).tz_convert("America/New_York"))
+
+    total = 0.0
+    for name in TIMEFRAMES:
+        elapsed, bars = timed(lambda : resample(candles, name))
+        total += elapsed
+        line = f"{name:>6}: {len(bars):6d} bars  resample {elapsed * 1e3:6.2f} ms"
+        timeframe = parse_timeframe(name)
+        if timeframe.unit == "minute":
+            pandas_time, expected = timed(lambda : pandas_resample(frame, timeframe.count))
+            same = np.allclose(bars["close"], expected["close"]) and np.array_equal(
+                    bars["volume"], expected["volume"])
+            line += f"  pandas {pandas_time * 1e3:6.2f} ms  same bars: {same}"
+        print(line)
+    print(f"all timeframes: {total * 1e3:.1f} ms")
+
+    stream_time, bars = timed(lambda : streamed(candles, "5min"), repeat=1)
+    print(f"5min streamed one minute at a time: {stream_time / len(candles) * 1e6:.1f} us/bar, "
+          f"same as batch: {np.array_equal(bars, resample(candles, '5min'))}")
+    print(f"price history requests per symbol: {len(TIMEFRAMES)} downloads -> 1 minute download")
@@ -0,0 +1,381 @@
+"""
+Scenario benchmarks against the local mock TD API. Each scenario runs the
+real client stack (transport, scheduler, token manager, cache, coalescer,
+candle store, runner) and reports timings as JSON, so runs from different
+releases can be compared:
+
+    python benchmarks/bench_scenarios.py -o results.json
+    python benchmarks/bench_scenarios.py -o new.json --baseline results.json
+
+Scenarios:
+- quote_fanout: many strategy threads requesting quotes at once, with and
+    without the coalescer.
+- universe_backfill: downloading minute history for a universe into the
+    candle store, one symbol at a time and concurrently, at a realistic
+    pricehistory latency.
+- token_refresh_storm: many threads needing a token at the same moment.
+- multi_strategy_session: polling strategies run side by side by the
+    StrategyRunner for a few seconds.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+BASILISK_DIR = os.path.join(SRC_DIR, "basilisk")
+CLIENT_DIR = os.path.join(BASILISK_DIR, "clients")
+STRATS_DIR = os.path.join(BASILISK_DIR, "strats")
+
+for path in [THISDIR, SRC_DIR, BASILISK_DIR, CLIENT_DIR, STRATS_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from base_strat import Strategy
+from data.candles import CandleStore
+from data.metrics import Histogram, METRICS
+from mock_server import MockConfig, MockTDServer
+from runner import StrategyRunner
+from td.async_client import AsyncTDClient
+from td.scheduler import RequestScheduler
+from td.test_client import TestClient
+
+# Regressions larger than this fraction are flagged by --baseline.
+DEFAULT_TOLERANCE = 0.2
+# Seconds the mock takes per pricehistory request in universe_backfill,
+# about what the real API takes for ten days of minute bars. At the default
+# few ms the scenario only measures JSON and numpy work, which the mock
+# server and client share one GIL for, so overlapping requests can't help.
+HISTORY_LATENCY = 0.15
+
+def unlimited():
+    """
+    A scheduler that never waits, so the 120/min production limit doesn't
+    dominate every measurement. Rate limiting is exercised by the mock
+    server's 429s instead.
+    """
+    return RequestScheduler(rate=10**9, period=1, burst=10**9)
+
+def universe(n):
+    return [f"S{i:04d}" for i in range(n)]
+
+def summarize(histogram):
+    return {
+        "count" : histogram.count,
+        "mean" : histogram.sum / histogram.count if histogram.count else None,
+        "p50" : histogram.percentile(0.5),
+        "p99" : histogram.percentile(0.99),
+        "max" : histogram.max if histogram.count else None,
+    }
+
+def close(client):
+    client.tokens.stop()
+    client._transport.close()
+
+def run_threads(n, target):
+    """
+    Starts `n` threads running target(i) together and waits for them.
+    Returns the elapsed wall time.
+    """
+    barrier = threading.Barrier(n + 1)
+
+    def worker(i):
+        barrier.wait()
+        target(i)
+
+    threads = [threading.Thread(target=worker, args=(i,)) for i in range(n)]
+    for thread in threads:
+        thread.start()
+    barrier.wait()
+    start = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    return time.perf_counter() - start
+
+###################################
+############ SCENARIOS ############
+###################################
+
+def quote_fanout(server, strategies=32, symbols=20, rounds=20):
+    results = {}
+    names = universe(symbols)
+    for mode, window in [("direct", None), ("coalesced", 0.005)]:
+        client = TestClient(server.url, cache=False, coalesce_window=window,
+                scheduler=unlimited(), pool_maxsize=strategies)
+        client.access_token()
+        server.reset_stats()
+        latency = Histogram()
+
+        def strategy(i):
+            mine = names[i % symbols:] + names[:i % symbols]
+            for _ in range(rounds):
+                start = time.perf_counter()
+                client.get_quote(*mine[:5])
+                latency.record(time.perf_counter() - start)
+
+        elapsed = run_threads(strategies, strategy)
+        calls = strategies * rounds
+        results[mode] = {
+            "seconds" : elapsed,
+            "calls_per_second" : calls / elapsed,
+            "server_requests" : server.stats["quotes"],
+            "latency" : summarize(latency),
+        }
+        close(client)
+    return results
+
+def universe_backfill(server, symbols=20, concurrency=8, latency=HISTORY_LATENCY):
+    results = {}
+    names = universe(symbols)
+    previous = server.config.latency
+    server.config.latency = latency
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            client = TestClient(server.url, cache=False, scheduler=unlimited())
+            client.access_token()
+
+            server.reset_stats()
+            store = CandleStore(os.path.join(tmp, "sync"))
+            start = time.perf_counter()
+            added = store.backfill_many(client, names)
+            elapsed = time.perf_counter() - start
+            results["sequential"] = {
+                "seconds" : elapsed,
+                "candles" : sum(added.values()),
+                "candles_per_second" : sum(added.values()) / elapsed,
+                "server_requests" : server.stats["pricehistory"],
+            }
+
+            async def backfill_async(store):
+                async with AsyncTDClient(client, concurrency=concurrency) as async_client:
+                    return await store.backfill_many_async(async_client, names)
+
+            server.reset_stats()
+            store = CandleStore(os.path.join(tmp, "async"))
+            start = time.perf_counter()
+            added = asyncio.run(backfill_async(store))
+            elapsed = time.perf_counter() - start
+            results["concurrent"] = {
+                "seconds" : elapsed,
+                "candles" : sum(added.values()),
+                "candles_per_second" : sum(added.values()) / elapsed,
+                "server_requests" : server.stats["pricehistory"],
+            }
+
+            # Second pass only fetches the tail after the newest stored candle.
+            server.reset_stats()
+            start = time.perf_counter()
+            added = store.backfill_many(client, names)
+            results["incremental"] = {
+                "seconds" : time.perf_counter() - start,
+                "candles" : sum(added.values()),
+                "server_requests" : server.stats["pricehistory"],
+            }
+            close(client)
+    finally:
+        server.config.latency = previous
+    return results
+
+def token_refresh_storm(server, threads=50, token_latency=0.05):
+    results = {}
+    previous = server.config.token_latency
+    server.config.token_latency = token_latency
+    try:
+        client = TestClient(server.url, cache=False, scheduler=unlimited(), pool_maxsize=threads)
+        latency = Histogram()
+
+        def first_use(i):
+            start = time.perf_counter()
+            client.get_quote("AAPL")
+            latency.record(time.perf_counter() - start)
+
+        server.reset_stats()
+        elapsed = run_threads(threads, first_use)
+        results["cold_start"] = {
+            "seconds" : elapsed,
+            "token_requests" : server.stats["oauth2/token"],
+            "latency" : summarize(latency),
+        }
+
+        def forced_refresh(i):
+            client.refresh_access_token()
+
+        server.reset_stats()
+        elapsed = run_threads(threads, forced_refresh)
+        results["forced_refresh"] = {
+            "seconds" : elapsed,
+            "token_requests" : server.stats["oauth2/token"],
+        }
+        close(client)
+    finally:
+        server.config.token_latency = previous
+    return results
+
+class PollingStrat(Strategy):
+    symbols = []
+    interval = 0.05
+
+    def run(self):
+        self.client.get_quote(*self.symbols)
+
+def multi_strategy_session(server, strategies=8, symbols=5, duration=3.0, interval=0.05):
+    client = TestClient(server.url, coalesce_window=0.002, scheduler=unlimited())
+    client.access_token()
+    names = universe(strategies * symbols)
+    strats = []
+    for i in range(strategies):
+        strat = PollingStrat(client)
+        strat.symbols = names[i * symbols:(i + 1) * symbols]
+        strat.interval = interval
+        strats.append(strat)
+
+    METRICS.reset()
+    server.reset_stats()
+    runner = StrategyRunner(strats)
+    start = time.perf_counter()
+    try:
+        runner.run(duration=duration)
+    finally:
+        runner.shutdown()
+    elapsed = time.perf_counter() - start
+
+    ticks = Histogram()
+    for (name, labels), metric in METRICS.items():
+        if name == "strategy_tick_seconds":
+            ticks.merge(metric)
+    close(client)
+    return {
+        "seconds" : elapsed,
+        "ticks" : sum(runner.ticks.values()),
+        "skipped" : sum(runner.skipped.values()),
+        "server_requests" : server.stats["quotes"],
+        "tick_latency" : summarize(ticks),
+    }
+
+def rate_limited_fanout(server, requests=40, limit=20, period=1.0):
+    """
+    Quote requests against a server that allows `limit` per `period`, so the
+    transport has to back off on 429s.
+    """
+    previous = (server.config.rate_limit, server.config.rate_period, server.config.retry_after)
+    client = TestClient(server.url, cache=False, scheduler=unlimited())
+    client.access_token()
+    server.reset_stats()
+    server.config.rate_limit, server.config.rate_period, server.config.retry_after = limit, period, 1
+    try:
+        start = time.perf_counter()
+        for _ in range(requests):
+            client.get_quote("AAPL")
+        elapsed = time.perf_counter() - start
+    finally:
+        server.config.rate_limit, server.config.rate_period, server.config.retry_after = previous
+    close(client)
+    return {
+        "seconds" : elapsed,
+        "requests" : requests,
+        "throttled" : server.stats["throttled"],
+    }
+
+SCENARIOS = {
+    "quote_fanout" : quote_fanout,
+    "universe_backfill" : universe_backfill,
+    "token_refresh_storm" : token_refresh_storm,
+    "multi_strategy_session" : multi_strategy_session,
+    "rate_limited_fanout" : rate_limited_fanout,
+}
+
+###################################
+############# RESULTS #############
+###################################
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                cwd=BASE_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def flatten(results, prefix=""):
+    flat = {}
+    for key, value in results.items():
+        name = f"{prefix}.{key}" if prefix else key
+        if isinstance(value, dict):
+            flat.update(flatten(value, name))
+        elif isinstance(value, (int, float)):
+            flat[name] = value
+    return flat
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns the timing metrics (seconds, latencies) that got worse by more
+    than `tolerance` relative to `baseline`, and throughput metrics
+    (per_second) that dropped by more than it.
+    """
+    regressions = []
+    current = flatten(results["scenarios"])
+    previous = flatten(baseline["scenarios"])
+    for name, value in sorted(current.items()):
+        old = previous.get(name)
+        if not old:
+            continue
+        change = (value - old) / old
+        if name.endswith("per_second"):
+            worse = change < -tolerance
+        elif name.endswith(("seconds", "p50", "p99", "mean")):
+            worse = change > tolerance
+        else:
+            continue
+        if worse:
+            regressions.append((name, old, value, change))
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("scenarios", nargs="*", default=list(SCENARIOS),
+            help=f"scenarios to run (default: all of {', '.join(SCENARIOS)})")
+    parser.add_argument("-o", "--output", default=None, help="write results JSON here")
+    parser.add_argument("--latency", type=float, default=0.002,
+            help="mock server latency per request in seconds")
+    parser.add_argument("--jitter", type=float, default=0.001,
+            help="extra random latency per request in seconds")
+    parser.add_argument("--baseline", default=None,
+            help="results JSON to compare against; exits 1 on regressions")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    config = MockConfig(latency=args.latency, jitter=args.jitter)
+    results = {
+        "revision" : git_revision(),
+        "python" : platform.python_version(),
+        "platform" : platform.platform(),
+        "time" : time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "config" : {"latency" : args.latency, "jitter" : args.jitter},
+        "scenarios" : {},
+    }
+    with MockTDServer(config) as server:
+        for name in args.scenarios:
+            print(f"Running {name}...", file=sys.stderr)
+            results["scenarios"][name] = SCENARIOS[name](server)
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output)
+    else:
+        print(output)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for name, old, new, change in regressions:
+            print(f"REGRESSION {name}: {old:.6g} -> {new:.6g} ({change:+.0%})", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
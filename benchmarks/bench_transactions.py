@@ -0,0 +1,60 @@
+"""
+Transaction history sync against the mock API: a first full download, then
+a daily sync that only fetches new activity. Reports requests, time,
+transactions stored and peak Python memory. Run from the repo root:
+
+    python benchmarks/bench_transactions.py
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+DATA_DIR = os.path.join(SRC_DIR, "data")
+BASILISK_DIR = os.path.join(SRC_DIR, "basilisk")
+CLIENT_DIR = os.path.join(BASILISK_DIR, "clients")
+
+for path in [THISDIR, SRC_DIR, DATA_DIR, BASILISK_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+import basilisk_data as bd
+from data.transactions import TransactionSync
+from mock_server import MockConfig, MockTDServer
+from td.scheduler import RequestScheduler
+from td.test_client import TestClient
+
+def timed_sync(server, sync):
+    server.reset_stats()
+    tracemalloc.start()
+    began = time.perf_counter()
+    added = sync.sync()
+    elapsed = time.perf_counter() - began
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return added, server.stats.get("transactions", 0), elapsed, peak
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--latency", type=float, default=0.05)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "transactions.db")
+    engine = bd.make_engine(f"sqlite:///{path}")
+    bd.Base.metadata.create_all(engine)
+    with MockTDServer(MockConfig(latency=args.latency)) as server:
+        client = TestClient(server.url, cache=False,
+                scheduler=RequestScheduler(rate=10**9, period=1, burst=10**9))
+        client.access_token()
+        sync = TransactionSync(client, engine=engine)
+        for run in ["first sync", "next sync"]:
+            added, requests, elapsed, peak = timed_sync(server, sync)
+            print(f"{run:>10}: {added:5d} new transactions, {requests:2d} requests, "
+                  f"{elapsed:.2f}s, peak {peak / 1e6:.1f}MB")
+        client.tokens.stop()
+        client._transport.close()
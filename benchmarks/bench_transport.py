@@ -0,0 +1,54 @@
+"""
+Compares requests per second of module-level requests.get (a new connection
+per call) against the pooled keep-alive Transport, both hitting a local mock
+server. Run from the repo root:
+
+    python benchmarks/bench_transport.py -n 2000
+"""
+import argparse
+import os
+import sys
+import time
+
+import requests
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+CLIENT_DIR = os.path.join(BASE_DIR, "src", "basilisk", "clients")
+
+for path in [THISDIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from mock_server import MockTDServer
+from td.scheduler import RequestScheduler
+from td.transport import Transport
+
+# Effectively unlimited so the rate limiter doesn't cap the measurement.
+UNLIMITED = RequestScheduler(rate=10**9, period=1, burst=10**9)
+
+def bench(get, url, n):
+    params = {"symbol" : "AAPL,MSFT"}
+    start = time.perf_counter()
+    for _ in range(n):
+        r = get(url, params=params)
+        r.raise_for_status()
+        r.json()
+    elapsed = time.perf_counter() - start
+    return n / elapsed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=1000, help="requests per run")
+    args = parser.parse_args()
+
+    with MockTDServer() as server:
+        url = server.url + "marketdata/quotes"
+        before = bench(requests.get, url, args.n)
+        transport = Transport(scheduler=UNLIMITED)
+        after = bench(transport.get, url, args.n)
+        transport.close()
+
+    print(f"requests.get (new connection per call): {before:10.1f} req/s")
+    print(f"Transport (pooled keep-alive):          {after:10.1f} req/s")
+    print(f"Speedup: {after / before:.2f}x")
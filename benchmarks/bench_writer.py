@@ -0,0 +1,70 @@
+"""
+Compares rows per second of committing each row in its own session (what
+the endpoints do) against the write-behind writer, on a scratch SQLite DB.
+Run from the repo root:
+
+    python benchmarks/bench_writer.py -n 20000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+DATA_DIR = os.path.join(SRC_DIR, "data")
+
+for path in [SRC_DIR, DATA_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from sqlalchemy.orm import sessionmaker
+
+import basilisk_data as bd
+from writer import WriteBehindWriter
+
+def quote_row(i):
+    return {
+        "time" : 1600000000000 + i,
+        "symbol" : "AAPL",
+        "bid" : 100.0,
+        "ask" : 100.05,
+        "last" : 100.02,
+        "volume" : float(i),
+    }
+
+def bench_per_row(engine, n):
+    factory = sessionmaker(bind=engine)
+    start = time.perf_counter()
+    for i in range(n):
+        session = factory()
+        session.execute(bd.QuoteLog.__table__.insert(), [quote_row(i)])
+        session.commit()
+        session.close()
+    return n / (time.perf_counter() - start)
+
+def bench_write_behind(engine, n):
+    writer = WriteBehindWriter(engine=engine).start()
+    start = time.perf_counter()
+    for i in range(n):
+        writer.write(bd.QuoteLog, quote_row(i))
+    writer.close()
+    return n / (time.perf_counter() - start)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("-n", type=int, default=5000, help="rows per run")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        engine = bd.make_engine(f"sqlite:///{os.path.join(tmp, 'bench.db')}")
+        bd.Base.metadata.create_all(engine)
+        before = bench_per_row(engine, args.n)
+        after = bench_write_behind(engine, args.n)
+        engine.dispose()
+
+    print(f"Session commit per row: {before:12.1f} rows/s")
+    print(f"Write-behind writer:    {after:12.1f} rows/s")
+    print(f"Speedup: {after / before:.1f}x")
@@ -0,0 +1,667 @@
+"""
+Local stand-in for the TD Ameritrade REST API used by the benchmarks. Serves
+marketdata/quotes, pricehistory, movers, chains, hours, instruments,
+accounts, orders, transactions, userprincipals and oauth2/token with deterministic fake data, and can add
+latency, jitter and rate-limit (429) responses:
+
+    config = MockConfig(latency=0.02, jitter=0.005, rate_limit=120)
+    with MockTDServer(config) as server:
+        client = TestClient(server.url)
+"""
+import json
+import math
+import itertools
+import random
+import re
+import threading
+import time
+import zlib
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+MINUTE_IN_MS = 60 * 1000
+DAY_IN_MS = 24 * 60 * MINUTE_IN_MS
+BAR_LENGTHS = {
+    "minute"  : MINUTE_IN_MS,
+    "daily"   : DAY_IN_MS,
+    "weekly"  : 7 * DAY_IN_MS,
+    "monthly" : 30 * DAY_IN_MS,
+}
+PERIOD_LENGTHS = {
+    "day"   : DAY_IN_MS,
+    "month" : 30 * DAY_IN_MS,
+    "year"  : 365 * DAY_IN_MS,
+    "ytd"   : 365 * DAY_IN_MS,
+}
+# Keeps a single pricehistory response to a realistic size.
+MAX_CANDLES = 20000
+# Default chain shape: weekly expiries, strikes 1 apart around the price.
+CHAIN_EXPIRIES = 30
+CHAIN_STRIKES = 300
+
+PRICE_HISTORY_PATH = re.compile(r"marketdata/([^/]+)/pricehistory$")
+MOVERS_PATH = re.compile(r"marketdata/([^/]+)/movers$")
+HOURS_PATH = re.compile(r"marketdata/(?:([^/]+)/)?hours$")
+ACCOUNT_PATH = re.compile(r"accounts/([^/]+)$")
+ORDERS_PATH = re.compile(r"accounts/([^/]+)/orders(?:/([^/]+))?$")
+TRANSACTIONS_PATH = re.compile(r"accounts/([^/]+)/transactions$")
+OPEN_ORDER_STATUSES = ["QUEUED", "ACCEPTED", "WORKING"]
+
+class MockConfig():
+    """
+    Behaviour of the mock server. Can be changed while it's running.
+
+    Args:
+    - latency: seconds added before every response.
+    - jitter: up to this many seconds of extra uniform random delay.
+    - rate_limit: requests allowed per `rate_period` seconds before the
+        server answers 429 (None for no limit).
+    - retry_after: Retry-After value sent with a 429.
+    - token_latency: extra delay for oauth2/token, which is much slower than
+        market data on the real API.
+    - token_lifetime: expires_in sent with new access tokens.
+    - order_delay: extra delay before answering an order placement, after
+        the order has been created. Longer than the client's read timeout
+        it simulates a submission whose outcome the client never learns.
+    """
+
+    def __init__(self, latency=0.0, jitter=0.0, rate_limit=None, rate_period=60.0,
+            retry_after=1, token_latency=0.0, token_lifetime=1800, order_delay=0.0, seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_limit = rate_limit
+        self.rate_period = rate_period
+        self.retry_after = retry_after
+        self.token_latency = token_latency
+        self.token_lifetime = token_lifetime
+        self.order_delay = order_delay
+        self.random = random.Random(seed)
+
+    def delay(self, extra=0.0):
+        delay = self.latency + extra
+        if self.jitter:
+            delay += self.random.uniform(0, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+
+def endpoint_for(path):
+    if path.endswith("oauth2/token"):
+        return "oauth2/token"
+    if path.endswith("marketdata/quotes"):
+        return "quotes"
+    if PRICE_HISTORY_PATH.search(path):
+        return "pricehistory"
+    if MOVERS_PATH.search(path):
+        return "movers"
+    if path.endswith("marketdata/chains"):
+        return "chains"
+    if HOURS_PATH.search(path):
+        return "hours"
+    if path.endswith("instruments"):
+        return "instruments"
+    if ORDERS_PATH.search(path):
+        return "orders"
+    if TRANSACTIONS_PATH.search(path):
+        return "transactions"
+    if path.endswith("userprincipals"):
+        return "userprincipals"
+    if ACCOUNT_PATH.search(path):
+        return "accounts"
+    return "other"
+
+def seed_for(symbol):
+    return zlib.crc32(symbol.encode())
+
+def quote(symbol):
+    rng = random.Random(seed_for(symbol))
+    price = round(rng.uniform(10, 500), 2)
+    return {
+        "symbol" : symbol,
+        "bidPrice" : price,
+        "askPrice" : round(price + 0.05, 2),
+        "lastPrice" : round(price + 0.02, 2),
+        "bidSize" : 100,
+        "askSize" : 100,
+        "openPrice" : price,
+        "highPrice" : round(price * 1.01, 2),
+        "lowPrice" : round(price * 0.99, 2),
+        "closePrice" : price,
+        "totalVolume" : rng.randint(10**5, 10**7),
+        "volatility" : round(rng.uniform(0.1, 0.6), 4),
+        "52WkHigh" : round(price * 1.3, 2),
+        "52WkLow" : round(price * 0.7, 2),
+        "quoteTimeInLong" : int(time.time() * 1000),
+    }
+
+def fundamentals(symbol):
+    rng = random.Random(seed_for(symbol))
+    return {
+        "fundamental" : {
+            "symbol" : symbol,
+            "peRatio" : round(rng.uniform(5, 60), 2),
+            "marketCap" : round(rng.uniform(1e3, 2e6), 2),
+            "dividendYield" : round(rng.uniform(0, 5), 2),
+            "beta" : round(rng.uniform(0.5, 2), 2),
+            "high52" : 0.0,
+            "low52" : 0.0,
+        },
+        "symbol" : symbol,
+        "assetType" : "EQUITY",
+    }
+
+def price_history(symbol, query):
+    """
+    Deterministic candles for the requested range, aligned to the bar
+    length.
+    """
+    frequency_type = query.get("frequencyType", ["minute"])[0]
+    frequency = int(query.get("frequency", ["1"])[0])
+    bar = BAR_LENGTHS.get(frequency_type, MINUTE_IN_MS) * frequency
+    now = int(time.time() * 1000)
+    if "startDate" in query:
+        start = int(query["startDate"][0])
+        end = int(query.get("endDate", [now])[0])
+    else:
+        period_type = query.get("periodType", ["day"])[0]
+        period = int(query.get("period", ["10"])[0])
+        end = now
+        start = end - period * PERIOD_LENGTHS.get(period_type, DAY_IN_MS)
+    first = -(-start // bar) * bar
+    count = max(0, (end - first) // bar + 1)
+    if count > MAX_CANDLES:
+        first += (count - MAX_CANDLES) * bar
+        count = MAX_CANDLES
+    # Prices are a function of the bar time, so overlapping requests agree.
+    base = 50 + seed_for(symbol) % 400
+    phase = seed_for(symbol) % 1000
+    candles = []
+    for i in range(count):
+        t = first + i * bar
+        open_price = base * (1 + 0.05 * math.sin((t - bar) / 3.6e6 + phase))
+        close = base * (1 + 0.05 * math.sin(t / 3.6e6 + phase))
+        candles.append({
+            "open" : round(open_price, 4),
+            "high" : round(max(open_price, close) * 1.0005, 4),
+            "low" : round(min(open_price, close) * 0.9995, 4),
+            "close" : round(close, 4),
+            "volume" : 100 + (t // bar) % 9900,
+            "datetime" : t,
+        })
+    return {"candles" : candles, "symbol" : symbol, "empty" : not candles}
+
+def option_chain(symbol, query):
+    """
+    A deterministic chain shaped like the real marketdata/chains response:
+    CHAIN_EXPIRIES weekly expiries with 2 * strikeCount strikes each
+    (CHAIN_STRIKES by default), calls and puts.
+    """
+    spot = quote(symbol)["lastPrice"]
+    contract_type = query.get("contractType", ["ALL"])[0]
+    strike_count = int(query.get("strikeCount", [CHAIN_STRIKES // 2])[0])
+    today = int(time.time() * 1000) // DAY_IN_MS * DAY_IN_MS
+    center = round(spot)
+    strikes = [float(center + k) for k in range(-strike_count, strike_count) if center + k > 0]
+    maps = {"callExpDateMap" : {}, "putExpDateMap" : {}}
+    for e in range(CHAIN_EXPIRIES):
+        days = 7 * (e + 1)
+        expiration = today + days * DAY_IN_MS + 20 * 60 * MINUTE_IN_MS
+        key = time.strftime("%Y-%m-%d", time.gmtime(expiration / 1000)) + f":{days}"
+        for put_call, name in [("CALL", "callExpDateMap"), ("PUT", "putExpDateMap")]:
+            if contract_type not in ("ALL", put_call):
+                continue
+            sign = 1 if put_call == "CALL" else -1
+            by_strike = maps[name].setdefault(key, {})
+            for strike in strikes:
+                moneyness = (spot - strike) / spot
+                iv = 20 + 40 * moneyness * moneyness + e * 0.1
+                intrinsic = max(sign * (spot - strike), 0.0)
+                mark = round(intrinsic + spot * iv / 100 * math.sqrt(days / 365) * 0.4, 2)
+                delta = sign * 0.5 + 0.5 * math.tanh(sign * moneyness * 10)
+                by_strike[str(strike)] = [{
+                    "putCall" : put_call,
+                    "symbol" : f"{symbol}_{key[5:7]}{key[8:10]}{key[2:4]}{put_call[0]}{strike:g}",
+                    "bid" : max(mark - 0.05, 0.0),
+                    "ask" : mark + 0.05,
+                    "last" : mark,
+                    "mark" : mark,
+                    "bidSize" : 10,
+                    "askSize" : 10,
+                    "totalVolume" : (int(strike) * 7 + e) % 5000,
+                    "openInterest" : (int(strike) * 13 + e) % 20000,
+                    "volatility" : round(iv, 3),
+                    "delta" : round(delta, 3),
+                    "gamma" : 0.01,
+                    "theta" : -0.05,
+                    "vega" : 0.1,
+                    "rho" : 0.02,
+                    "theoreticalOptionValue" : mark,
+                    "strikePrice" : strike,
+                    "expirationDate" : expiration,
+                    "daysToExpiration" : days,
+                    "multiplier" : 100.0,
+                    "inTheMoney" : intrinsic > 0,
+                }]
+    return {
+        "symbol" : symbol,
+        "status" : "SUCCESS",
+        "strategy" : query.get("strategy", ["SINGLE"])[0],
+        "interestRate" : 0.1,
+        "underlyingPrice" : spot,
+        "volatility" : 29.0,
+        "numberOfContracts" : sum(len(strikes) for side in maps.values() for strikes in side.values()),
+        **maps,
+    }
+
+# Session hours in minutes after midnight New York time, by market.
+MARKET_SESSIONS = {
+    "EQUITY" : ("EQ", [("preMarket", 420, 570), ("regularMarket", 570, 960),
+            ("postMarket", 960, 1200)]),
+    "OPTION" : ("EQO", [("regularMarket", 570, 960)]),
+    "FUTURE" : ("ES", [("preMarket", 0, 570), ("regularMarket", 570, 960),
+            ("outcryMarket", 960, 1020)]),
+    "FOREX" : ("forex", [("regularMarket", 0, 1440)]),
+    "BOND" : ("BON", [("preMarket", 420, 480), ("regularMarket", 480, 1020)]),
+}
+HOLIDAYS = ["01-01", "07-04", "12-25"]
+
+def market_hours(markets, date):
+    """
+    Weekday sessions, closed on weekends and a few fixed holidays, with
+    the New York UTC offset of the day.
+    """
+    from datetime import datetime, timedelta
+    from dateutil import tz
+
+    day = datetime.strptime(date[:10], "%Y-%m-%d")
+    local = tz.gettz("America/New_York")
+    response = {}
+    for market in markets:
+        product, sessions = MARKET_SESSIONS[market]
+        # Forex trades through the holidays.
+        is_open = day.weekday() < 5 and (market == "FOREX" or day.strftime("%m-%d") not in HOLIDAYS)
+        entry = {
+            "date" : date[:10],
+            "marketType" : market,
+            "product" : product,
+            "isOpen" : is_open,
+        }
+        if is_open:
+            hours = {}
+            for name, start, end in sessions:
+                hours.setdefault(name, []).append({
+                    "start" : (day + timedelta(minutes=start)).replace(tzinfo=local).isoformat(),
+                    "end" : (day + timedelta(minutes=end)).replace(tzinfo=local).isoformat(),
+                })
+            entry["sessionHours"] = hours
+        response[market.lower()] = {product : entry}
+    return response
+
+def movers(market, direction):
+    rng = random.Random(seed_for(market + direction))
+    sign = 1 if direction == "up" else -1
+    return [{
+        "symbol" : f"MV{i:02d}",
+        "description" : f"Mover {i}",
+        "change" : round(sign * rng.uniform(0.5, 10), 2),
+        "last" : round(rng.uniform(10, 300), 2),
+        "totalVolume" : rng.randint(10**5, 10**7),
+        "direction" : direction,
+    } for i in range(10)]
+
+def account(account_id, query, orders=()):
+    fields = query.get("fields", [""])[0].split(",")
+    body = {
+        "securitiesAccount" : {
+            "type" : "MARGIN",
+            "accountId" : account_id,
+            "currentBalances" : {"cashBalance" : 100000.0, "liquidationValue" : 150000.0},
+        }
+    }
+    if "positions" in fields:
+        body["securitiesAccount"]["positions"] = [{
+            "instrument" : {"symbol" : symbol, "assetType" : "EQUITY"},
+            "longQuantity" : 10.0,
+            "averagePrice" : quote(symbol)["lastPrice"],
+        } for symbol in ["AAPL", "MSFT", "SPY"]]
+    if "orders" in fields:
+        body["securitiesAccount"]["orderStrategies"] = list(orders)
+    return body
+
+# Trades a weekday has in the account's transaction history.
+TRANSACTIONS_PER_DAY = 20
+
+def transactions(query):
+    """
+    TRANSACTIONS_PER_DAY trades on each weekday from startDate to endDate,
+    none in the future. Ids and fields only depend on the day.
+    """
+    from datetime import datetime, timedelta, timezone
+
+    day = datetime.strptime(query["startDate"][0], "%Y-%m-%d").date()
+    end = min(datetime.strptime(query["endDate"][0], "%Y-%m-%d").date(),
+            datetime.now(timezone.utc).date())
+    symbol = query.get("symbol", [None])[0]
+    body = []
+    while day <= end:
+        if day.weekday() < 5:
+            rng = random.Random(day.toordinal())
+            for i in range(TRANSACTIONS_PER_DAY):
+                traded = ["AAPL", "MSFT", "SPY"][i % 3]
+                if symbol is not None and traded != symbol:
+                    continue
+                price = round(quote(traded)["lastPrice"] * rng.uniform(0.9, 1.1), 2)
+                amount = float(rng.randint(1, 100))
+                instruction = rng.choice(["BUY", "SELL"])
+                cost = round(-price * amount if instruction == "BUY" else price * amount, 2)
+                traded_at = datetime(day.year, day.month, day.day, 14, 30, tzinfo=timezone.utc) \
+                        + timedelta(minutes=17 * i)
+                body.append({
+                    "type" : "TRADE",
+                    "transactionSubType" : "BY" if instruction == "BUY" else "SL",
+                    "orderId" : f"{day.toordinal()}{i:03d}",
+                    "transactionId" : day.toordinal() * 1000 + i,
+                    "transactionDate" : traded_at.strftime("%Y-%m-%dT%H:%M:%S+0000"),
+                    "description" : f"{instruction} TRADE",
+                    "netAmount" : cost - 0.65,
+                    "fees" : {"commission" : 0.65, "secFee" : 0.0},
+                    "transactionItem" : {
+                        "instrument" : {"symbol" : traded, "assetType" : "EQUITY"},
+                        "instruction" : instruction,
+                        "amount" : amount,
+                        "price" : price,
+                        "cost" : cost,
+                    },
+                })
+        day += timedelta(days=1)
+    # Newest first, as the API sends them.
+    body.reverse()
+    return body
+
+def new_order(order_id, spec):
+    """
+    Order record for a placed order. Market orders fill straight away at the
+    mock quote; everything else works until cancelled or replaced.
+    """
+    leg = spec["orderLegCollection"][0]
+    order = {
+        "orderId" : order_id,
+        "accountId" : "123456789",
+        "orderType" : spec["orderType"],
+        "session" : spec.get("session", "NORMAL"),
+        "duration" : spec.get("duration", "DAY"),
+        "orderStrategyType" : "SINGLE",
+        "quantity" : float(leg["quantity"]),
+        "filledQuantity" : 0.0,
+        "remainingQuantity" : float(leg["quantity"]),
+        "orderLegCollection" : [dict(leg, quantity=float(leg["quantity"]))],
+        "status" : "WORKING",
+        "enteredTime" : time.strftime("%Y-%m-%dT%H:%M:%S+0000", time.gmtime()),
+        "cancelable" : True,
+        "editable" : True,
+    }
+    for field in ["price", "stopPrice"]:
+        if field in spec:
+            order[field] = float(spec[field])
+    if spec["orderType"] == "MARKET":
+        book = quote(leg["instrument"]["symbol"])
+        price = book["askPrice"] if leg["instruction"] in ("BUY", "BUY_TO_COVER") else book["bidPrice"]
+        order.update(status="FILLED", filledQuantity=order["quantity"], remainingQuantity=0.0,
+                cancelable=False, editable=False, orderActivityCollection=[{
+                    "activityType" : "EXECUTION",
+                    "executionLegs" : [{"quantity" : order["quantity"], "price" : price}],
+                }])
+    return order
+
+class MockTDHandler(BaseHTTPRequestHandler):
+    """
+    Request handler for MockTDServer. Speaks HTTP/1.1 so clients can keep
+    connections alive between requests.
+    """
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, body, status=200, headers=None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_empty(self, status, headers=None):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length)
+        try:
+            return json.loads(body) if body else None
+        except ValueError:
+            return None
+
+    def place(self, spec, match):
+        """
+        Creates an order and answers 201 with its Location, like the API.
+        """
+        if not spec or not spec.get("orderLegCollection"):
+            self.send_json({"error" : "Invalid order"}, status=400)
+            return
+        order = self.server.add_order(spec)
+        self.server.config.delay(self.server.config.order_delay)
+        location = f"{self.server.url_root}accounts/{match.group(1)}/orders/{order['orderId']}"
+        self.send_empty(201, headers={"Location" : location})
+
+    def admit(self, endpoint):
+        """
+        Counts the request and applies the delay and rate limit. Returns
+        False if a 429 was sent instead.
+        """
+        server = self.server
+        config = server.config
+        server.record(endpoint)
+        config.delay(config.token_latency if endpoint == "oauth2/token" else 0.0)
+        if not server.allow():
+            server.record("throttled")
+            self.send_json({"error" : "Too Many Requests"}, status=429,
+                    headers={"Retry-After" : str(config.retry_after)})
+            return False
+        return True
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        query = parse_qs(parsed.query)
+        path = parsed.path
+        endpoint = endpoint_for(path)
+        if not self.admit(endpoint):
+            return
+        if endpoint == "quotes":
+            symbols = query.get("symbol", [""])[0].split(",")
+            self.send_json({symbol : quote(symbol) for symbol in symbols if symbol})
+        elif endpoint == "pricehistory":
+            self.send_json(price_history(PRICE_HISTORY_PATH.search(path).group(1), query))
+        elif endpoint == "movers":
+            direction = query.get("direction", ["up"])[0]
+            self.send_json(movers(MOVERS_PATH.search(path).group(1), direction))
+        elif endpoint == "chains":
+            self.send_json(option_chain(query.get("symbol", ["SPY"])[0], query))
+        elif endpoint == "hours":
+            market = HOURS_PATH.search(path).group(1)
+            markets = [market] if market else query.get("markets", ["EQUITY"])[0].split(",")
+            self.send_json(market_hours(markets, query.get("date", [""])[0]))
+        elif endpoint == "instruments":
+            symbols = query.get("symbol", [""])[0].split(",")
+            self.send_json({symbol : fundamentals(symbol) for symbol in symbols if symbol})
+        elif endpoint == "orders":
+            match = ORDERS_PATH.search(path)
+            if match.group(2) is None:
+                self.send_json(self.server.list_orders())
+            elif match.group(2) in self.server.orders:
+                self.send_json(self.server.orders[match.group(2)])
+            else:
+                self.send_json({"error" : "Order not found"}, status=404)
+        elif endpoint == "transactions":
+            self.send_json(transactions(query))
+        elif endpoint == "accounts":
+            self.send_json(account(ACCOUNT_PATH.search(path).group(1), query,
+                    self.server.list_orders()))
+        elif endpoint == "userprincipals":
+            self.send_json({"accounts" : [{"accountId" : "123456789"}], "streamerInfo" : {}})
+        else:
+            self.send_json({"error" : "Not Found"}, status=404)
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        endpoint = endpoint_for(path)
+        body = self.read_json() if endpoint == "orders" else self.rfile.read(
+                int(self.headers.get("Content-Length", 0)))
+        if not self.admit(endpoint):
+            return
+        if endpoint == "orders":
+            self.place(body, ORDERS_PATH.search(path))
+            return
+        if endpoint != "oauth2/token":
+            self.send_json({"error" : "Not Found"}, status=404)
+            return
+        token = f"mock-access-token-{self.server.stats['oauth2/token']}"
+        self.send_json({
+            "access_token" : token,
+            "refresh_token" : "mock-refresh-token",
+            "expires_in" : self.server.config.token_lifetime,
+            "refresh_token_expires_in" : 7776000,
+        })
+
+    def do_PUT(self):
+        path = urlparse(self.path).path
+        body = self.read_json()
+        if not self.admit(endpoint_for(path)):
+            return
+        match = ORDERS_PATH.search(path)
+        if match is None or match.group(2) is None:
+            self.send_json({"error" : "Not Found"}, status=404)
+        elif not self.server.close_order(match.group(2), "REPLACED"):
+            self.send_json({"error" : "Order cannot be replaced"}, status=400)
+        else:
+            self.place(body, match)
+
+    def do_DELETE(self):
+        path = urlparse(self.path).path
+        if not self.admit(endpoint_for(path)):
+            return
+        match = ORDERS_PATH.search(path)
+        if match is None or match.group(2) is None:
+            self.send_json({"error" : "Not Found"}, status=404)
+        elif not self.server.close_order(match.group(2), "CANCELED"):
+            self.send_json({"error" : "Order cannot be cancelled"}, status=400)
+        else:
+            self.send_empty(200)
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, handler, config):
+        super().__init__(address, handler)
+        self.config = config
+        self.stats = Counter()
+        self.orders = {}
+        self.url_root = ""
+        self._order_ids = itertools.count(1000000001)
+        self._lock = threading.Lock()
+        self._window = deque()
+
+    def add_order(self, spec):
+        with self._lock:
+            order = new_order(next(self._order_ids), spec)
+            self.orders[str(order["orderId"])] = order
+        return order
+
+    def close_order(self, order_id, status):
+        """
+        Moves a working order to `status`. Returns False if there's no such
+        order or it's already done.
+        """
+        with self._lock:
+            order = self.orders.get(order_id)
+            if order is None or order["status"] not in OPEN_ORDER_STATUSES:
+                return False
+            order.update(status=status, cancelable=False, editable=False)
+            return True
+
+    def list_orders(self):
+        with self._lock:
+            return [dict(order) for order in self.orders.values()]
+
+    def record(self, key):
+        with self._lock:
+            self.stats[key] += 1
+
+    def allow(self):
+        limit = self.config.rate_limit
+        if limit is None:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            while self._window and now - self._window[0] >= self.config.rate_period:
+                self._window.popleft()
+            if len(self._window) >= limit:
+                return False
+            self._window.append(now)
+            return True
+
+class MockTDServer():
+    """
+    Runs the mock API on a background thread. Use as a context manager:
+
+        with MockTDServer() as server:
+            requests.get(server.url + "marketdata/quotes", ...)
+
+    `stats` counts requests by endpoint, plus "throttled" for 429s sent.
+    `orders` holds every order placed, by order id.
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0, handler=MockTDHandler):
+        self.config = config if config is not None else MockConfig()
+        self.httpd = MockHTTPServer((host, port), handler, self.config)
+        self.httpd.url_root = self.url
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"http://{host}:{port}/v1/"
+
+    @property
+    def stats(self):
+        return self.httpd.stats
+
+    @property
+    def orders(self):
+        return self.httpd.orders
+
+    def reset_stats(self):
+        with self.httpd._lock:
+            self.httpd.stats.clear()
+            self.httpd._window.clear()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,151 @@
+"""
+Fake TD streamer for running TDStreamer offline. Accepts any LOGIN and, once
+a QUOTE SUBS request arrives, pushes random level one updates for the
+subscribed keys every `interval` seconds. Connections that subscribe to
+ACCT_ACTIVITY get the order messages sent with send_activity/send_fill.
+
+    with MockStreamServer(interval=0.01) as server:
+        streamer = TDStreamer(url=server.url, orders=client.orders).start("AAPL")
+        server.send_fill(order_id, "AAPL", 10, 150.0)
+"""
+import asyncio
+import json
+import random
+import threading
+import time
+
+import websockets
+
+ACTIVITY_NAMESPACE = "urn:xmlns:beb.ameritrade.com"
+
+def fill_message(order_id, symbol, quantity, price):
+    """
+    XML body of an OrderFill message, trimmed to the elements
+    td.orders.parse_activity reads.
+    """
+    return (f'<?xml version="1.0" encoding="UTF-8"?>'
+        f'<OrderFillMessage xmlns="{ACTIVITY_NAMESPACE}">'
+        f'<Order><OrderKey>{order_id}</OrderKey>'
+        f'<Security><Symbol>{symbol}</Symbol></Security>'
+        f'<OriginalQuantity>{quantity}</OriginalQuantity></Order>'
+        f'<ExecutionInformation><Type>Bought</Type><Quantity>{quantity}</Quantity>'
+        f'<ExecutionPrice>{price}</ExecutionPrice></ExecutionInformation>'
+        f'</OrderFillMessage>')
+
+class MockStreamServer():
+
+    def __init__(self, host="127.0.0.1", port=0, interval=0.1):
+        self.host = host
+        self.port = port
+        self.interval = interval
+        self.messages_sent = 0
+        self._activity = set()
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._started = threading.Event()
+        self._server = None
+        self._stop = None
+
+    @property
+    def url(self):
+        return f"ws://{self.host}:{self.port}/ws"
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._serve())
+        self._loop.close()
+
+    async def _serve(self):
+        self._stop = asyncio.Event()
+        async with websockets.serve(self.handle, self.host, self.port) as server:
+            self.port = next(iter(server.sockets)).getsockname()[1]
+            self._started.set()
+            await self._stop.wait()
+
+    async def handle(self, websocket, path=None):
+        keys = []
+        pusher = None
+        try:
+            async for message in websocket:
+                for request in json.loads(message)["requests"]:
+                    if request["command"] == "LOGIN":
+                        await websocket.send(json.dumps({"response" : [{
+                            "service" : "ADMIN",
+                            "requestid" : request["requestid"],
+                            "command" : "LOGIN",
+                            "timestamp" : int(time.time() * 1000),
+                            "content" : {"code" : 0, "msg" : "mock login"},
+                        }]}))
+                    elif request["command"] == "SUBS" and request["service"] == "ACCT_ACTIVITY":
+                        self._activity.add(websocket)
+                    elif request["command"] == "SUBS":
+                        keys[:] = request["parameters"]["keys"].split(",")
+                        if pusher is None:
+                            pusher = asyncio.ensure_future(self.push(websocket, keys))
+        finally:
+            self._activity.discard(websocket)
+            if pusher is not None:
+                pusher.cancel()
+
+    async def push(self, websocket, keys):
+        prices = {}
+        while True:
+            content = []
+            for key in keys:
+                price = prices.get(key, 100.0) * (1 + random.gauss(0, 0.0005))
+                prices[key] = price
+                content.append({
+                    "key" : key,
+                    "1" : round(price - 0.01, 2),
+                    "2" : round(price + 0.01, 2),
+                    "3" : round(price, 2),
+                    "4" : random.randint(1, 10) * 100,
+                    "5" : random.randint(1, 10) * 100,
+                    "24" : 0.25,
+                })
+            await websocket.send(json.dumps({"data" : [{
+                "service" : "QUOTE",
+                "timestamp" : int(time.time() * 1000),
+                "command" : "SUBS",
+                "content" : content,
+            }]}))
+            self.messages_sent += 1
+            await asyncio.sleep(self.interval)
+
+    async def _send_activity(self, account, message_type, body):
+        message = json.dumps({"data" : [{
+            "service" : "ACCT_ACTIVITY",
+            "timestamp" : int(time.time() * 1000),
+            "command" : "SUBS",
+            "content" : [{"seq" : self.messages_sent, "key" : "mock",
+                "1" : account, "2" : message_type, "3" : body}],
+        }]})
+        for websocket in list(self._activity):
+            await websocket.send(message)
+        self.messages_sent += 1
+
+    def send_activity(self, message_type, body, account="123456789"):
+        """
+        Sends an ACCT_ACTIVITY message to every connection subscribed to it
+        and waits until it's sent.
+        """
+        asyncio.run_coroutine_threadsafe(
+                self._send_activity(account, message_type, body), self._loop).result()
+
+    def send_fill(self, order_id, symbol, quantity, price):
+        self.send_activity("OrderFill", fill_message(order_id, symbol, quantity, price))
+
+    def start(self):
+        self._thread.start()
+        self._started.wait()
+        return self
+
+    def stop(self):
+        self._loop.call_soon_threadsafe(self._stop.set)
+        self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
@@ -0,0 +1,143 @@
+import itertools
+import logging
+import math
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(THISDIR, "..")
+CLIENT_DIR = os.path.join(THISDIR, "clients")
+
+for path in [SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from backtest.backtest_client import BARS_PER_YEAR, BacktestClient
+
+logger = logging.getLogger(__name__)
+
+def performance(equity, bars_per_year=BARS_PER_YEAR):
+    """
+    Summary statistics for an equity curve.
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    if len(equity) < 2:
+        return {"total_return" : 0.0, "sharpe" : 0.0, "max_drawdown" : 0.0}
+    returns = np.diff(equity) / equity[:-1]
+    std = returns.std(ddof=1)
+    peaks = np.maximum.accumulate(equity)
+    return {
+        "total_return" : float(equity[-1] / equity[0] - 1),
+        "sharpe" : float(returns.mean() / std * math.sqrt(bars_per_year)) if std > 0 else 0.0,
+        "max_drawdown" : float(((peaks - equity) / peaks).max()),
+    }
+
+class BacktestEngine():
+    """
+    Replays stored candles through strategies, bar by bar, as fast as they
+    can process them. Strategies are built with a BacktestClient in place
+    of the live client and receive the same callbacks the event bus would
+    send: on_bar and on_quote for their symbols, on_fill for their orders.
+    Polling strategies have `run` called on their interval in simulated
+    time.
+    """
+
+    def __init__(self, client, strat_classes):
+        """
+        Args:
+        - client: BacktestClient holding the data to replay.
+        - strat_classes: strategy classes to instantiate with the client.
+        """
+        self.client = client
+        self.strats = [strat_class(client) for strat_class in strat_classes]
+        self.times = []
+        self.equity = []
+        client.on_fill = self._on_fill
+
+    def _on_fill(self, order_id, fill):
+        for strat in self.strats:
+            strat.on_fill(order_id, fill)
+
+    def run(self):
+        """
+        Replays every bar and returns performance stats for the run.
+        """
+        client = self.client
+        due = {id(strat) : None for strat in self.strats}
+        last_close = {}
+        for time in client.timeline():
+            updated = client.advance_to(int(time))
+            for symbol in updated:
+                bar = client.bar(symbol)
+                last_close[symbol] = bar["close"]
+                quote = client.quote(symbol)
+                for strat in self.strats:
+                    if symbol in getattr(strat, "symbols", ()):
+                        strat.on_bar(symbol, bar)
+                        strat.on_quote(symbol, quote)
+            for strat in self.strats:
+                interval = getattr(strat, "interval", None)
+                if interval is None:
+                    continue
+                next_due = due[id(strat)]
+                if next_due is None or time >= next_due:
+                    strat.run()
+                    due[id(strat)] = time + interval * 1000
+            self.times.append(int(time))
+            self.equity.append(client.portfolio.equity(last_close))
+
+        stats = performance(self.equity)
+        stats["fills"] = len(client.portfolio.fills)
+        stats["realized"] = client.portfolio.realized
+        return stats
+
+def vectorized_backtest(close, positions, cost=0.0, bars_per_year=BARS_PER_YEAR):
+    """
+    Fast path for strategies that can express their signal as an array.
+    `positions` is the target position (e.g. -1, 0, 1) decided at each bar's
+    close; it is held over the next bar, so there's no look-ahead. `cost` is
+    charged per unit of position change as a fraction of price.
+    Returns (equity curve, stats) starting from 1.0.
+    """
+    close = np.asarray(close, dtype=np.float64)
+    positions = np.asarray(positions, dtype=np.float64)
+    returns = np.diff(close) / close[:-1]
+    held = positions[:-1]
+    turnover = np.abs(np.diff(held, prepend=0.0))
+    strategy_returns = held * returns - cost * turnover
+    equity = np.concatenate([[1.0], np.cumprod(1 + strategy_returns)])
+    return equity, performance(equity, bars_per_year)
+
+def _evaluate(args):
+    signal_fn, close, params, cost = args
+    positions = signal_fn(close, **params)
+    _, stats = vectorized_backtest(close, positions, cost)
+    return params, stats
+
+def sweep(signal_fn, close, grid, cost=0.0, workers=None):
+    """
+    Runs the vectorized backtest for every combination of parameters in
+    `grid` (dict of name to list of values) across a process pool.
+    `signal_fn(close, **params)` must be a module-level function returning
+    positions. Returns (params, stats) pairs sorted by Sharpe ratio, best
+    first.
+    """
+    names = list(grid)
+    combos = [dict(zip(names, values)) for values in itertools.product(*grid.values())]
+    close = np.asarray(close, dtype=np.float64)
+    jobs = [(signal_fn, close, params, cost) for params in combos]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_evaluate, jobs, chunksize=max(1, len(jobs) // 32)))
+    return sorted(results, key=lambda result: result[1]["sharpe"], reverse=True)
+
+def backtest(store, strat_classes, symbols, start=None, end=None, **client_kwargs):
+    """
+    Convenience wrapper: builds a BacktestClient over `store` and runs the
+    strategies through it.
+    """
+    client = BacktestClient(store, symbols, start=start, end=end, **client_kwargs)
+    engine = BacktestEngine(client, strat_classes)
+    return engine.run()
@@ -3,16 +3,21 @@ import atexit
 import configparser
 from datetime import datetime
 import httpx
+import importlib
+import inspect
 import logging
 import os
 import random
+import signal
 import string
 import sys
+import threading
 import time
 
 THISDIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.join(THISDIR, "..", "..")
 LOG_DIR = os.path.join(BASE_DIR, "logs")
+JOURNAL_DIR = os.path.join(BASE_DIR, "journal")
 SRC_DIR = os.path.join(THISDIR, "..")
 DATA_DIR = os.path.join(BASE_DIR, "src", "data")
 CONF_DIR = os.path.join(BASE_DIR, "conf")
@@ -23,19 +28,71 @@ for path in [SRC_DIR, DATA_DIR, CLIENT_DIR, STRATS_DIR]:
     if path not in sys.path:
         sys.path.append(path)
 
+from bus import TOPIC_FILL, BarFeed, EventBus, QuoteFeed
+from data.candles import CandleStore
+from data.journal import AuditLog, CombinedLog
+from data.market_calendar import MarketCalendar
+from data.metrics import METRICS
+from data.quote_table import QuoteTableWriter, SharedQuoteTable
 from data.session import SessionEndpoint
-from strats.example import ExampleStrat
-from clients.td.td_client import TDClient
+from data.writer import DatabaseLog
+from market_scheduler import MarketScheduler
+from runner import StrategyRunner
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(filename=os.path.join(LOG_DIR, "session.log"), level=logging.DEBUG)
 
+# Seconds clients gather quote requests from concurrent strategies before
+# sending them as one.
+DEFAULT_COALESCE_WINDOW = 0.005
+
+def log_metrics(*args):
+    """
+    Writes a snapshot of every metric to the session log. Installed as the
+    SIGUSR1 handler so a running session can be inspected on demand.
+    """
+    for name, snapshot in METRICS.dump().items():
+        logging.info(f"{name} {snapshot}")
+
+class PluginError(Exception):
+    pass
+
+def load_class(path):
+    """
+    Imports a class from a dotted path, e.g. "td.td_client.TDClient".
+    Client paths are relative to the clients dir and strategy paths to the
+    strats dir.
+    """
+    module_name, _, class_name = path.strip().rpartition(".")
+    if not module_name:
+        raise PluginError(f"Plugin '{path}' should be a dotted module.Class path")
+    try:
+        module = importlib.import_module(module_name)
+        return getattr(module, class_name)
+    except (ImportError, AttributeError) as e:
+        raise PluginError(f"Failed to load plugin '{path}': {e}")
+
+def split_list(value):
+    return [item.strip() for item in value.split(",") if item.strip()]
+
 class BasiliskSession():
+    """
+    Args:
+    - coalesce_window: passed to clients that take one, so quote requests
+        from strategies ticking together go out as one request. None
+        turns coalescing off.
+    """
 
-    def __init__(self):
+    def __init__(self, coalesce_window=DEFAULT_COALESCE_WINDOW):
         self.session_id = round(time.time())
+        self.coalesce_window = coalesce_window
         self.strats = None
         self.clients = None
+        self.client_modules = []
+        self.strat_modules = []
+        self.bus = EventBus()
+        self.candles = CandleStore()
+        self.journal = None
 
     @staticmethod
     def get_clients():
@@ -81,18 +138,266 @@ class BasiliskSession():
         }
         return SessionEndpoint.insert(new_session)
 
+    def open_journal(self):
+        """
+        Starts the binary audit journal for this session under
+        journal/<session_id>. Clients loaded afterwards record their
+        requests, quotes and orders in it.
+        """
+        journal = AuditLog(os.path.join(JOURNAL_DIR, str(self.session_id)))
+        atexit.register(journal.close)
+        return self.add_journal(journal)
+
+    def open_db_log(self):
+        """
+        Starts recording quotes, orders and fills in the session database,
+        through the shared write-behind writer. Clients loaded afterwards
+        log to it.
+        """
+        return self.add_journal(DatabaseLog())
+
+    def add_journal(self, journal):
+        if self.journal is None:
+            self.journal = journal
+        else:
+            logs = self.journal.logs if isinstance(self.journal, CombinedLog) else (self.journal,)
+            self.journal = CombinedLog(*logs, journal)
+        return journal
+
+    def client_kwargs(self, client_class):
+        """
+        Session wide client options, limited to the ones `client_class`
+        takes.
+        """
+        options = {"coalesce_window" : self.coalesce_window}
+        parameters = inspect.signature(client_class).parameters
+        return {name : value for name, value in options.items() if name in parameters}
+
     def load_client_modules(self):
-        raise NotImplementedError
+        """
+        Instantiates every client listed in the CLIENTS section. Each client
+        is created once and shared by all strategies.
+        """
+        if self.clients is None:
+            self.clients = self.get_clients()
+        self.client_modules = []
+        for path in split_list(self.clients):
+            client_class = load_class(path)
+            logging.info(f"Loading client {path} providing {client_class.provides}")
+            client = client_class(**self.client_kwargs(client_class))
+            if self.journal is not None and hasattr(client, "attach_journal"):
+                client.attach_journal(self.journal)
+            self.client_modules.append(client)
+        return self.client_modules
 
     def load_strat_modules(self):
-        raise NotImplementedError
+        """
+        Instantiates every strategy listed in the STRATEGIES section with the
+        first loaded client whose `provides` covers the strategy's `requires`.
+        Raises PluginError if no client does.
+        """
+        if self.strats is None:
+            self.strats = self.get_strats()
+        self.strat_modules = []
+        for path in split_list(self.strats):
+            strat_class = load_class(path)
+            requires = set(getattr(strat_class, "requires", []))
+            for client in self.client_modules:
+                if requires <= set(getattr(client, "provides", [])):
+                    break
+            else:
+                raise PluginError(f"No loaded client provides {sorted(requires)} for strategy {path}")
+            logging.info(f"Loading strategy {path} with client {type(client).__name__}")
+            self.strat_modules.append(strat_class(client))
+        return self.strat_modules
+
+    def start_scheduler(self):
+        """
+        Loads the market calendar from the first client that has market
+        hours and starts a MarketScheduler on it. Before each equity open it
+        refreshes the clients' tokens, fills their fundamentals caches and
+        backfills the candle store for their strategies' symbols, then warms
+        up the strategies. Returns None if no client has market hours.
+        """
+        clients = [client for client in self.client_modules if hasattr(client, "get_market_hours")]
+        if not clients:
+            logger.warning("No client provides market hours, strategies run around the clock")
+            return None
+        calendar = MarketCalendar(clients[0])
+        calendar.refresh()
+        scheduler = MarketScheduler(calendar)
+        for client in self.client_modules:
+            if hasattr(client, "access_token"):
+                scheduler.add_warm_up(client.access_token)
+            symbols = sorted({symbol for strat in self.strat_modules if strat.client is client
+                    for symbol in getattr(strat, "symbols", [])})
+            if symbols and hasattr(client, "get_fundamentals_many"):
+                scheduler.add_warm_up(lambda client=client, symbols=symbols :
+                        client.get_fundamentals_many(symbols))
+            if symbols and hasattr(client, "get_price_history"):
+                scheduler.add_warm_up(lambda client=client, symbols=symbols :
+                        self.candles.backfill_many(client, symbols))
+        for strat in self.strat_modules:
+            if hasattr(strat, "warm_up"):
+                scheduler.add_warm_up(strat.warm_up)
+        return scheduler.start()
+
+    def publish_fill(self, client_order_id, order):
+        self.bus.publish(TOPIC_FILL, client_order_id, order)
+
+    def start_feeds(self, quote_interval=1.0, scheduler=None):
+        """
+        Attaches every strategy to the event bus and starts the feeds behind
+        it, so each tick is fetched once and shared:
+        - one quote feed per client covering all its strategies' symbols.
+            With a scheduler, a feed whose strategies all trade the same
+            market hours sleeps while it's closed.
+        - one bar feed per client and market hours for the strategies with
+            a `timeframe`, resampling every timeframe they ask for from the
+            client's 1-minute bars. With a scheduler, polls are aligned to
+            the bar boundaries and stop while the market is closed.
+        Fills on each client are published on the bus as they're booked.
+        """
+        feeds = []
+        for client in self.client_modules:
+            if hasattr(client, "on_fill"):
+                client.on_fill = self.publish_fill
+            strats = [strat for strat in self.strat_modules if strat.client is client]
+            for strat in strats:
+                self.bus.attach(strat)
+            strats = [strat for strat in strats if getattr(strat, "symbols", None)]
+            symbols = {symbol for strat in strats for symbol in strat.symbols}
+            if not symbols:
+                continue
+            hours = {(getattr(strat, "market", None), getattr(strat, "extended_hours", False))
+                    for strat in strats}
+            market, extended_hours = hours.pop() if len(hours) == 1 else (None, False)
+            feed = QuoteFeed(self.bus, client, symbols, quote_interval,
+                    scheduler=None if market is None else scheduler, market=market,
+                    extended_hours=extended_hours)
+            feeds.append(feed.start())
+            feeds += self.start_bar_feeds(client, strats, scheduler)
+        return feeds
+
+    def start_bar_feeds(self, client, strats, scheduler=None):
+        """
+        Starts the bar feeds for `client`'s strategies with a timeframe, one
+        per market and extended_hours setting.
+        """
+        groups = {}
+        for strat in strats:
+            if getattr(strat, "timeframe", None) is not None:
+                hours = (getattr(strat, "market", None), getattr(strat, "extended_hours", False))
+                groups.setdefault(hours, []).append(strat)
+        if groups and not hasattr(client, "get_price_history"):
+            raise PluginError(f"Client {type(client).__name__} has no price history for bars")
+        feeds = []
+        for (market, extended_hours), group in groups.items():
+            symbols = {symbol for strat in group for symbol in strat.symbols}
+            timeframes = {strat.timeframe for strat in group}
+            # start_scheduler already backfills the store before the open.
+            feed = BarFeed(self.bus, client, self.candles, symbols,
+                    timeframes=timeframes, extended_hours=extended_hours,
+                    scheduler=None if market is None else scheduler, market=market,
+                    warm_up=False)
+            feeds.append(feed.start())
+        return feeds
+
+    def start_quote_table(self, quote_interval=1.0):
+        """
+        Creates a shared memory quote table for the cpu-bound strategies'
+        symbols and starts one writer per client keeping it current, so the
+        process pool workers read quotes without requests of their own.
+        Returns (table, writers), or (None, []) if no cpu-bound strategy
+        lists symbols.
+        """
+        strats = [strat for strat in self.strat_modules
+                if getattr(strat, "cpu_bound", False) and getattr(strat, "symbols", None)]
+        if not strats:
+            return None, []
+        symbols = {symbol for strat in strats for symbol in strat.symbols}
+        table = SharedQuoteTable.create(f"basilisk_quotes_{os.getpid()}", symbols=sorted(symbols))
+        writers = []
+        for client in self.client_modules:
+            client_symbols = {symbol for strat in strats if strat.client is client
+                    for symbol in strat.symbols}
+            if client_symbols:
+                writers.append(QuoteTableWriter(client, client_symbols, table, quote_interval).start())
+        return table, writers
+
+    def run(self, duration=None, max_ticks=None, cpu_workers=None, quote_interval=1.0,
+            shared_quotes=False, market_hours=True):
+        """
+        Runs all loaded strategies concurrently until `duration` seconds have
+        passed or each has ticked `max_ticks` times. Event-driven strategies
+        are fed by the bus; polling ones by the runner. With `shared_quotes`
+        cpu-bound strategies also get quotes in shared memory (see
+        start_quote_table). With `market_hours` strategies and feeds are
+        idle while their market is closed (see start_scheduler). SIGINT and
+        SIGTERM stop the session cleanly.
+        """
+        scheduler = self.start_scheduler() if market_hours else None
+        feeds = self.start_feeds(quote_interval, scheduler)
+        table, writers = None, []
+        if shared_quotes:
+            table, writers = self.start_quote_table(quote_interval)
+        runner = StrategyRunner(self.strat_modules, cpu_workers=cpu_workers,
+                quote_table=None if table is None else table.name, scheduler=scheduler)
+        if threading.current_thread() is threading.main_thread():
+            for signum in (signal.SIGINT, signal.SIGTERM):
+                signal.signal(signum, lambda *_ : runner.stop())
+        try:
+            runner.run(duration=duration, max_ticks=max_ticks)
+        finally:
+            runner.shutdown()
+            for feed in feeds + writers:
+                feed.stop()
+            if table is not None:
+                table.close()
+            if scheduler is not None:
+                scheduler.stop()
+            self.bus.close()
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
-    
-    sess = BasiliskSession()
+    parser.add_argument("--duration", type=float, default=None,
+            help="seconds to run for (default: forever)")
+    parser.add_argument("--ticks", type=int, default=None,
+            help="number of ticks per strategy (default: unlimited)")
+    parser.add_argument("--cpu-workers", type=int, default=None,
+            help="size of the process pool for CPU-bound strategies")
+    parser.add_argument("--shared-quotes", action="store_true",
+            help="give CPU-bound strategies quotes through shared memory")
+    parser.add_argument("--ignore-market-hours", action="store_true",
+            help="run strategies even while their market is closed")
+    parser.add_argument("--journal", action="store_true",
+            help="record requests, quotes and orders in a binary journal")
+    parser.add_argument("--db-log", action="store_true",
+            help="record quotes, orders and fills in the session database")
+    parser.add_argument("--coalesce-window", type=float, default=DEFAULT_COALESCE_WINDOW,
+            help="seconds to gather quote requests from strategies into one request "
+            "(0 to turn coalescing off)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+            help="serve Prometheus metrics on this local port")
+    parser.add_argument("--metrics-file", default=None,
+            help="write Prometheus metrics to this file on exit")
+    args = parser.parse_args()
+
+    if hasattr(signal, "SIGUSR1"):
+        signal.signal(signal.SIGUSR1, log_metrics)
+    if args.metrics_port is not None:
+        METRICS.serve(args.metrics_port)
+    if args.metrics_file is not None:
+        atexit.register(METRICS.write_prometheus, args.metrics_file)
+
+    sess = BasiliskSession(coalesce_window=args.coalesce_window or None)
     sess.init_db_session()
-    client = TDClient()
-    strat = ExampleStrat(client)
-    strat.run()
+    if args.journal:
+        sess.open_journal()
+    if args.db_log:
+        sess.open_db_log()
+    sess.load_client_modules()
+    sess.load_strat_modules()
+    sess.run(duration=args.duration, max_ticks=args.ticks, cpu_workers=args.cpu_workers,
+            shared_quotes=args.shared_quotes, market_hours=not args.ignore_market_hours)
@@ -0,0 +1,426 @@
+import logging
+import os
+import sys
+import threading
+import time
+from collections import OrderedDict, deque
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(THISDIR, "..")
+
+for path in [SRC_DIR, THISDIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.metrics import METRICS
+from data.resample import BarAggregator, Timeframe, parse_timeframe, period_start
+from market_scheduler import BAR_SETTLE_DELAY, next_boundary, sleep_until
+
+logger = logging.getLogger(__name__)
+
+TOPIC_QUOTE = "quote"
+TOPIC_BAR = "bar"
+TOPIC_FILL = "fill"
+
+MINUTE = Timeframe("minute")
+
+def bar_topic(timeframe):
+    """
+    Topic BarFeed publishes bars of `timeframe` on: TOPIC_BAR for the
+    1-minute bars, e.g. "bar:minute_5" for resampled ones.
+    """
+    timeframe = parse_timeframe(timeframe)
+    if timeframe == MINUTE:
+        return TOPIC_BAR
+    return f"{TOPIC_BAR}:{timeframe.name}"
+
+# Backpressure policies, applied when a subscriber's queue is full. None of
+# them ever makes the publisher wait, so a slow subscriber only delays
+# itself.
+# DROP_OLDEST: the oldest queued event is discarded.
+# CONFLATE: only the newest event per key is kept, so a slow subscriber
+#   skips straight to the latest quote for each symbol.
+# UNBOUNDED: the queue grows as needed. Nothing is lost; for events every
+#   subscriber must see, like fills, which are rare.
+# BLOCK: the publisher waits for room. Never a default, since it stalls
+#   every other subscriber of the topic.
+BLOCK = "block"
+DROP_OLDEST = "drop_oldest"
+CONFLATE = "conflate"
+UNBOUNDED = "unbounded"
+
+# By topic, or for resampled bars ("bar:minute_5") by the part before the colon.
+DEFAULT_POLICIES = {
+    TOPIC_QUOTE : CONFLATE,
+    TOPIC_BAR   : DROP_OLDEST,
+    TOPIC_FILL  : UNBOUNDED,
+}
+DEFAULT_QUEUE_SIZE = 1024
+# After the first, one overflow warning per this many dropped events.
+OVERFLOW_LOG_EVERY = 1000
+
+class Event():
+    """
+    One published message. The same Event object is handed to every
+    subscriber, so handlers must treat `data` as read-only.
+    """
+    __slots__ = ("topic", "key", "data", "published")
+
+    def __init__(self, topic, key, data):
+        self.topic = topic
+        self.key = key
+        self.data = data
+        self.published = time.monotonic()
+
+class Subscription():
+    """
+    A handler with its own bounded queue and dispatch thread, so a slow
+    subscriber only ever delays itself.
+    """
+
+    def __init__(self, topic, handler, keys=None, maxsize=DEFAULT_QUEUE_SIZE, policy=None):
+        self.topic = topic
+        self.handler = handler
+        self.keys = set(keys) if keys is not None else None
+        self.maxsize = maxsize
+        self.policy = policy or DEFAULT_POLICIES.get(topic.split(":")[0], DROP_OLDEST)
+        self._queue = OrderedDict() if self.policy == CONFLATE else deque()
+        self._cond = threading.Condition()
+        self._closed = False
+        self._thread = threading.Thread(target=self._dispatch, daemon=True,
+                name=f"bus-{topic}-{getattr(handler, '__qualname__', 'handler')}")
+
+        self.delivered = 0
+        self.dropped = 0
+        self.overflowed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def wants(self, key):
+        return self.keys is None or key in self.keys
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def put(self, event):
+        with self._cond:
+            if self.policy == CONFLATE:
+                if event.key in self._queue:
+                    del self._queue[event.key]
+                    self.dropped += 1
+                elif len(self._queue) >= self.maxsize:
+                    self._queue.popitem(last=False)
+                    self._overflow()
+                self._queue[event.key] = event
+            elif self.policy == DROP_OLDEST:
+                if len(self._queue) >= self.maxsize:
+                    self._queue.popleft()
+                    self._overflow()
+                self._queue.append(event)
+            elif self.policy == UNBOUNDED:
+                self._queue.append(event)
+            else:
+                while len(self._queue) >= self.maxsize and not self._closed:
+                    self._cond.wait()
+                self._queue.append(event)
+            self._cond.notify_all()
+
+    def _overflow(self):
+        """
+        Counts an event dropped because the queue was full. Called with the
+        lock held.
+        """
+        self.dropped += 1
+        self.overflowed += 1
+        METRICS.counter("bus_overflow_total", topic=self.topic).inc()
+        if (self.overflowed - 1) % OVERFLOW_LOG_EVERY == 0:
+            logger.warning(f"Subscriber {self._thread.name} can't keep up, "
+                    f"{self.overflowed} {self.topic} events dropped so far")
+
+    def _get(self):
+        with self._cond:
+            while not self._queue and not self._closed:
+                self._cond.wait()
+            if not self._queue:
+                return None
+            if self.policy == CONFLATE:
+                _, event = self._queue.popitem(last=False)
+            else:
+                event = self._queue.popleft()
+            self._cond.notify_all()
+            return event
+
+    def _dispatch(self):
+        while True:
+            event = self._get()
+            if event is None:
+                return
+            latency = time.monotonic() - event.published
+            try:
+                self.handler(event.key, event.data)
+            except Exception as e:
+                logger.error(f"Handler for {self.topic} failed with exception: {e}", exc_info=True)
+            self.delivered += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    def depth(self):
+        with self._cond:
+            return len(self._queue)
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+
+    def stats(self):
+        return {
+            "topic" : self.topic,
+            "policy" : self.policy,
+            "depth" : self.depth(),
+            "delivered" : self.delivered,
+            "dropped" : self.dropped,
+            "overflowed" : self.overflowed,
+            "latency_avg" : self.latency_total / self.delivered if self.delivered else 0.0,
+            "latency_max" : self.latency_max,
+        }
+
+class EventBus():
+    """
+    Publish/subscribe hub for market data and fills. Each event is built
+    once and fanned out to every interested subscriber's queue; handlers are
+    called as handler(key, data) on the subscriber's own thread.
+    """
+
+    def __init__(self):
+        self._subscriptions = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, topic, handler, keys=None, maxsize=DEFAULT_QUEUE_SIZE, policy=None):
+        """
+        Subscribes `handler` to `topic`, optionally only for the given keys
+        (symbols). Returns the Subscription.
+        """
+        subscription = Subscription(topic, handler, keys, maxsize, policy).start()
+        with self._lock:
+            # Copy on write so publish never holds the lock.
+            subscriptions = dict(self._subscriptions)
+            subscriptions[topic] = subscriptions.get(topic, ()) + (subscription,)
+            self._subscriptions = subscriptions
+        return subscription
+
+    def unsubscribe(self, subscription):
+        with self._lock:
+            subscriptions = dict(self._subscriptions)
+            subscriptions[subscription.topic] = tuple(
+                s for s in subscriptions.get(subscription.topic, ()) if s is not subscription)
+            self._subscriptions = subscriptions
+        subscription.close()
+
+    def publish(self, topic, key, data):
+        event = Event(topic, key, data)
+        for subscription in self._subscriptions.get(topic, ()):
+            if subscription.wants(key):
+                subscription.put(event)
+        return event
+
+    def attach(self, strat):
+        """
+        Subscribes a strategy's on_quote, on_bar and on_fill callbacks. Quotes
+        and bars are filtered to the strategy's `symbols`, and bars to its
+        `timeframe`; a strategy without symbols only gets fills.
+        """
+        subscriptions = [self.subscribe(TOPIC_FILL, strat.on_fill)]
+        symbols = getattr(strat, "symbols", None)
+        if symbols:
+            subscriptions.append(self.subscribe(TOPIC_QUOTE, strat.on_quote, keys=symbols))
+            timeframe = getattr(strat, "timeframe", None)
+            if timeframe is not None:
+                subscriptions.append(self.subscribe(bar_topic(timeframe), strat.on_bar,
+                        keys=symbols))
+        return subscriptions
+
+    def subscribers(self, topic=None):
+        if topic is not None:
+            return list(self._subscriptions.get(topic, ()))
+        return [s for subs in self._subscriptions.values() for s in subs]
+
+    def stats(self):
+        return [subscription.stats() for subscription in self.subscribers()]
+
+    def close(self):
+        with self._lock:
+            subscriptions = [s for subs in self._subscriptions.values() for s in subs]
+            self._subscriptions = {}
+        for subscription in subscriptions:
+            subscription.close()
+
+class QuoteFeed():
+    """
+    Polls quotes for the union of every subscriber's symbols with one
+    batched request per interval and publishes each quote on the bus, so
+    strategies share a single fetch per tick.
+
+    With a MarketScheduler, polling stops while `market` is closed.
+    """
+
+    def __init__(self, bus, client, symbols, interval=1.0, scheduler=None, market="EQUITY",
+            extended_hours=False):
+        self.bus = bus
+        self.client = client
+        self.symbols = sorted(set(symbols))
+        self.interval = interval
+        self.scheduler = scheduler
+        self.market = market
+        self.extended_hours = extended_hours
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="quote-feed")
+
+    def poll(self):
+        quotes = self.client.get_quote(*self.symbols)
+        for symbol, quote in quotes.items():
+            self.bus.publish(TOPIC_QUOTE, symbol, quote)
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            if self.scheduler is not None and not self.scheduler.is_open(self.market, self.extended_hours):
+                if not self.scheduler.wait_until_open(self._stop, self.market, self.extended_hours):
+                    break
+                next_tick = time.monotonic()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Quote feed poll failed with exception: {e}")
+            next_tick += self.interval
+            self._stop.wait(max(0, next_tick - time.monotonic()))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+class BarFeed():
+    """
+    Publishes each newly completed candle from the candle store. Every
+    interval the store is backfilled once per symbol and only bars newer
+    than the last published one go out on the bus.
+
+    With `timeframes` (e.g. ["5min", "1h", "1d"]) the 1-minute bars are
+    also aggregated into those timeframes as they arrive, and each finished
+    bar is published on bar_topic(timeframe). One minute download serves
+    every frequency.
+
+    With `align` polls happen just after each interval boundary in exchange
+    time (e.g. 9:31:02), so bars go out as soon as they're complete. With a
+    MarketScheduler, polling stops while `market` is closed and, with
+    `warm_up`, the store is backfilled before the open.
+    """
+
+    def __init__(self, bus, client, store, symbols, interval=60.0,
+            frequency_type="minute", frequency=1, timeframes=(), extended_hours=True,
+            align=True, scheduler=None, market="EQUITY", warm_up=True):
+        if timeframes and (frequency_type, frequency) != ("minute", 1):
+            raise ValueError("BarFeed can only resample 1-minute bars")
+        self.bus = bus
+        self.client = client
+        self.store = store
+        self.symbols = sorted(set(symbols))
+        self.interval = interval
+        self.frequency_type = frequency_type
+        self.frequency = frequency
+        # 1-minute bars already go out on TOPIC_BAR as they are.
+        timeframes = dict.fromkeys(parse_timeframe(timeframe) for timeframe in timeframes)
+        self.timeframes = [timeframe for timeframe in timeframes if timeframe != MINUTE]
+        self.extended_hours = extended_hours
+        self.align = align
+        self.scheduler = scheduler
+        self.market = market
+        self._aggregators = {}
+        self._last = {}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="bar-feed")
+        if scheduler is not None and warm_up:
+            scheduler.add_warm_up(self.backfill)
+
+    def backfill(self):
+        """
+        Brings the store up to date for every symbol.
+        """
+        self.store.backfill_many(self.client, self.symbols, frequency_type=self.frequency_type,
+                frequency=self.frequency)
+
+    def _warm_up(self, symbol, last):
+        """
+        Starts the aggregators from the stored minutes since the start of
+        the longest timeframe's current bar (e.g. Monday for weekly bars),
+        so the first resampled bars published are complete.
+        """
+        aggregators = [BarAggregator(timeframe, self.extended_hours)
+                for timeframe in self.timeframes]
+        if aggregators and last:
+            start = min(period_start(last, timeframe) for timeframe in self.timeframes)
+            history = self.store.read(symbol, start=start)
+            for aggregator in aggregators:
+                aggregator.warm_up(history)
+        self._aggregators[symbol] = aggregators
+
+    def poll(self):
+        for symbol in self.symbols:
+            self.store.backfill(self.client, symbol, self.frequency_type, self.frequency)
+            if symbol not in self._last:
+                # History from before the feed started isn't replayed.
+                last = self.store.last_timestamp(symbol, self.frequency_type, self.frequency)
+                self._last[symbol] = last or 0
+                self._warm_up(symbol, last)
+                continue
+            bars = self.store.read(symbol, start=self._last[symbol] + 1,
+                    frequency_type=self.frequency_type, frequency=self.frequency).copy()
+            for bar in bars:
+                self.bus.publish(TOPIC_BAR, symbol, bar)
+                for aggregator in self._aggregators[symbol]:
+                    for resampled in aggregator.update(bar):
+                        self.bus.publish(bar_topic(aggregator.timeframe), symbol, resampled)
+            if len(bars):
+                self._last[symbol] = int(bars["datetime"][-1])
+
+    def active(self):
+        """
+        Whether bars can be arriving: the market is open, or was during the
+        last interval (so the bar finished at the close still goes out).
+        """
+        if self.scheduler is None:
+            return True
+        return (self.scheduler.is_open(self.market, self.extended_hours)
+                or self.scheduler.is_open(self.market, self.extended_hours,
+                        when=time.time() - self.interval))
+
+    def _run(self):
+        next_tick = time.time()
+        while not self._stop.is_set():
+            if not self.active():
+                if not self.scheduler.wait_until_open(self._stop, self.market, self.extended_hours):
+                    break
+                next_tick = time.time()
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Bar feed poll failed with exception: {e}")
+            if self.align:
+                next_tick = next_boundary(self.interval, delay=BAR_SETTLE_DELAY)
+            else:
+                next_tick += self.interval
+            sleep_until(next_tick, self._stop)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
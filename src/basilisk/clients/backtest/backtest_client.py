@@ -0,0 +1,287 @@
+import logging
+import math
+import os
+import sys
+
+import numpy as np
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..", "..", "..", "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+CLIENT_DIR = os.path.join(THISDIR, "..")
+
+for path in [SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from base_client.base_client import LevelOne
+from data.candles import CANDLE_FIELDS, HISTORY_OUTPUTS, CandleArrays
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Bars used for the rolling volatility estimate, and bars per year to
+# annualize it (minute bars over a 6.5 hour session).
+VOLATILITY_WINDOW = 20
+BARS_PER_YEAR = 252 * 390
+
+class Portfolio():
+    """
+    Cash and position ledger for a backtest. Tracks average cost so that
+    realized P&L can be booked on every reducing fill.
+    """
+
+    def __init__(self, cash=100000.0, commission=0.0):
+        self.cash = cash
+        self.commission = commission
+        self.positions = {}
+        self.avg_cost = {}
+        self.realized = 0.0
+        self.fills = []
+
+    def fill(self, time, symbol, quantity, price):
+        """
+        Books a fill. Positive quantities buy, negative sell.
+        """
+        position = self.positions.get(symbol, 0)
+        cost = self.avg_cost.get(symbol, 0.0)
+        if position != 0 and (position > 0) != (quantity > 0):
+            closed = min(abs(quantity), abs(position)) * (1 if position > 0 else -1)
+            self.realized += closed * (price - cost)
+        new_position = position + quantity
+        if new_position == 0:
+            self.avg_cost.pop(symbol, None)
+        elif position == 0 or (position > 0) != (new_position > 0):
+            self.avg_cost[symbol] = price
+        elif (position > 0) == (quantity > 0):
+            self.avg_cost[symbol] = (position * cost + quantity * price) / new_position
+        self.positions[symbol] = new_position
+        self.cash -= quantity * price + self.commission
+        fill = {
+            "time" : time,
+            "symbol" : symbol,
+            "quantity" : quantity,
+            "price" : price,
+            "commission" : self.commission,
+        }
+        self.fills.append(fill)
+        return fill
+
+    def equity(self, prices):
+        """
+        Cash plus positions marked at `prices` (dict of symbol to price).
+        """
+        return self.cash + sum(qty * prices[symbol] for symbol, qty in self.positions.items() if qty)
+
+class BacktestClient(LevelOne):
+    """
+    Client that serves stored candles as if they were live. It exposes the
+    same calls strategies make against TDClient (LevelOne quotes,
+    get_quote, get_price_history) but only ever shows data up to the
+    simulated clock, so strategies can't see the future.
+
+    Orders fill against the simulated market: market orders at the current
+    bid/ask, limit orders on the first later bar that trades through them.
+    """
+
+    provides = ["equity", "backtest"]
+
+    def __init__(self, store, symbols, start=None, end=None, frequency_type="minute",
+            frequency=1, cash=100000.0, spread=0.0, commission=0.0, journal=None):
+        """
+        Args:
+        - store: CandleStore to replay.
+        - symbols: symbols to load.
+        - start, end: replay range in ms since epoch (optional).
+        - spread: quoted bid/ask spread in price units around each close.
+        - journal: data.journal.AuditLog to record orders and fills in.
+        """
+        self.symbols = list(symbols)
+        self.spread = spread
+        self.candles = {}
+        for symbol in self.symbols:
+            records = np.array(store.read(symbol, start=start, end=end,
+                    frequency_type=frequency_type, frequency=frequency))
+            self.candles[symbol] = CandleArrays.from_records(records, symbol=symbol)
+        self.portfolio = Portfolio(cash=cash, commission=commission)
+        self.now = None
+        self._index = {symbol : -1 for symbol in self.symbols}
+        self._pending = []
+        self._order_id = 0
+        self.on_fill = None
+        self.journal = journal
+
+    def attach_journal(self, journal):
+        self.journal = journal
+
+    def timeline(self):
+        """
+        Every bar time across all symbols, sorted.
+        """
+        times = [candles.datetime for candles in self.candles.values()]
+        if not times:
+            return np.empty(0, dtype=np.int64)
+        return np.unique(np.concatenate(times))
+
+    def advance_to(self, time):
+        """
+        Moves the clock to `time` and fills pending limit orders against the
+        bars that just completed. Returns the symbols that have a bar at
+        exactly `time`.
+        """
+        self.now = time
+        updated = []
+        for symbol, candles in self.candles.items():
+            i = int(np.searchsorted(candles.datetime, time, side="right")) - 1
+            if i != self._index[symbol]:
+                self._index[symbol] = i
+                if i >= 0 and candles.datetime[i] == time:
+                    updated.append(symbol)
+        self._match_pending(updated)
+        return updated
+
+    def bar(self, symbol):
+        """
+        The latest completed bar for `symbol` as a dict, or None.
+        """
+        i = self._index[symbol]
+        if i < 0:
+            return None
+        candles = self.candles[symbol]
+        return {field : getattr(candles, field)[i].item() for field in CANDLE_FIELDS}
+
+    ###################################
+    ############# QUOTES ##############
+    ###################################
+
+    def quote(self, symbol):
+        bar = self.bar(symbol)
+        if bar is None:
+            raise KeyError(f"No data for {symbol} at {self.now}")
+        half = self.spread / 2
+        return {
+            "symbol"      : symbol,
+            "bidPrice"    : bar["close"] - half,
+            "askPrice"    : bar["close"] + half,
+            "lastPrice"   : bar["close"],
+            "openPrice"   : bar["open"],
+            "highPrice"   : bar["high"],
+            "lowPrice"    : bar["low"],
+            "closePrice"  : bar["close"],
+            "totalVolume" : bar["volume"],
+            "volatility"  : self.volatility(symbol),
+            "quoteTimeInLong" : bar["datetime"],
+        }
+
+    def volatility(self, symbol):
+        """
+        Annualized volatility of the last VOLATILITY_WINDOW bar returns.
+        """
+        i = self._index[symbol]
+        if i < 2:
+            return math.nan
+        close = self.candles[symbol].close[max(0, i - VOLATILITY_WINDOW):i + 1]
+        returns = np.diff(np.log(close))
+        return float(np.std(returns, ddof=1) * math.sqrt(BARS_PER_YEAR))
+
+    def get_quote(self, *symbols, field=None, max_age=None):
+        data = {symbol : self.quote(symbol) for symbol in symbols}
+        if field:
+            return {symbol : data[symbol][field] for symbol in symbols}
+        return data
+
+    def get_bid_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="bidPrice")
+
+    def get_ask_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="askPrice")
+
+    def get_volatility(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="volatility")
+
+    def get_price_history(self, symbol, period_type="day", period=10,
+            frequency_type="minute", frequency=1, end_date=0, start_date=0,
+            extended_hours=True, output="json"):
+        """
+        Stored candles up to the simulated clock. Only start_date and
+        end_date narrow the range; the frequency is the one loaded.
+        """
+        if output not in HISTORY_OUTPUTS:
+            raise ValueError("Invalid output passed to 'get_price_history'")
+        candles = self.candles[symbol]
+        hi = self._index[symbol] + 1
+        lo = 0
+        if start_date:
+            lo = int(np.searchsorted(candles.datetime[:hi], start_date, side="left"))
+        if end_date:
+            hi = int(np.searchsorted(candles.datetime[:hi], end_date, side="right"))
+        window = CandleArrays(*(getattr(candles, field)[lo:hi] for field in CANDLE_FIELDS),
+                symbol=symbol)
+        if output == "array":
+            return window
+        if output == "frame":
+            return window.to_frame()
+        return {
+            "symbol" : symbol,
+            "empty" : len(window) == 0,
+            "candles" : [dict(zip(CANDLE_FIELDS, row)) for row in window.to_records().tolist()],
+        }
+
+    ###################################
+    ############# ORDERS ##############
+    ###################################
+
+    def place_order(self, symbol, quantity, instruction="BUY", order_type="MARKET", price=None):
+        """
+        Submits a simulated order. Market orders fill immediately at the
+        current ask (buys) or bid (sells); limit orders wait for a bar that
+        trades through `price`. Returns the order id.
+        """
+        if instruction not in ["BUY", "SELL"] or order_type not in ["MARKET", "LIMIT"]:
+            raise ValueError("Invalid argument passed to 'place_order'")
+        if order_type == "LIMIT" and price is None:
+            raise ValueError("Limit orders need a price")
+        self._order_id += 1
+        signed = quantity if instruction == "BUY" else -quantity
+        if self.journal is not None:
+            self.journal.log_order("order", self._order_id, symbol, instruction, order_type,
+                    quantity, math.nan if price is None else price, "WORKING")
+        if order_type == "MARKET":
+            quote = self.quote(symbol)
+            fill_price = quote["askPrice"] if signed > 0 else quote["bidPrice"]
+            self._fill(self._order_id, symbol, signed, fill_price)
+        else:
+            self._pending.append((self._order_id, symbol, signed, price))
+        return self._order_id
+
+    def cancel_order(self, order_id):
+        before = len(self._pending)
+        self._pending = [order for order in self._pending if order[0] != order_id]
+        cancelled = len(self._pending) < before
+        if cancelled and self.journal is not None:
+            self.journal.log_order("cancel", order_id, status="CANCELED")
+        return cancelled
+
+    def _match_pending(self, updated):
+        remaining = []
+        for order in self._pending:
+            order_id, symbol, signed, limit = order
+            if symbol not in updated:
+                remaining.append(order)
+                continue
+            bar = self.bar(symbol)
+            if signed > 0 and bar["low"] <= limit:
+                self._fill(order_id, symbol, signed, min(bar["open"], limit))
+            elif signed < 0 and bar["high"] >= limit:
+                self._fill(order_id, symbol, signed, max(bar["open"], limit))
+            else:
+                remaining.append(order)
+        self._pending = remaining
+
+    def _fill(self, order_id, symbol, signed, price):
+        fill = self.portfolio.fill(self.now, symbol, signed, price)
+        fill["order_id"] = order_id
+        if self.journal is not None:
+            self.journal.log_fill(order_id, symbol, signed, price)
+        if self.on_fill is not None:
+            self.on_fill(order_id, fill)
@@ -0,0 +1,260 @@
+import asyncio
+import logging
+import os
+import sys
+import time
+
+import httpx
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(THISDIR, "..", "..", "..")
+
+for path in [CLIENT_DIR, SRC_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.candles import HISTORY_OUTPUTS, CandlePanel, format_history
+from data.options import CHAIN_OUTPUTS, format_chain
+from td.scheduler import parse_retry_after, priority_for
+from td.td_client import MAX_FUNDAMENTAL_SYMBOLS, MAX_QUOTE_SYMBOLS, TDClient
+from td.transport import (DEFAULT_CONNECT_TIMEOUT, DEFAULT_POOL_MAXSIZE, DEFAULT_READ_TIMEOUT,
+        METRICS, endpoint_for, record_request)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_CONCURRENCY = 16
+
+class AsyncTDClient():
+    """
+    Asyncio version of the TDClient market-data and account calls, built on
+    httpx.AsyncClient. Credentials and tokens are handled by a regular
+    TDClient, so both clients share the same token state, and requests and
+    quotes are recorded in that client's journal.
+
+        async with AsyncTDClient() as client:
+            histories = await client.get_price_history_many(symbols)
+    """
+
+    def __init__(self, client=None, concurrency=DEFAULT_CONCURRENCY,
+            max_connections=DEFAULT_POOL_MAXSIZE, connect_timeout=DEFAULT_CONNECT_TIMEOUT,
+            read_timeout=DEFAULT_READ_TIMEOUT):
+        """
+        Args:
+        - client: the TDClient to take credentials and tokens from. A new one
+            is created if not given.
+        - concurrency: default limit on in-flight requests for `gather`.
+        - max_connections: size of the httpx connection pool.
+        """
+        self.client = client if client is not None else TDClient()
+        self.scheduler = self.client._transport.scheduler
+        self.max_throttle_retries = self.client._transport.max_throttle_retries
+        self.concurrency = concurrency
+        limits = httpx.Limits(max_connections=max_connections,
+                max_keepalive_connections=max_connections)
+        timeout = httpx.Timeout(read_timeout, connect=connect_timeout)
+        self._http = httpx.AsyncClient(limits=limits, timeout=timeout)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        await self._http.aclose()
+
+    async def access_token(self):
+        return await self.client.tokens.access_token_async()
+
+    async def refresh_access_token(self):
+        return await self.client.tokens.refresh_async()
+
+    async def send(self, url, params, headers, priority):
+        """
+        Sends one GET once the shared scheduler lets it through, waiting out
+        and retrying 429 responses.
+        """
+        endpoint = endpoint_for(url)
+        for _ in range(self.max_throttle_retries + 1):
+            queued = time.perf_counter()
+            await self.scheduler.acquire_async(priority)
+            start = time.perf_counter()
+            r = await self._http.get(url, params=params, headers=headers)
+            elapsed = time.perf_counter() - start
+            record_request(endpoint, r.status_code, elapsed, start - queued)
+            journal = self.client.journal
+            if journal is not None:
+                journal.log_request("GET", url, r.status_code, elapsed, priority, len(r.content))
+            if r.status_code != 429:
+                break
+            self.scheduler.throttle(parse_retry_after(r.headers.get("Retry-After")))
+        return r
+
+    async def make_get_request(self, url, params=None, headers=None, priority=None):
+        """
+        Coroutine version of TDClient.make_get_request. Requests draw from the
+        same rate limiter as the TDClient, and a 401 is retried once after
+        refreshing the access token.
+        """
+        if priority is None:
+            priority = priority_for(url)
+        authenticated = headers is None
+        if authenticated:
+            headers = {"Authorization": f"Bearer {await self.access_token()}"}
+        try:
+            r = await self.send(url, params, headers, priority)
+            if r.status_code == 401 and authenticated:
+                logger.info(f"Request to {url} returned 401, refreshing access token and retrying")
+                METRICS.counter("td_retries_total", endpoint=endpoint_for(url), reason="unauthorized").inc()
+                token = await self.refresh_access_token()
+                if token is not None:
+                    headers = {"Authorization": f"Bearer {token}"}
+                    r = await self.send(url, params, headers, priority)
+            r.raise_for_status()
+        except Exception as e:
+            logger.error(f"Request to {url} failed with exception: {e}")
+            raise
+        return r.json()
+
+    async def gather(self, coros, limit=None):
+        """
+        Runs the given coroutines concurrently with at most `limit` (default
+        `self.concurrency`) of them in flight. Results come back in order.
+        """
+        semaphore = asyncio.Semaphore(limit or self.concurrency)
+
+        async def bounded(coro):
+            async with semaphore:
+                return await coro
+
+        return await asyncio.gather(*[bounded(coro) for coro in coros])
+
+    #######################################
+    ############## QUOTES #################
+    #######################################
+
+    def log_quotes(self, data):
+        journal = self.client.journal
+        if journal is not None:
+            for symbol, quote in data.items():
+                journal.log_quote(symbol, quote)
+
+    async def get_quote(self, *symbols, field=None):
+        url = self.client.base_url + "marketdata/quotes"
+        params = {"symbol" : ",".join(symbols)}
+        data = await self.make_get_request(url, params=params)
+        self.log_quotes(data)
+
+        if field:
+            results = {}
+            for symbol in symbols:
+                results[symbol] = data[symbol][field]
+            return results
+
+        return data
+
+    async def get_quotes_many(self, symbols, limit=None, priority=None):
+        """
+        Full quotes for any number of symbols, MAX_QUOTE_SYMBOLS per request
+        with the requests in flight concurrently.
+        """
+        url = self.client.base_url + "marketdata/quotes"
+        chunks = [symbols[i:i + MAX_QUOTE_SYMBOLS] for i in range(0, len(symbols), MAX_QUOTE_SYMBOLS)]
+        responses = await self.gather([self.make_get_request(url,
+                params={"symbol" : ",".join(chunk)}, priority=priority) for chunk in chunks], limit=limit)
+        data = {}
+        for response in responses:
+            data.update(response)
+        self.log_quotes(data)
+        return data
+
+    async def get_fundamentals_many(self, symbols, limit=None, priority=None):
+        """
+        Concurrent version of TDClient.get_fundamentals_many, without the
+        cache.
+        """
+        url = self.client.base_url + "instruments"
+        chunks = [symbols[i:i + MAX_FUNDAMENTAL_SYMBOLS]
+                for i in range(0, len(symbols), MAX_FUNDAMENTAL_SYMBOLS)]
+        responses = await self.gather([self.make_get_request(url,
+                params={"symbol" : ",".join(chunk), "projection" : "fundamental"},
+                priority=priority) for chunk in chunks], limit=limit)
+        data = {}
+        for response in responses:
+            data.update(response)
+        return data
+
+    ###################################
+    ########## PRICE HISTORY ##########
+    ###################################
+
+    async def get_price_history(self, symbol, period_type="day", period=10,
+            frequency_type="minute", frequency=1, end_date=0, start_date=0,
+            extended_hours=True, output="json"):
+        """
+        See TDClient.get_price_history for the meaning of the arguments.
+        """
+        if output not in HISTORY_OUTPUTS:
+            raise ValueError("Invalid output passed to 'get_price_history'")
+        params = TDClient.price_history_params(period_type, period, frequency_type,
+                frequency, end_date, start_date, extended_hours)
+        url = self.client.base_url + f"marketdata/{symbol}/pricehistory"
+        data = await self.make_get_request(url, params=params)
+        return format_history(data, output, symbol=symbol)
+
+    async def get_price_history_many(self, symbols, limit=None, **kwargs):
+        """
+        Fetches price history for every symbol concurrently. Returns a dict
+        mapping each symbol to its history. kwargs are passed through to
+        get_price_history.
+        """
+        histories = await self.gather(
+            [self.get_price_history(symbol, **kwargs) for symbol in symbols], limit=limit)
+        return dict(zip(symbols, histories))
+
+    async def get_price_history_panel(self, symbols, limit=None, **kwargs):
+        """
+        Concurrent version of TDClient.get_price_history_panel.
+        """
+        histories = await self.get_price_history_many(symbols, limit=limit,
+                output="array", **kwargs)
+        return CandlePanel(histories)
+
+    ###################################
+    ######### ACCOUNT INFO ############
+    ###################################
+
+    async def get_account_info(self, positions=True, orders=True):
+        url = self.client.base_url + f"accounts/{self.client._account_id}"
+        params = TDClient.account_info_params(positions, orders)
+        return await self.make_get_request(url, params=params)
+
+    ####################################
+    ############# MOVERS ###############
+    ####################################
+
+    async def get_movers(self, market, direction="up", change="value"):
+        url = self.client.base_url + f"marketdata/{market}/movers"
+        params = TDClient.movers_params(direction, change)
+        return await self.make_get_request(url, params=params)
+
+    ####################################
+    ######### OPTION CHAINS ############
+    ####################################
+
+    async def get_option_chain(self, symbol, contract_type="ALL", strike_count=None,
+            include_quotes=False, strategy="SINGLE", interval=None, strike=None,
+            option_range="ALL", from_date=None, to_date=None, exp_month="ALL",
+            option_type="ALL", output="json", **kwargs):
+        """
+        See TDClient.get_option_chain.
+        """
+        if output not in CHAIN_OUTPUTS:
+            raise ValueError("Invalid output passed to 'get_option_chain'")
+        params = TDClient.option_chain_params(symbol, contract_type, strike_count, include_quotes,
+                strategy, interval, strike, option_range, from_date, to_date, exp_month,
+                option_type, **kwargs)
+        data = await self.make_get_request(self.client.base_url + "marketdata/chains", params=params)
+        return format_chain(data, output)
@@ -0,0 +1,141 @@
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+DAY_IN_SEC = 86400
+
+# How old a cached value may be before it's fetched again, unless the caller
+# passes an explicit max_age. Live prices aren't cached by default; data that
+# only changes daily is kept for the day.
+FIELD_TTLS = {
+    "bidPrice"   : 0,
+    "bidSize"    : 0,
+    "askPrice"   : 0,
+    "askSize"    : 0,
+    "highPrice"  : 0,
+    "lowPrice"   : 0,
+    "openPrice"  : 3600,
+    "closePrice" : 3600,
+    "volatility" : 60,
+    "52WkHigh"   : DAY_IN_SEC,
+    "52WkLow"    : DAY_IN_SEC,
+}
+DEFAULT_QUOTE_TTL = 0
+
+ENDPOINT_TTLS = {
+    "quotes"       : DEFAULT_QUOTE_TTL,
+    "fundamentals" : DAY_IN_SEC,
+}
+
+DEFAULT_MAX_BYTES = 64 * 1024 * 1024
+
+def approx_size(value):
+    """
+    Rough memory footprint of a decoded JSON value. Good enough to keep the
+    cache under its cap without the cost of measuring exactly.
+    """
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        for k, v in value.items():
+            size += sys.getsizeof(k) + approx_size(v)
+    elif isinstance(value, list):
+        for v in value:
+            size += approx_size(v)
+    return size
+
+class Entry():
+    __slots__ = ("value", "stored_at", "size")
+
+    def __init__(self, value, stored_at, size):
+        self.value = value
+        self.stored_at = stored_at
+        self.size = size
+
+class TTLCache():
+    """
+    Thread-safe LRU cache capped by approximate memory use. Entries carry the
+    time they were stored so each read can decide how stale is too stale.
+    Keys are (endpoint, symbol) tuples.
+    """
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def get(self, key, max_age):
+        """
+        Returns the cached value if it is at most `max_age` seconds old,
+        else None.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.monotonic() - entry.stored_at > max_age:
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry.value
+
+    def put(self, key, value):
+        entry = Entry(value, time.monotonic(), approx_size(value))
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.size -= old.size
+            self._entries[key] = entry
+            self.size += entry.size
+            while self.size > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= evicted.size
+                self.evictions += 1
+
+    def age(self, key):
+        """
+        Seconds since `key` was stored, or None if it isn't cached.
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            return time.monotonic() - entry.stored_at
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries" : len(self._entries),
+                "bytes" : self.size,
+                "hits" : self.hits,
+                "misses" : self.misses,
+                "expired" : self.expired,
+                "evictions" : self.evictions,
+                "hit_rate" : self.hits / lookups if lookups else 0.0,
+            }
+
+def quote_max_age(field=None, max_age=None):
+    """
+    Staleness budget for a quote read: the caller's max_age if given,
+    otherwise the field's TTL.
+    """
+    if max_age is not None:
+        return max_age
+    if field is None:
+        return DEFAULT_QUOTE_TTL
+    return FIELD_TTLS.get(field, DEFAULT_QUOTE_TTL)
@@ -0,0 +1,127 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_WINDOW = 0.005
+
+class Batch():
+    """
+    Symbols collected during one coalescing window and the result of the
+    single request that fetches them.
+    """
+
+    def __init__(self):
+        self.symbols = set()
+        self.done = threading.Event()
+        self.quotes = None
+        self.error = None
+
+class QuoteCoalescer():
+    """
+    Merges quote requests from many callers into as few marketdata/quotes
+    calls as possible.
+
+    The first caller in a window becomes the leader: it waits `window`
+    seconds for other callers to add their symbols, then sends one batched
+    request for all of them. Everyone in the window shares the response and
+    gets back only the symbols they asked for.
+
+    Inside a `tick()` block the fetched quotes are also kept until the block
+    exits, so every strategy asking about a symbol during the same tick
+    reuses one quote. The StrategyRunner runs each strategy tick in one,
+    after a `prefetch` of the strategy's symbols; strategies ticking at the
+    same moment share that prefetch request too.
+    """
+
+    def __init__(self, fetch, window=DEFAULT_WINDOW):
+        """
+        Args:
+        - fetch: callable taking a list of symbols and returning a dict of
+            symbol to quote. It is expected to do its own chunking.
+        - window: seconds the leader waits for more symbols before sending.
+        """
+        self.fetch = fetch
+        self.window = window
+        self._lock = threading.Lock()
+        self._batch = None
+        self._tick_depth = 0
+        self._tick_quotes = {}
+
+        self.requests = 0
+        self.batches = 0
+
+    @contextmanager
+    def tick(self):
+        """
+        Keeps quotes fetched inside the block for the rest of the block.
+        Ticks can nest and overlap between threads; the quotes are dropped
+        once the last one exits.
+        """
+        with self._lock:
+            self._tick_depth += 1
+        try:
+            yield self
+        finally:
+            with self._lock:
+                self._tick_depth -= 1
+                if self._tick_depth == 0:
+                    self._tick_quotes = {}
+
+    def prefetch(self, symbols):
+        """
+        Fetches every symbol a tick is going to need in one go. Always
+        fetches, since overlapping ticks can keep older quotes around.
+        """
+        self.get(symbols, refresh=True)
+
+    def get(self, symbols, refresh=False):
+        """
+        Returns a dict of symbol to quote for the requested symbols. With
+        `refresh` quotes kept for the tick aren't used.
+        """
+        symbols = list(symbols)
+        with self._lock:
+            self.requests += 1
+            cached = {} if refresh else {s : self._tick_quotes[s] for s in symbols
+                    if s in self._tick_quotes}
+            missing = [s for s in symbols if s not in cached]
+            if not missing:
+                return cached
+
+            batch = self._batch
+            leader = batch is None
+            if leader:
+                batch = self._batch = Batch()
+            batch.symbols.update(missing)
+
+        if leader:
+            self._flush(batch)
+        else:
+            batch.done.wait()
+
+        if batch.error is not None:
+            raise batch.error
+        cached.update({s : batch.quotes[s] for s in missing if s in batch.quotes})
+        return cached
+
+    def _flush(self, batch):
+        if self.window:
+            time.sleep(self.window)
+        with self._lock:
+            # Close the window so later callers start a new batch.
+            self._batch = None
+            symbols = sorted(batch.symbols)
+        try:
+            batch.quotes = self.fetch(symbols)
+            with self._lock:
+                self.batches += 1
+                if self._tick_depth:
+                    self._tick_quotes.update(batch.quotes)
+        except Exception as e:
+            batch.error = e
+        finally:
+            batch.done.set()
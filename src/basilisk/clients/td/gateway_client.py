@@ -0,0 +1,325 @@
+import itertools
+import logging
+import marshal
+import os
+import socket
+import struct
+import sys
+import threading
+from concurrent.futures import Future, TimeoutError
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..", "..", "..", "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+CLIENT_DIR = os.path.join(THISDIR, "..")
+RUN_DIR = os.path.join(BASE_DIR, "run")
+
+for path in [SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from base_client.base_client import LevelOne
+from data.candles import CandlePanel, format_history
+from data.options import format_chain
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_SOCKET_PATH = os.path.join(RUN_DIR, "gateway.sock")
+DEFAULT_TIMEOUT = 60.0
+
+### Wire protocol
+#
+# Every message is a 9 byte header (payload length, request id, kind)
+# followed by a marshal encoded payload: C speed, compact, and it can only
+# produce plain values, never objects. marshal's format depends on the
+# Python version, so HELLO checks both ends use the same one.
+
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct("<IIB")
+MAX_PAYLOAD = 256 * 1024 * 1024
+
+HELLO = 1     # client -> gateway: {"protocol", "marshal", "python", "name"}; echoed back
+CALL = 2      # client -> gateway: (method, args, kwargs)
+RESULT = 3    # gateway -> client: return value
+ERROR = 4     # gateway -> client: (exception type name, message)
+STATS = 5     # client -> gateway: None; answered with RESULT
+
+# Client methods the gateway runs for its sessions. Orders stay with
+# each session's own client, which keeps the order book they update.
+GATEWAY_METHODS = [
+    "get_quote",
+    "fetch_quotes",
+    "get_fundamentals",
+    "get_fundamentals_many",
+    "get_price_history",
+    "get_movers",
+    "get_option_chain",
+    "get_market_hours",
+    "get_markets_hours",
+    "get_account_info",
+    "get_user_principals",
+    "get_account_type",
+]
+
+class GatewayError(Exception):
+    """
+    The gateway couldn't be reached, or the call failed there. `kind` is
+    the name of the exception the gateway's client raised, if any.
+    """
+
+    def __init__(self, message, kind=None):
+        super().__init__(message)
+        self.kind = kind
+
+def hello_payload(name=None):
+    return {
+        "protocol" : PROTOCOL_VERSION,
+        "marshal" : marshal.version,
+        "python" : list(sys.version_info[:2]),
+        "name" : name,
+    }
+
+def compatible(hello):
+    ours = hello_payload()
+    return all(hello.get(key) == ours[key] for key in ("protocol", "marshal", "python"))
+
+def send_frame(sock, request_id, kind, payload):
+    body = marshal.dumps(payload)
+    sock.sendall(HEADER.pack(len(body), request_id, kind) + body)
+
+def recv_exact(sock, n):
+    buf = bytearray(n)
+    view = memoryview(buf)
+    got = 0
+    while got < n:
+        read = sock.recv_into(view[got:], n - got)
+        if read == 0:
+            raise ConnectionError("Gateway connection closed")
+        got += read
+    return buf
+
+def recv_frame(sock):
+    """
+    Reads one message. Returns (request_id, kind, payload).
+    """
+    length, request_id, kind = HEADER.unpack(recv_exact(sock, HEADER.size))
+    if length > MAX_PAYLOAD:
+        raise ConnectionError(f"Gateway message of {length} bytes is too large")
+    return request_id, kind, marshal.loads(recv_exact(sock, length))
+
+class GatewayClient(LevelOne):
+    """
+    Client for a market data gateway (src/basilisk/gateway.py) running on
+    this host. Calls go over one Unix socket shared by every thread of the
+    session; the gateway's own TDClient makes the requests, so every
+    session shares its connections, rate limit budget, tokens and caches.
+
+    It has the market data and account methods of TDClient. To use it in a
+    session, list td.gateway_client.GatewayClient in the CLIENTS section
+    instead of td.td_client.TDClient.
+
+    Args:
+    - socket_path: the gateway's socket.
+    - name: how this session shows up in the gateway's log.
+    - timeout: seconds to wait for any one call.
+    """
+
+    provides = ["equity"]
+
+    def __init__(self, socket_path=DEFAULT_SOCKET_PATH, name=None, timeout=DEFAULT_TIMEOUT):
+        self.socket_path = socket_path
+        self.name = name or f"session-{os.getpid()}"
+        self.timeout = timeout
+        self._sock = None
+        self._pending = {}
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._send_lock = threading.Lock()
+
+    def _connect(self):
+        """
+        Opens the connection and starts its reader thread. Called with
+        self._lock held.
+        """
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(self.socket_path)
+            send_frame(sock, 0, HELLO, hello_payload(self.name))
+            _, kind, reply = recv_frame(sock)
+        except OSError as e:
+            sock.close()
+            raise GatewayError(f"Can't connect to gateway at {self.socket_path}: {e}")
+        if kind != HELLO:
+            sock.close()
+            raise GatewayError(f"Gateway refused the session: {reply[1] if kind == ERROR else reply}")
+        self._sock = sock
+        threading.Thread(target=self._read, args=(sock,), daemon=True,
+                name="gateway-reader").start()
+        logger.info(f"Connected to gateway at {self.socket_path}")
+        return sock
+
+    def _read(self, sock):
+        """
+        Hands each response to the call waiting for it. If the connection
+        drops every waiting call fails, and the next call reconnects.
+        """
+        try:
+            while True:
+                request_id, kind, payload = recv_frame(sock)
+                with self._lock:
+                    future = self._pending.pop(request_id, None)
+                if future is None:
+                    continue
+                if kind == RESULT:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(GatewayError(payload[1], kind=payload[0]))
+        except (OSError, ValueError, EOFError) as e:
+            with self._lock:
+                if self._sock is sock:
+                    self._sock = None
+                pending, self._pending = self._pending, {}
+            sock.close()
+            for future in pending.values():
+                future.set_exception(GatewayError(f"Lost connection to gateway: {e}"))
+
+    def _request(self, kind, payload):
+        future = Future()
+        with self._lock:
+            sock = self._sock or self._connect()
+            request_id = next(self._ids)
+            self._pending[request_id] = future
+        try:
+            with self._send_lock:
+                send_frame(sock, request_id, kind, payload)
+        except OSError as e:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise GatewayError(f"Lost connection to gateway: {e}")
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._pending.pop(request_id, None)
+            raise GatewayError(f"Gateway didn't answer within {self.timeout}s")
+
+    def call(self, method, *args, **kwargs):
+        """
+        Runs client method `method` on the gateway and returns its result.
+        """
+        if method not in GATEWAY_METHODS:
+            raise ValueError(f"The gateway doesn't serve '{method}'")
+        return self._request(CALL, (method, args, kwargs))
+
+    def stats(self):
+        """
+        The gateway's counters: sessions, calls, deduplicated calls and its
+        caches.
+        """
+        return self._request(STATS, None)
+
+    def close(self):
+        with self._lock:
+            sock, self._sock = self._sock, None
+        if sock is not None:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            sock.close()
+
+    ### Quotes
+
+    def get_quote(self, *symbols, field=None, max_age=None):
+        return self.call("get_quote", *symbols, field=field, max_age=max_age)
+
+    def fetch_quotes(self, symbols, priority=None):
+        return self.call("fetch_quotes", list(symbols), priority=priority)
+
+    def get_bid_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="bidPrice", max_age=max_age)
+
+    def get_bid_size(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="bidSize", max_age=max_age)
+
+    def get_ask_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="askPrice", max_age=max_age)
+
+    def get_ask_size(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="askSize", max_age=max_age)
+
+    def get_open_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="openPrice", max_age=max_age)
+
+    def get_high_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="highPrice", max_age=max_age)
+
+    def get_low_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="lowPrice", max_age=max_age)
+
+    def get_close_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="closePrice", max_age=max_age)
+
+    def get_volatility(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="volatility", max_age=max_age)
+
+    def get_high_52(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="52WkHigh", max_age=max_age)
+
+    def get_low_52(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="52WkLow", max_age=max_age)
+
+    def get_fundamentals(self, symbol, max_age=None):
+        return self.call("get_fundamentals", symbol, max_age=max_age)
+
+    def get_fundamentals_many(self, symbols, max_age=None, priority=None):
+        return self.call("get_fundamentals_many", list(symbols), max_age=max_age,
+                priority=priority)
+
+    ### Price history, movers and chains
+    #
+    # The gateway always sends the raw response; arrays and frames are
+    # built here, so the wire only carries plain values.
+
+    def get_price_history(self, symbol, output="json", **kwargs):
+        data = self.call("get_price_history", symbol, **kwargs)
+        return format_history(data, output, symbol=symbol)
+
+    def get_price_history_panel(self, symbols, **kwargs):
+        histories = {}
+        for symbol in symbols:
+            histories[symbol] = self.get_price_history(symbol, output="array", **kwargs)
+        return CandlePanel(histories)
+
+    def get_movers(self, market, direction="up", change="value"):
+        return self.call("get_movers", market, direction=direction, change=change)
+
+    def get_option_chain(self, symbol, output="json", **kwargs):
+        data = self.call("get_option_chain", symbol, **kwargs)
+        return format_chain(data, output)
+
+    ### Market hours
+    #
+    # Dates go over the wire as yyyy-MM-dd strings.
+
+    def get_market_hours(self, market, date):
+        if hasattr(date, "strftime"):
+            date = date.strftime("%Y-%m-%d")
+        return self.call("get_market_hours", market, date)
+
+    def get_markets_hours(self, markets, date):
+        if hasattr(date, "strftime"):
+            date = date.strftime("%Y-%m-%d")
+        return self.call("get_markets_hours", list(markets), date)
+
+    ### Account info
+
+    def get_account_info(self, positions=True, orders=True):
+        return self.call("get_account_info", positions=positions, orders=orders)
+
+    def get_user_principals(self, fields="streamerSubscriptionKeys,streamerConnectionInfo"):
+        return self.call("get_user_principals", fields=fields)
+
+    def get_account_type(self):
+        return self.call("get_account_type")
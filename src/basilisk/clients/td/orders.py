@@ -0,0 +1,497 @@
+import logging
+import math
+import os
+import threading
+import time
+import xml.etree.ElementTree as ET
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+INSTRUCTIONS = ["BUY", "SELL", "BUY_TO_COVER", "SELL_SHORT"]
+ORDER_TYPES = ["MARKET", "LIMIT", "STOP", "STOP_LIMIT"]
+DURATIONS = ["DAY", "GOOD_TILL_CANCEL", "FILL_OR_KILL"]
+SESSIONS = ["NORMAL", "AM", "PM", "SEAMLESS"]
+
+# Order statuses the API reports. Orders in a terminal status never change
+# again, so late or out of order updates for them are ignored.
+OPEN_STATUSES = ["AWAITING_PARENT_ORDER", "AWAITING_CONDITION", "AWAITING_MANUAL_REVIEW",
+        "ACCEPTED", "AWAITING_UR_OUT", "PENDING_ACTIVATION", "QUEUED", "WORKING",
+        "PENDING_CANCEL", "PENDING_REPLACE"]
+TERMINAL_STATUSES = ["REJECTED", "CANCELED", "REPLACED", "FILLED", "EXPIRED"]
+# Local statuses: built but not sent yet, and sent without a definite answer
+# (timeout, dropped connection), which has to be reconciled before retrying.
+NEW = "NEW"
+UNKNOWN = "UNKNOWN"
+
+CLIENT_ID_PREFIX = "bsk-"
+
+# ACCT_ACTIVITY message types and the status each one moves an order to.
+ACTIVITY_STATUSES = {
+    "OrderEntryRequest" : "ACCEPTED",
+    "OrderRoute" : "WORKING",
+    "OrderActivation" : "WORKING",
+    "OrderCancelRequest" : "PENDING_CANCEL",
+    "OrderCancelReplaceRequest" : "PENDING_REPLACE",
+    "UROUT" : "CANCELED",
+    "OrderRejection" : "REJECTED",
+    "TooLateToCancel" : "WORKING",
+}
+FILL_MESSAGES = ["OrderFill", "OrderPartialFill"]
+
+class OrderError(Exception):
+    pass
+
+class RiskError(OrderError):
+    pass
+
+def new_client_order_id():
+    """
+    Random id to tag an order with before it's sent. TD doesn't take client
+    ids, so they only live in the local OrderBook; reusing one makes a retry
+    return the order already placed instead of sending a second one.
+    """
+    return CLIENT_ID_PREFIX + os.urandom(8).hex()
+
+def order_spec(symbol, quantity, instruction="BUY", order_type="MARKET", price=None,
+        stop_price=None, duration="DAY", session="NORMAL", asset_type="EQUITY"):
+    """
+    Builds the JSON body for a single leg order.
+    """
+    valid = instruction in INSTRUCTIONS and order_type in ORDER_TYPES
+    valid &= duration in DURATIONS and session in SESSIONS
+    valid &= quantity > 0
+    valid &= (price is not None) == (order_type in ["LIMIT", "STOP_LIMIT"])
+    valid &= (stop_price is not None) == (order_type in ["STOP", "STOP_LIMIT"])
+    if not valid:
+        raise ValueError("Invalid arguments passed to 'order_spec'")
+    spec = {
+        "orderType" : order_type,
+        "session" : session,
+        "duration" : duration,
+        "orderStrategyType" : "SINGLE",
+        "orderLegCollection" : [{
+            "instruction" : instruction,
+            "quantity" : quantity,
+            "instrument" : {"symbol" : symbol, "assetType" : asset_type},
+        }],
+    }
+    if price is not None:
+        spec["price"] = f"{price:.2f}" if price >= 1 else f"{price:.4f}"
+    if stop_price is not None:
+        spec["stopPrice"] = f"{stop_price:.2f}" if stop_price >= 1 else f"{stop_price:.4f}"
+    return spec
+
+def signed(instruction, quantity):
+    return quantity if instruction in ("BUY", "BUY_TO_COVER") else -quantity
+
+def order_id_from_location(location):
+    """
+    The API answers order placement with 201 and no body; the new order's id
+    is the last part of the Location header.
+    """
+    if not location:
+        return None
+    return location.rstrip("/").rsplit("/", 1)[-1]
+
+class Order():
+    """
+    Local view of one order. `order_id` is the broker's id, None until the
+    placement response arrives.
+    """
+    __slots__ = ("client_order_id", "order_id", "symbol", "instruction", "quantity",
+            "order_type", "price", "stop_price", "spec", "status", "filled", "fill_cost",
+            "submitted", "updated", "replaces", "replaced_by")
+
+    def __init__(self, client_order_id, spec):
+        leg = spec["orderLegCollection"][0]
+        self.client_order_id = client_order_id
+        self.order_id = None
+        self.symbol = leg["instrument"]["symbol"]
+        self.instruction = leg["instruction"]
+        self.quantity = float(leg["quantity"])
+        self.order_type = spec["orderType"]
+        self.price = float(spec["price"]) if "price" in spec else None
+        self.stop_price = float(spec["stopPrice"]) if "stopPrice" in spec else None
+        self.spec = spec
+        self.status = NEW
+        self.filled = 0.0
+        self.fill_cost = 0.0
+        self.submitted = None
+        self.updated = time.time()
+        self.replaces = None
+        self.replaced_by = None
+
+    @property
+    def signed_quantity(self):
+        return signed(self.instruction, self.quantity)
+
+    @property
+    def remaining(self):
+        return self.quantity - self.filled
+
+    @property
+    def average_price(self):
+        return self.fill_cost / self.filled if self.filled else math.nan
+
+    @property
+    def is_open(self):
+        return self.status not in TERMINAL_STATUSES
+
+    def to_dict(self):
+        return {name : getattr(self, name) for name in self.__slots__ if name != "spec"}
+
+class OrderBook():
+    """
+    In-memory order and position state for one account, updated from order
+    responses, the ACCT_ACTIVITY stream and account snapshots, so strategies
+    can check orders and positions without polling accounts/{id}.
+
+    Besides the orders themselves it keeps running totals the risk checks
+    need (open quantity per symbol, open orders), so a check is a few dict
+    lookups rather than a scan over every order.
+    """
+
+    def __init__(self):
+        self.orders = {}
+        self.by_order_id = {}
+        self.positions = {}
+        self.avg_cost = {}
+        self.open_quantity = {}
+        self.open_orders = 0
+        self.on_fill = None
+        self.on_status = None
+        self._lock = threading.RLock()
+
+    def get(self, order_id):
+        """
+        Looks an order up by client order id or broker order id.
+        """
+        order = self.orders.get(order_id)
+        if order is None:
+            order = self.by_order_id.get(str(order_id))
+        return order
+
+    def position(self, symbol):
+        return self.positions.get(symbol, 0.0)
+
+    def open_for(self, symbol=None):
+        with self._lock:
+            return [order for order in self.orders.values()
+                    if order.is_open and (symbol is None or order.symbol == symbol)]
+
+    def _track_open(self, order, sign):
+        self.open_quantity[order.symbol] = (self.open_quantity.get(order.symbol, 0.0)
+                + sign * signed(order.instruction, order.remaining))
+        self.open_orders += sign
+
+    def add(self, order):
+        """
+        Registers an order about to be sent. Its quantity counts as open
+        from now on, so orders in flight are part of the risk checks.
+        """
+        with self._lock:
+            if order.client_order_id in self.orders:
+                raise OrderError(f"Duplicate client order id {order.client_order_id}")
+            self.orders[order.client_order_id] = order
+            self._track_open(order, 1)
+
+    def reserve(self, order, risk=None, replacing=None):
+        """
+        Risk checks `order` (if a RiskChecker is given) and adds it, holding
+        the lock across both so concurrent orders can't each pass a limit
+        that only one of them fits in.
+        """
+        with self._lock:
+            if risk is not None:
+                risk.check(order, replacing)
+            self.add(order)
+
+    def discard(self, order):
+        """
+        Drops an order that was reserved but never sent.
+        """
+        with self._lock:
+            if self.orders.pop(order.client_order_id, None) is not None and order.is_open:
+                self._track_open(order, -1)
+
+    def set_order_id(self, order, order_id):
+        with self._lock:
+            order.order_id = str(order_id)
+            self.by_order_id[order.order_id] = order
+
+    def update_status(self, order, status):
+        """
+        Moves an order to `status`. Returns False if the order was already
+        terminal and the update was dropped.
+        """
+        with self._lock:
+            if not order.is_open:
+                if status != order.status:
+                    logger.info(f"Ignoring {status} for {order.order_id}, already {order.status}")
+                return False
+            if status in TERMINAL_STATUSES:
+                self._track_open(order, -1)
+            order.status = status
+            order.updated = time.time()
+        if self.on_status is not None:
+            self.on_status(order)
+        return True
+
+    def fill(self, order, quantity, price):
+        """
+        Books a (partial) fill on an order and its position.
+        """
+        with self._lock:
+            quantity = min(quantity, order.remaining)
+            if quantity <= 0:
+                return
+            delta = signed(order.instruction, quantity)
+            order.filled += quantity
+            order.fill_cost += quantity * price
+            if order.is_open:
+                self.open_quantity[order.symbol] -= delta
+            self._book_position(order.symbol, delta, price)
+            if order.filled >= order.quantity and order.is_open:
+                self.update_status(order, "FILLED")
+        if self.on_fill is not None:
+            self.on_fill(order, quantity, price)
+
+    def _book_position(self, symbol, delta, price):
+        position = self.positions.get(symbol, 0.0)
+        new_position = position + delta
+        if new_position == 0:
+            self.avg_cost.pop(symbol, None)
+        elif position == 0 or (position > 0) != (new_position > 0):
+            self.avg_cost[symbol] = price
+        elif (position > 0) == (delta > 0):
+            cost = self.avg_cost.get(symbol, price)
+            self.avg_cost[symbol] = (position * cost + delta * price) / new_position
+        self.positions[symbol] = new_position
+
+    def apply_order(self, data):
+        """
+        Updates the book from an order as the REST API returns it (from
+        get_order, get_orders or an account snapshot). Orders placed
+        elsewhere are added. OCO and TRIGGER orders go through
+        single_orders first. Fills are taken from filledQuantity, booked at
+        the order's average execution price.
+        """
+        order_id = str(data["orderId"])
+        with self._lock:
+            order = self.by_order_id.get(order_id)
+            if order is None:
+                order = Order(f"{CLIENT_ID_PREFIX}{order_id}", data)
+                order.status = "WORKING"
+                self.add(order)
+                self.set_order_id(order, order_id)
+            filled = float(data.get("filledQuantity", 0.0))
+            if filled > order.filled:
+                self.fill(order, filled - order.filled, execution_price(data, order))
+            status = data.get("status")
+            if status and status != order.status:
+                self.update_status(order, status)
+        return order
+
+    def sync(self, account):
+        """
+        Applies the orders in an accounts/{id} snapshot (fields=
+        positions,orders), then replaces positions with the snapshot's,
+        which already include every fill.
+        """
+        info = account.get("securitiesAccount", account)
+        with self._lock:
+            for strategy in info.get("orderStrategies", []):
+                for data in single_orders(strategy):
+                    try:
+                        self.apply_order(data)
+                    except (KeyError, TypeError, ValueError) as e:
+                        # One order we can't read mustn't cost us the rest of the snapshot.
+                        logger.error(f"Skipping unreadable order {data.get('orderId')}: {e!r}")
+            if "positions" in info:
+                self.positions = {}
+                self.avg_cost = {}
+                for position in info["positions"]:
+                    symbol = position["instrument"]["symbol"]
+                    quantity = position.get("longQuantity", 0.0) - position.get("shortQuantity", 0.0)
+                    if quantity:
+                        self.positions[symbol] = quantity
+                        self.avg_cost[symbol] = position.get("averagePrice", 0.0)
+
+    def apply_activity(self, message_type, body):
+        """
+        Applies one ACCT_ACTIVITY stream message (its type and XML body).
+        Returns the order it touched, or None.
+        """
+        if message_type not in ACTIVITY_STATUSES and message_type not in FILL_MESSAGES:
+            return None
+        fields = parse_activity(body)
+        order_id = fields.get("OrderKey")
+        order = self.by_order_id.get(order_id) if order_id else None
+        if order is None:
+            return None
+        if message_type in FILL_MESSAGES:
+            quantity = float(fields.get("Quantity", 0.0))
+            price = float(fields.get("ExecutionPrice", "nan"))
+            self.fill(order, quantity, price)
+        else:
+            self.update_status(order, ACTIVITY_STATUSES[message_type])
+        return order
+
+def execution_price(data, order):
+    """
+    Average fill price of a REST order, from its execution legs when present.
+    """
+    quantity = 0.0
+    cost = 0.0
+    for activity in data.get("orderActivityCollection", []):
+        for leg in activity.get("executionLegs", []):
+            quantity += leg.get("quantity", 0.0)
+            cost += leg.get("quantity", 0.0) * leg.get("price", 0.0)
+    if quantity:
+        return cost / quantity
+    if order.price is not None:
+        return order.price
+    return float(data.get("price", math.nan))
+
+def single_orders(data):
+    """
+    Yields the orders with legs in a REST order: the order itself if it
+    has an orderLegCollection, then those in its childOrderStrategies. An
+    OCO order has no legs of its own, only children; a TRIGGER order (and
+    so a bracket) has both.
+    """
+    if data.get("orderLegCollection"):
+        yield data
+    for child in data.get("childOrderStrategies", []):
+        yield from single_orders(child)
+
+def same_order(order, data):
+    """
+    Whether a REST order has the same leg, type and prices as `order`.
+    """
+    legs = data.get("orderLegCollection", [])
+    if len(legs) != 1:
+        return False
+    leg = legs[0]
+    prices_match = all(
+        (mine is None and data.get(field) is None)
+        or (mine is not None and data.get(field) is not None and abs(float(data[field]) - mine) < 1e-6)
+        for mine, field in [(order.price, "price"), (order.stop_price, "stopPrice")])
+    return (leg.get("instrument", {}).get("symbol") == order.symbol
+            and leg.get("instruction") == order.instruction
+            and float(leg.get("quantity", 0.0)) == order.quantity
+            and data.get("orderType") == order.order_type
+            and prices_match)
+
+def parse_entered_time(value):
+    """
+    Parses an order's enteredTime, e.g. "2021-01-15T14:30:00+0000".
+    """
+    if not value:
+        return None
+    try:
+        return datetime.strptime(value, "%Y-%m-%dT%H:%M:%S%z")
+    except ValueError:
+        return None
+
+def parse_activity(body):
+    """
+    Flattens an ACCT_ACTIVITY XML message to {tag: text} for its leaf
+    elements, dropping namespaces. Where a tag repeats the first one wins,
+    except that a fill's ExecutionInformation overrides the order's own
+    fields (its Quantity is the fill size, not the order size).
+    """
+    fields = {}
+    try:
+        root = ET.fromstring(body)
+    except ET.ParseError:
+        logger.error("Could not parse account activity message")
+        return fields
+    for element in root.iter():
+        if len(element):
+            continue
+        tag = element.tag.rsplit("}", 1)[-1]
+        fields.setdefault(tag, (element.text or "").strip())
+    for element in root.iter():
+        if element.tag.rsplit("}", 1)[-1] == "ExecutionInformation":
+            for child in element:
+                fields[child.tag.rsplit("}", 1)[-1]] = (child.text or "").strip()
+    return fields
+
+class RiskLimits():
+    """
+    Pre-trade limits. Any limit left as None isn't checked.
+
+    Args:
+    - max_order_quantity: most shares in one order.
+    - max_order_notional: most quantity * price in one order.
+    - max_position: largest absolute position per symbol, counting fills
+        and every open order as if it filled.
+    - max_open_orders: most orders open at once.
+    - price_band: largest fraction a limit price may be away from the
+        reference price (e.g. 0.05), to catch fat fingered prices.
+    - symbols: if given, the only symbols that may be traded.
+    """
+
+    def __init__(self, max_order_quantity=None, max_order_notional=None, max_position=None,
+            max_open_orders=None, price_band=None, symbols=None):
+        self.max_order_quantity = max_order_quantity
+        self.max_order_notional = max_order_notional
+        self.max_position = max_position
+        self.max_open_orders = max_open_orders
+        self.price_band = price_band
+        self.symbols = set(symbols) if symbols is not None else None
+
+class RiskChecker():
+    """
+    Checks an order against RiskLimits and the OrderBook before it's sent.
+    Everything it needs is held in memory, so a check costs a few
+    microseconds and never touches the network.
+
+    `price_source(symbol)` gives a reference price (e.g. the last cached
+    quote) for market orders and the price band, or None if it has none.
+    """
+
+    def __init__(self, limits, book, price_source=None):
+        self.limits = limits
+        self.book = book
+        self.price_source = price_source
+
+    def check(self, order, replacing=None):
+        """
+        Raises RiskError if `order` breaks a limit. When it replaces an open
+        order, that order's remaining quantity no longer counts.
+        """
+        limits = self.limits
+        symbol = order.symbol
+        open_orders = self.book.open_orders
+        open_quantity = self.book.open_quantity.get(symbol, 0.0)
+        if replacing is not None and replacing.is_open:
+            open_orders -= 1
+            open_quantity -= signed(replacing.instruction, replacing.remaining)
+        if limits.symbols is not None and symbol not in limits.symbols:
+            raise RiskError(f"{symbol} is not in the tradable symbols")
+        if limits.max_order_quantity is not None and order.quantity > limits.max_order_quantity:
+            raise RiskError(f"Order quantity {order.quantity} over {limits.max_order_quantity}")
+        if limits.max_open_orders is not None and open_orders >= limits.max_open_orders:
+            raise RiskError(f"Already {open_orders} open orders")
+        if limits.max_position is not None:
+            projected = self.book.positions.get(symbol, 0.0) + open_quantity + order.signed_quantity
+            if abs(projected) > limits.max_position:
+                raise RiskError(f"{symbol} position would reach {projected}")
+        if limits.max_order_notional is None and limits.price_band is None:
+            return
+        reference = self.price_source(symbol) if self.price_source is not None else None
+        price = order.price if order.price is not None else order.stop_price
+        if price is None:
+            price = reference
+        if limits.max_order_notional is not None:
+            if price is None:
+                raise RiskError(f"No price to check the notional of a {symbol} market order")
+            if order.quantity * price > limits.max_order_notional:
+                raise RiskError(f"Order notional {order.quantity * price:.2f} over {limits.max_order_notional}")
+        if limits.price_band is not None and order.price is not None and reference:
+            if abs(order.price - reference) > limits.price_band * reference:
+                raise RiskError(f"Limit {order.price} too far from {symbol} reference {reference}")
@@ -0,0 +1,212 @@
+import asyncio
+import heapq
+import itertools
+import logging
+import threading
+import time
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# TD Ameritrade allows 120 requests per minute per application.
+DEFAULT_RATE = 120
+DEFAULT_PERIOD = 60
+
+# Priority lanes. Lower values are served first.
+PRIORITY_HIGH = 0
+PRIORITY_NORMAL = 1
+PRIORITY_LOW = 2
+LANES = {
+    PRIORITY_HIGH : "high",
+    PRIORITY_NORMAL : "normal",
+    PRIORITY_LOW : "low",
+}
+
+# How often async waiters that aren't at the head of the queue check again.
+ASYNC_POLL_INTERVAL = 0.01
+
+def priority_for(url):
+    """
+    Picks a lane from the endpoint. Orders, account and auth calls go first,
+    bulk price history goes last.
+    """
+    if "accounts" in url or "oauth2" in url:
+        return PRIORITY_HIGH
+    if "pricehistory" in url:
+        return PRIORITY_LOW
+    return PRIORITY_NORMAL
+
+def parse_retry_after(value):
+    """
+    Returns the number of seconds a Retry-After header asks us to wait.
+    The header can be either a number of seconds or an HTTP date.
+    """
+    if value is None:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class RequestScheduler():
+    """
+    Token-bucket rate limiter with priority lanes. Callers take a token with
+    `acquire` (threads) or `acquire_async` (asyncio) before sending a request.
+    Waiters are served by lane, then first come first served within a lane.
+
+    When the server answers 429 call `throttle` with the Retry-After value;
+    nobody is let through until it has passed.
+    """
+
+    def __init__(self, rate=DEFAULT_RATE, period=DEFAULT_PERIOD, burst=None):
+        """
+        Args:
+        - rate: number of requests allowed per `period` seconds.
+        - burst: bucket size. Defaults to a tenth of `rate` so a full minute's
+            budget can't be spent in one burst.
+        """
+        self.fill_rate = rate / period
+        self.capacity = burst if burst is not None else max(1, rate // 10)
+        self._tokens = float(self.capacity)
+        self._last_fill = time.monotonic()
+        self._blocked_until = 0.0
+        self._waiters = []
+        self._counter = itertools.count()
+        self._cond = threading.Condition()
+
+        self.granted = 0
+        self.throttled = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+
+    def _refill(self, now):
+        elapsed = now - self._last_fill
+        self._tokens = min(self.capacity, self._tokens + elapsed * self.fill_rate)
+        self._last_fill = now
+
+    def _try_acquire(self, ticket):
+        """
+        Must be called with the lock held. Takes a token for `ticket` if it is
+        at the head of the queue and one is available. Returns 0 on success,
+        otherwise the number of seconds to wait before trying again (None if
+        we can't tell and have to wait to be woken up).
+        """
+        now = time.monotonic()
+        if self._waiters[0] != ticket:
+            return None
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            heapq.heappop(self._waiters)
+            self._cond.notify_all()
+            return 0
+        return (1 - self._tokens) / self.fill_rate
+
+    def _enqueue(self, priority):
+        ticket = (priority, next(self._counter))
+        heapq.heappush(self._waiters, ticket)
+        return ticket
+
+    def _dequeue(self, ticket):
+        self._waiters.remove(ticket)
+        heapq.heapify(self._waiters)
+        self._cond.notify_all()
+
+    def _record_wait(self, waited):
+        self.granted += 1
+        self.wait_time_total += waited
+        self.wait_time_max = max(self.wait_time_max, waited)
+
+    def acquire(self, priority=PRIORITY_NORMAL):
+        """
+        Blocks the calling thread until a request may be sent.
+        Returns the time spent waiting in seconds.
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(priority)
+            try:
+                while True:
+                    delay = self._try_acquire(ticket)
+                    if delay == 0:
+                        break
+                    self._cond.wait(delay)
+            except BaseException:
+                if ticket in self._waiters:
+                    self._dequeue(ticket)
+                raise
+            waited = time.monotonic() - start
+            self._record_wait(waited)
+        return waited
+
+    async def acquire_async(self, priority=PRIORITY_NORMAL):
+        """
+        Coroutine version of `acquire`. Never blocks the event loop for longer
+        than it takes to check the bucket.
+        """
+        start = time.monotonic()
+        with self._cond:
+            ticket = self._enqueue(priority)
+        try:
+            while True:
+                with self._cond:
+                    delay = self._try_acquire(ticket)
+                    if delay == 0:
+                        waited = time.monotonic() - start
+                        self._record_wait(waited)
+                        return waited
+                await asyncio.sleep(ASYNC_POLL_INTERVAL if delay is None else delay)
+        except BaseException:
+            with self._cond:
+                if ticket in self._waiters:
+                    self._dequeue(ticket)
+            raise
+
+    def throttle(self, retry_after=None):
+        """
+        Called when the server rate limits us. Empties the bucket and holds
+        every lane until `retry_after` seconds have passed (or one token's
+        worth of time if the server didn't say).
+        """
+        if retry_after is None:
+            retry_after = 1 / self.fill_rate
+        logger.info(f"Rate limited by server, pausing requests for {retry_after:.2f}s")
+        with self._cond:
+            now = time.monotonic()
+            self.throttled += 1
+            self._tokens = 0.0
+            self._last_fill = now
+            self._blocked_until = max(self._blocked_until, now + retry_after)
+            self._cond.notify_all()
+
+    def queue_depth(self):
+        """
+        Returns the number of waiting callers in each lane.
+        """
+        with self._cond:
+            depth = {name : 0 for name in LANES.values()}
+            for priority, _ in self._waiters:
+                depth[LANES[priority]] += 1
+        return depth
+
+    def stats(self):
+        with self._cond:
+            granted = self.granted
+            return {
+                "queue_depth" : self.queue_depth(),
+                "granted" : granted,
+                "throttled" : self.throttled,
+                "wait_time_total" : self.wait_time_total,
+                "wait_time_max" : self.wait_time_max,
+                "wait_time_avg" : self.wait_time_total / granted if granted else 0.0,
+            }
+
+# Shared by every client in the process so they all draw from one budget.
+SCHEDULER = RequestScheduler()
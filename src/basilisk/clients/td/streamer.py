@@ -0,0 +1,380 @@
+import asyncio
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+from urllib.parse import urlencode
+
+import numpy as np
+import websockets
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.join(THISDIR, "..")
+
+if CLIENT_DIR not in sys.path:
+    sys.path.append(CLIENT_DIR)
+
+from base_client.base_client import LevelOne
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Level one equity fields we subscribe to, keyed by streamer field number and
+# named after the matching REST quote field.
+QUOTE_FIELDS = {
+    1  : "bidPrice",
+    2  : "askPrice",
+    3  : "lastPrice",
+    4  : "bidSize",
+    5  : "askSize",
+    8  : "totalVolume",
+    12 : "highPrice",
+    13 : "lowPrice",
+    15 : "closePrice",
+    24 : "volatility",
+    28 : "openPrice",
+    30 : "52WkHigh",
+    31 : "52WkLow",
+}
+BOOK_FIELDS = list(QUOTE_FIELDS.values()) + ["updated"]
+FIELD_COLUMNS = {name : i for i, name in enumerate(BOOK_FIELDS)}
+STREAM_COLUMNS = {str(number) : FIELD_COLUMNS[name] for number, name in QUOTE_FIELDS.items()}
+
+DEFAULT_CAPACITY = 256
+DEFAULT_FIRST_QUOTE_TIMEOUT = 5
+RECONNECT_DELAY = 1
+
+class LevelOneBook():
+    """
+    Top-of-book table backed by a single float64 array with one row per
+    symbol and one column per field in BOOK_FIELDS. Fields we haven't seen
+    yet are NaN. `updated` holds the local time of the row's last update.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY):
+        self.values = np.full((capacity, len(BOOK_FIELDS)), np.nan)
+        self.rows = {}
+        self._lock = threading.Lock()
+        self._updated = threading.Condition(self._lock)
+        self._waiting = 0
+
+    def row(self, symbol):
+        """
+        Returns the row for `symbol`, adding one if needed.
+        """
+        row = self.rows.get(symbol)
+        if row is not None:
+            return row
+        with self._lock:
+            if symbol not in self.rows:
+                if len(self.rows) == len(self.values):
+                    grown = np.full((2 * len(self.values), len(BOOK_FIELDS)), np.nan)
+                    grown[:len(self.values)] = self.values
+                    self.values = grown
+                self.rows[symbol] = len(self.rows)
+            return self.rows[symbol]
+
+    def update(self, symbol, content):
+        """
+        Applies one streamer content entry, e.g. {"key": "AAPL", "1": 1.5}.
+        """
+        row = self.row(symbol)
+        # Under the lock, so a write can't land in the old array while row()
+        # is growing it.
+        with self._updated:
+            values = self.values
+            for key, value in content.items():
+                column = STREAM_COLUMNS.get(key)
+                if column is not None:
+                    values[row, column] = value
+            values[row, FIELD_COLUMNS["updated"]] = time.time()
+            if self._waiting:
+                self._updated.notify_all()
+
+    def get(self, symbols, field):
+        column = FIELD_COLUMNS[field]
+        values = self.values
+        return {symbol : float(values[self.rows[symbol], column]) for symbol in symbols}
+
+    def has_data(self, symbol):
+        row = self.rows.get(symbol)
+        return row is not None and not np.isnan(self.values[row, FIELD_COLUMNS["updated"]])
+
+    def wait_for(self, symbols, timeout):
+        """
+        Blocks until every symbol has had at least one update. Returns False
+        on timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self._updated:
+            self._waiting += 1
+            try:
+                while not all(self.has_data(symbol) for symbol in symbols):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return False
+                    self._updated.wait(remaining)
+            finally:
+                self._waiting -= 1
+        return True
+
+class TDStreamer(LevelOne):
+    """
+    Streaming LevelOne client. Keeps one websocket subscription to the TD
+    streamer open on a background thread and writes every quote update into
+    a LevelOneBook, so reads never touch the network.
+
+        streamer = TDStreamer(TDClient()).start("AAPL", "MSFT")
+        streamer.get_bid_price("AAPL")
+
+    Reads for symbols that aren't subscribed yet subscribe them and wait up
+    to `first_quote_timeout` seconds for the first update.
+    """
+
+    provides = ["equity", "stream"]
+
+    def __init__(self, client=None, url=None, principals=None,
+            first_quote_timeout=DEFAULT_FIRST_QUOTE_TIMEOUT, bus=None, journal=None, orders=None):
+        """
+        Args:
+        - client: TDClient used to look up the streamer url and login
+            credentials.
+        - url: websocket url to connect to instead of the one in the user
+            principals, e.g. a local fake stream server.
+        - principals: user principals response to log in with. Fetched from
+            `client` when not given.
+        - bus: EventBus to publish each quote update on, as a dict of the
+            changed fields.
+        - journal: data.journal.AuditLog to record every quote update in,
+            as the full top of book after the update.
+        - orders: td.orders.OrderBook to keep current from the account
+            activity stream (fills, cancels, rejections). Usually the
+            client's `orders`.
+        """
+        self.client = client
+        self.url = url
+        self.principals = principals
+        self.first_quote_timeout = first_quote_timeout
+        self.book = LevelOneBook()
+        self.bus = bus
+        self.journal = journal
+        self.orders = orders
+        self.symbols = []
+        self._request_id = 0
+        self._loop = None
+        self._thread = None
+        self._websocket = None
+        self._connected = threading.Event()
+        self._stopping = False
+
+    ###################################
+    ########### CONNECTION ############
+    ###################################
+
+    def start(self, *symbols, timeout=10):
+        """
+        Connects, logs in and subscribes to `symbols`. Returns self.
+        """
+        for symbol in symbols:
+            if symbol not in self.symbols:
+                self.symbols.append(symbol)
+                self.book.row(symbol)
+        if self.principals is None and self.client is not None:
+            self.principals = self.client.get_user_principals()
+        if self.url is None:
+            info = self.principals["streamerInfo"]
+            self.url = f"wss://{info['streamerSocketUrl']}/ws"
+
+        self._stopping = False
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        if not self._connected.wait(timeout):
+            # Don't leave the thread reconnecting in the background.
+            self.stop()
+            raise ConnectionError(f"Could not connect to streamer at {self.url}")
+        return self
+
+    def stop(self):
+        self._stopping = True
+        if self._loop is not None and self._websocket is not None:
+            asyncio.run_coroutine_threadsafe(self._websocket.close(), self._loop)
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._stream())
+        self._loop.close()
+
+    async def _stream(self):
+        """
+        Reads messages until stopped, reconnecting and resubscribing if the
+        connection drops.
+        """
+        while not self._stopping:
+            try:
+                async with websockets.connect(self.url) as websocket:
+                    self._websocket = websocket
+                    if self._stopping:
+                        break
+                    await websocket.send(json.dumps(self.login_request()))
+                    if self.symbols:
+                        await websocket.send(json.dumps(self.subs_request(self.symbols)))
+                    if self.orders is not None:
+                        await websocket.send(json.dumps(self.activity_request()))
+                    async for message in websocket:
+                        try:
+                            self.handle_message(json.loads(message))
+                        except (KeyError, TypeError, ValueError) as e:
+                            # One malformed message mustn't end the stream
+                            # (json.JSONDecodeError is a ValueError).
+                            logger.error(f"Skipping streamer message that failed with "
+                                    f"{type(e).__name__}: {e}")
+            except (OSError, websockets.WebSocketException) as e:
+                if self._stopping:
+                    break
+                logger.error(f"Streamer connection failed with exception: {e}")
+            finally:
+                self._websocket = None
+                self._connected.clear()
+            if not self._stopping:
+                await asyncio.sleep(RECONNECT_DELAY)
+
+    def handle_message(self, message):
+        for response in message.get("response", []):
+            if response.get("command") == "LOGIN":
+                if response["content"]["code"] == 0:
+                    self._connected.set()
+                else:
+                    logger.error(f"Streamer login failed: {response['content']}")
+        for data in message.get("data", []):
+            if data.get("service") == "QUOTE":
+                for content in data["content"]:
+                    self.book.update(content["key"], content)
+                    if self.journal is not None:
+                        row = self.book.values[self.book.rows[content["key"]]]
+                        self.journal.log_quote(content["key"], dict(zip(BOOK_FIELDS, row)))
+                    if self.bus is not None:
+                        quote = {QUOTE_FIELDS[int(k)] : v for k, v in content.items()
+                                if k.isdigit() and int(k) in QUOTE_FIELDS}
+                        self.bus.publish("quote", content["key"], quote)
+            elif data.get("service") == "ACCT_ACTIVITY" and self.orders is not None:
+                for content in data["content"]:
+                    # Field 1 is the account, 2 the message type and 3 the XML
+                    # message body.
+                    self.orders.apply_activity(content.get("2"), content.get("3", ""))
+
+    ###################################
+    ############ REQUESTS #############
+    ###################################
+
+    def next_request_id(self):
+        self._request_id += 1
+        return str(self._request_id)
+
+    def request(self, service, command, parameters):
+        info = self.principals["streamerInfo"] if self.principals else {}
+        account = self.principals["accounts"][0]["accountId"] if self.principals else ""
+        return {"requests" : [{
+            "service"    : service,
+            "requestid"  : self.next_request_id(),
+            "command"    : command,
+            "account"    : account,
+            "source"     : info.get("appId", ""),
+            "parameters" : parameters,
+        }]}
+
+    def login_request(self):
+        """
+        Builds the ADMIN LOGIN request from the user principals.
+        """
+        if not self.principals:
+            return self.request("ADMIN", "LOGIN", {"credential" : "", "token" : "", "version" : "1.0"})
+        info = self.principals["streamerInfo"]
+        account = self.principals["accounts"][0]
+        token_time = datetime.strptime(info["tokenTimestamp"], "%Y-%m-%dT%H:%M:%S%z")
+        credentials = {
+            "userid"      : account["accountId"],
+            "token"       : info["token"],
+            "company"     : account["company"],
+            "segment"     : account["segment"],
+            "cddomain"    : account["accountCdDomainId"],
+            "usergroup"   : info["userGroup"],
+            "accesslevel" : info["accessLevel"],
+            "authorized"  : "Y",
+            "timestamp"   : int(token_time.timestamp() * 1000),
+            "appid"       : info["appId"],
+            "acl"         : info["acl"],
+        }
+        return self.request("ADMIN", "LOGIN", {
+            "credential" : urlencode(credentials),
+            "token"      : info["token"],
+            "version"    : "1.0",
+        })
+
+    def subs_request(self, symbols):
+        fields = ",".join(str(number) for number in [0] + list(QUOTE_FIELDS))
+        return self.request("QUOTE", "SUBS", {"keys" : ",".join(symbols), "fields" : fields})
+
+    def activity_request(self):
+        """
+        Subscribes to order and fill messages for the account. The key is
+        the principals' streamer subscription key; a fake stream server
+        takes any.
+        """
+        keys = (self.principals or {}).get("streamerSubscriptionKeys", {}).get("keys", [])
+        key = keys[0]["key"] if keys else ""
+        return self.request("ACCT_ACTIVITY", "SUBS", {"keys" : key, "fields" : "0,1,2,3"})
+
+    def subscribe(self, *symbols):
+        """
+        Adds symbols to the subscription. SUBS replaces the previous key
+        list, so the full list is sent each time.
+        """
+        new = [symbol for symbol in symbols if symbol not in self.symbols]
+        if not new:
+            return
+        for symbol in new:
+            self.symbols.append(symbol)
+            self.book.row(symbol)
+        websocket = self._websocket
+        if websocket is not None:
+            request = json.dumps(self.subs_request(self.symbols))
+            asyncio.run_coroutine_threadsafe(websocket.send(request), self._loop).result()
+
+    ###################################
+    ############ LEVEL ONE ############
+    ###################################
+
+    def get_field(self, symbols, field):
+        """
+        Returns a dict of symbol to the latest streamed value of `field`.
+        """
+        missing = [symbol for symbol in symbols if not self.book.has_data(symbol)]
+        if missing:
+            self.subscribe(*missing)
+            if not self.book.wait_for(missing, self.first_quote_timeout):
+                logger.error(f"No streamed quote for {missing} yet")
+        return self.book.get(symbols, field)
+
+    def get_bid_price(self, *symbols):
+        return self.get_field(symbols, "bidPrice")
+
+    def get_bid_size(self, *symbols):
+        return self.get_field(symbols, "bidSize")
+
+    def get_ask_price(self, *symbols):
+        return self.get_field(symbols, "askPrice")
+
+    def get_ask_size(self, *symbols):
+        return self.get_field(symbols, "askSize")
+
+    def get_last_price(self, *symbols):
+        return self.get_field(symbols, "lastPrice")
+
+    def get_volatility(self, *symbols):
+        return self.get_field(symbols, "volatility")
@@ -1,10 +1,14 @@
 import configparser
 import json
 import logging
+import math
 import os
-import requests
 import sys
 import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+
+import requests
 
 THISDIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.join(THISDIR, "..", "..", "..", "..")
@@ -18,7 +22,16 @@ for path in [SRC_DIR, CLIENT_DIR, DATA_DIR]:
         sys.path.append(path)
 
 from base_client.base_client import LevelOne
-from data.tokens import TokensEndpoint
+from data.candles import HISTORY_OUTPUTS, CandlePanel, format_history
+from data.options import CHAIN_OUTPUTS, format_chain
+from td.cache import ENDPOINT_TTLS, TTLCache, quote_max_age
+from td.coalescer import QuoteCoalescer
+from td.orders import (NEW, UNKNOWN, Order, OrderBook, OrderError, RiskChecker,
+        new_client_order_id, order_id_from_location, order_spec, parse_entered_time, same_order,
+        signed)
+from td.scheduler import PRIORITY_HIGH, PRIORITY_LOW
+from td.token_manager import TokenManager
+from td.transport import METRICS, Transport, endpoint_for
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -26,6 +39,36 @@ logger.setLevel(logging.INFO)
 BASE_URL = "https://api.tdameritrade.com/v1/"
 AUTH_URL = BASE_URL + "oauth2/"
 
+# Most symbols we put in a single marketdata/quotes or instruments request.
+MAX_QUOTE_SYMBOLS = 500
+MAX_FUNDAMENTAL_SYMBOLS = 500
+
+MARKETS = ["EQUITY", "OPTION", "FUTURE", "FOREX", "BOND"]
+TRANSACTION_TYPES = ["ALL", "TRADE", "BUY_ONLY", "SELL_ONLY", "CASH_IN_OR_CASH_OUT", "CHECKING",
+        "DIVIDEND", "INTEREST", "OTHER", "ADVISOR_FEES"]
+OPTION_STRATEGIES = ["SINGLE", "ANALYTICAL", "COVERED", "VERTICAL", "CALENDAR", "STRANGLE",
+        "STRADDLE", "BUTTERFLY", "CONDOR", "DIAGONAL", "COLLAR", "ROLL"]
+OPTION_MONTHS = ["ALL", "JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT",
+        "NOV", "DEC"]
+# How old a cached quote can be to serve as the risk check reference price.
+REFERENCE_PRICE_MAX_AGE = 60
+# Most orders place_orders sends at once.
+MAX_BATCH_WORKERS = 8
+# How far either side of an ambiguous submission reconcile_order looks.
+RECONCILE_WINDOW = 60
+# Days of transactions get_transactions asks for per request, and how far
+# back it goes by default (the API serves at most a year per request).
+TRANSACTION_WINDOW_DAYS = 30
+TRANSACTION_HISTORY_DAYS = 365
+
+# get_option_chain keyword arguments for the ANALYTICAL strategy.
+ANALYTICAL_PARAMS = {
+    "volatility" : "volatility",
+    "underlying_price" : "underlyingPrice",
+    "interest_rate" : "interestRate",
+    "days_to_expiration" : "daysToExpiration",
+}
+
 class TokenError(Exception):
     pass
 
@@ -33,14 +76,60 @@ class TDClient(LevelOne):
     
     provides = ["equity"]
 
-    def __init__(self):
+    def __init__(self, transport=None, coalesce_window=None, cache=None, journal=None,
+            base_url=BASE_URL, risk_limits=None, **transport_kwargs):
+        """
+        Args:
+        - transport: an existing Transport to share with other clients. If not
+            given a new pooled one is created. Each client sends its own
+            tokens with every request, so clients with different credentials
+            can share one.
+        - coalesce_window: if set, quote requests arriving within this many
+            seconds of each other are merged into one batched request.
+        - cache: TTLCache for quotes and fundamentals. A default sized one is
+            created if not given; pass False to disable caching.
+        - journal: data.journal.AuditLog to record every request sent and
+            every quote received.
+        - base_url: API root to send requests to, e.g. a local mock server.
+        - risk_limits: td.orders.RiskLimits every order is checked against
+            before it's sent.
+        - transport_kwargs: passed to Transport (pool_connections, pool_maxsize,
+            connect_timeout, read_timeout, scheduler, max_throttle_retries).
+        """
+        self.base_url = base_url
+        self.auth_url = base_url + "oauth2/"
         credentials = self.get_credentials_info()
         self._client_id = credentials["CLIENT_ID"]
         self._redirect_uri = credentials["REDIRECT_URI"]
         self._account_id = credentials["ACCOUNT_ID"]
-        self._refresh_token = None
-        self._access_token = None
-        self._access_end = None
+        self.tokens = TokenManager("td", self.request_access_token)
+        if transport is None:
+            transport = Transport(**transport_kwargs)
+        self._transport = transport
+        self.journal = None
+        if journal is not None:
+            self.attach_journal(journal)
+        if cache is None:
+            cache = TTLCache()
+        self.cache = cache or None
+        self.coalescer = None
+        if coalesce_window is not None:
+            self.coalescer = QuoteCoalescer(self.fetch_quotes, window=coalesce_window)
+        self.orders = OrderBook()
+        self.orders.on_fill = self._order_filled
+        self.orders.on_status = self._order_status
+        self.on_fill = None
+        self.risk = None
+        if risk_limits is not None:
+            self.risk = RiskChecker(risk_limits, self.orders, self.reference_price)
+        self._order_pool = None
+
+    def attach_journal(self, journal):
+        """
+        Starts recording requests and quotes to `journal`.
+        """
+        self.journal = journal
+        self._transport.journal = journal
 
     @staticmethod
     def get_credentials_info():
@@ -67,89 +156,50 @@ class TDClient(LevelOne):
             "access_type"   : "offline",
             "client_id"     : self._client_id + "@AMER.OAUTHAP"
         }
-        response = self.make_post_request(AUTH_URL + "token", data=payload)
+        response = self.make_post_request(self.auth_url + "token", data=payload)
         new_refresh_token = response["refresh_token"]
         expires_in = response["expires_in"]
         safe_expiration = self.calc_refresh_end(expires_in)
-        data = {
-            "auth_token" : new_refresh_token,
-            "auth_token_end" : safe_expiration
-        }
 
-        # Update local version
-        self._refresh_token = new_refresh_token
-
-        if TokensEndpoint.update("td", data):
+        # Update local version and DB
+        if self.tokens.store_refresh_token(new_refresh_token, safe_expiration):
             print("Refreshing DB succeeded")
         else:
             print("Failed to update DB with new refresh token")
             return None
 
-        return self._refresh_token
+        return new_refresh_token
 
-    def refresh_access_token(self):
+    def request_access_token(self, refresh_token):
         """
-        Requests a new access token. If the request succeeds we update
-        the local access token as well as the DB fields.
-        Returns the token on success.
-        Returns None if request fails.
+        Requests a new access token from the API. Returns the token and the
+        time it should be considered expired. Storing it is left to the
+        token manager.
         """
-        refresh_token = self.refresh_token()
         payload = {
             "grant_type"    : "refresh_token",
             "refresh_token" : refresh_token,
             "client_id"     : self._client_id + "@AMER.OAUTHAP"
         }
-        response = self.make_post_request(AUTH_URL + "token", data=payload)
-        new_access_token = response["access_token"]
-        expires_in = response["expires_in"]
-        safe_expiration = self.calc_access_end(expires_in)
-        data = {
-            "session_token" : new_access_token,
-            "session_token_end"  : safe_expiration,
-        }
-     
-        # Update local version
-        self._access_token = new_access_token
-        self._access_end = safe_expiration
-
-        # Update DB with new token.
-        if TokensEndpoint.update("td", data):
-            print("Refreshing access token succeeded.")
-        else:
-            print("Refreshing access token failed.")
-            return None
+        response = self.make_post_request(self.auth_url + "token", data=payload)
+        return response["access_token"], self.calc_access_end(response["expires_in"])
 
-        return self._access_token
+    def refresh_access_token(self):
+        """
+        Requests a new access token. If the request succeeds the token
+        manager updates the local access token as well as the DB fields.
+        Concurrent callers share a single refresh.
+        Returns the token on success.
+        Returns None if request fails.
+        """
+        return self.tokens.refresh()
 
     def access_token(self):
         """
-        Returns the access token. Uses the locally cached version if it
-        exists and is fresh, else gets it from the DB.
+        Returns the access token. Uses the in-memory version if it is fresh,
+        else the DB one, else requests a new one.
         """
-        current_time = round(time.time())
-        # If local access token exists and is fresh use it
-        if self._access_token is not None:
-            if self._access_end is not None and self._access_end > current_time:
-                return self._access_token
-        # Otherwise check the DB
-        else:
-            row = TokensEndpoint.get("td")
-            access_token = row.session_token
-            access_end = row.session_token_end
-            # Values may be null if this is the first time we're starting the DB?
-            # Get a fresh access token
-            if (access_token == "null" or access_end == "null" or
-                access_token is None or access_end is None):
-                return self.refresh_access_token()
-
-            # If the DB token is stale request a new one
-            if access_end < current_time:
-                return self.refresh_access_token()
-
-            self._access_token = access_token
-            self._access_end = access_end
-            return self._access_token
+        return self.tokens.access_token()
 
     def refresh_token(self):
         """
@@ -158,17 +208,7 @@ class TDClient(LevelOne):
         TODO: We should have a check of some kind to check whether the token
         is stale or not.
         """
-        if self._refresh_token is not None:
-            return self._refresh_token
-        else:
-            try:
-                token = TokensEndpoint.get("td").auth_token
-                self._refresh_token = token
-                return token
-            except:
-                print("Failed to fetch refresh token")
-                return None
-
+        return self.tokens.refresh_token()
 
     @staticmethod
     def calc_access_end(lifetime):
@@ -206,49 +246,80 @@ class TDClient(LevelOne):
     ######### INSTRUMENT DATA #############
     #######################################
 
-    def make_get_request(self, url, params=None, headers=None):
+    def token_sources(self):
+        """
+        This client's token provider and refresher, passed with each request
+        rather than set on the transport, which may be shared.
+        """
+        return {"token_provider" : self.access_token, "token_refresher" : self.refresh_access_token}
+
+    def make_get_request(self, url, params=None, headers=None, priority=None):
         """
         Basic method for making a GET request to the TD Ameritrade API.
+        Unless explicit headers are given the request is authenticated with
+        the access token, and a 401 is retried once after a token refresh.
+        `priority` overrides the rate limiter lane picked from the url.
         """
-        if headers is None:
-            headers = {"Authorization": f"Bearer {self.access_token()}"}
         try:
-            r = requests.get(url, headers=headers, params=params)
+            r = self._transport.get(url, params=params, headers=headers,
+                    authenticated=headers is None, priority=priority, **self.token_sources())
             r.raise_for_status()
         except Exception as e:
             logger.error(f"Request to {url} failed with exception: {e}")
-            # TODO: consider handling this by tryint refresh_access_token() before raising
             raise
-        response_data = r.json()
+        with METRICS.span("td_json_decode_seconds", endpoint=endpoint_for(url)):
+            response_data = r.json()
         return response_data
 
-    def make_post_request(self, url, data=None, headers=None):
+    def make_post_request(self, url, data=None, headers=None, priority=None):
         """
         Basic method for making a POST request.
         """
         try:
-            r = requests.post(url, data=data)
+            r = self._transport.post(url, data=data, headers=headers, priority=priority)
             r.raise_for_status()
         except Exception as e:
             logger.error(f"Request to {url} failed with exception: {e}")
             raise
-        response_data = r.json()
+        with METRICS.span("td_json_decode_seconds", endpoint=endpoint_for(url)):
+            response_data = r.json()
         return response_data
 
     #######################################
     ############## QUOTES #################
     #######################################
 
-    def get_quote(self, *symbols, field=None):
+    def get_quote(self, *symbols, field=None, max_age=None):
         """
         Gets quote info for one or more symbols.
         If a specific field (i.e. bid price, ask price, volatility, etc)
         is needed, a dict mapping of symbols to their fields is returned.
         Otherwise all quote info is returned.
+        Quotes at most `max_age` seconds old are served from the cache; by
+        default the budget is the field's TTL (see cache.FIELD_TTLS).
+        Requests go through the coalescer when one is configured.
         """
-        url = BASE_URL + "marketdata/quotes" 
-        params = {"symbol" : ",".join(symbols)}
-        data = self.make_get_request(url, params=params)
+        max_age = quote_max_age(field, max_age)
+        data = {}
+        if self.cache is not None and max_age > 0:
+            for symbol in symbols:
+                quote = self.cache.get(("quotes", symbol), max_age)
+                if quote is not None:
+                    data[symbol] = quote
+
+        missing = [symbol for symbol in symbols if symbol not in data]
+        if self.cache is not None and max_age > 0:
+            METRICS.counter("td_cache_hits_total", endpoint="quotes").inc(len(data))
+            METRICS.counter("td_cache_misses_total", endpoint="quotes").inc(len(missing))
+        if missing:
+            if self.coalescer is not None:
+                fetched = self.coalescer.get(missing)
+            else:
+                fetched = self.fetch_quotes(missing)
+            if self.cache is not None:
+                for symbol, quote in fetched.items():
+                    self.cache.put(("quotes", symbol), quote)
+            data.update(fetched)
 
         if field:
             results = {}
@@ -258,46 +329,111 @@ class TDClient(LevelOne):
 
         return data
 
-    def get_bid_price(self, *symbols):
-        return self.get_quote(*symbols, field="bidPrice")
+    def fetch_quotes(self, symbols, priority=None):
+        """
+        Fetches full quotes for any number of symbols, split into requests of
+        at most MAX_QUOTE_SYMBOLS symbols each.
+        """
+        url = self.base_url + "marketdata/quotes"
+        data = {}
+        for i in range(0, len(symbols), MAX_QUOTE_SYMBOLS):
+            chunk = symbols[i:i + MAX_QUOTE_SYMBOLS]
+            params = {"symbol" : ",".join(chunk)}
+            data.update(self.make_get_request(url, params=params, priority=priority))
+        if self.journal is not None:
+            for symbol, quote in data.items():
+                self.journal.log_quote(symbol, quote)
+        return data
+
+    def get_bid_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="bidPrice", max_age=max_age)
 
-    def get_bid_size(self, *symbols):
-        return self.get_quote(*symbols, field="bidSize")
+    def get_bid_size(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="bidSize", max_age=max_age)
 
-    def get_ask_price(self, *symbols):
-        return self.get_quote(*symbols, field="askPrice")
+    def get_ask_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="askPrice", max_age=max_age)
 
-    def get_ask_size(self, *symbols):
-        return self.get_quote(*symbols, field="askSize")
+    def get_ask_size(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="askSize", max_age=max_age)
 
-    def get_open_price(self, *symbols):
-        return self.get_quote(*symbols, field="openPrice")
+    def get_open_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="openPrice", max_age=max_age)
 
-    def get_high_price(self, *symbols):
-        return self.get_quote(*symbols, field="highPrice")
+    def get_high_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="highPrice", max_age=max_age)
 
-    def get_low_price(self, *symbols):
-        return self.get_quote(*symbols, field="lowPrice")
+    def get_low_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="lowPrice", max_age=max_age)
 
-    def get_close_price(self, *symbols):
-        return self.get_quote(*symbols, field="closePrice")
+    def get_close_price(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="closePrice", max_age=max_age)
 
-    def get_volatility(self, *symbols):
-        return self.get_quote(*symbols, field="volatility")
+    def get_volatility(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="volatility", max_age=max_age)
 
-    def get_high_52(self, *symbols):
-        return self.get_quote(*symbols, field="52WkHigh")
+    def get_high_52(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="52WkHigh", max_age=max_age)
 
-    def get_low_52(self, *symbols):
-        return self.get_quote(*symbols, field="52WkLow")
+    def get_low_52(self, *symbols, max_age=None):
+        return self.get_quote(*symbols, field="52WkLow", max_age=max_age)
 
-    def get_fundamentals(self, symbol):
-        url = BASE_URL + "instruments"
+    def get_fundamentals(self, symbol, max_age=None):
+        """
+        Gets fundamental data for a symbol. Cached for a day unless
+        `max_age` says otherwise.
+        """
+        if max_age is None:
+            max_age = ENDPOINT_TTLS["fundamentals"]
+        if self.cache is not None and max_age > 0:
+            data = self.cache.get(("fundamentals", symbol), max_age)
+            if data is not None:
+                METRICS.counter("td_cache_hits_total", endpoint="fundamentals").inc()
+                return data
+            METRICS.counter("td_cache_misses_total", endpoint="fundamentals").inc()
+
+        url = self.base_url + "instruments"
         params = {
             "symbol" : symbol,
             "projection" : "fundamental"
         }
-        return self.make_get_request(url, params=params)
+        data = self.make_get_request(url, params=params)
+        if self.cache is not None:
+            self.cache.put(("fundamentals", symbol), data)
+        return data
+
+    def get_fundamentals_many(self, symbols, max_age=None, priority=None):
+        """
+        Gets fundamental data for any number of symbols, MAX_FUNDAMENTAL_SYMBOLS
+        per request. Returns a dict of symbol to its instruments entry (the
+        same shape get_fundamentals returns, merged). Symbols the API doesn't
+        know are left out. Cached per symbol like get_fundamentals.
+        """
+        if max_age is None:
+            max_age = ENDPOINT_TTLS["fundamentals"]
+        data = {}
+        if self.cache is not None and max_age > 0:
+            for symbol in symbols:
+                cached = self.cache.get(("fundamentals", symbol), max_age)
+                if cached is not None:
+                    data.update(cached)
+        missing = [symbol for symbol in symbols if symbol not in data]
+        METRICS.counter("td_cache_hits_total", endpoint="fundamentals").inc(len(symbols) - len(missing))
+        METRICS.counter("td_cache_misses_total", endpoint="fundamentals").inc(len(missing))
+
+        url = self.base_url + "instruments"
+        for i in range(0, len(missing), MAX_FUNDAMENTAL_SYMBOLS):
+            chunk = missing[i:i + MAX_FUNDAMENTAL_SYMBOLS]
+            params = {
+                "symbol" : ",".join(chunk),
+                "projection" : "fundamental"
+            }
+            fetched = self.make_get_request(url, params=params, priority=priority)
+            if self.cache is not None:
+                for symbol, entry in fetched.items():
+                    self.cache.put(("fundamentals", symbol), {symbol : entry})
+            data.update(fetched)
+        return data
 
     ###################################
     ########## PRICE HISTORY ##########
@@ -305,7 +441,7 @@ class TDClient(LevelOne):
 
     def get_price_history(self, symbol, period_type="day", period=10,
             frequency_type="minute", frequency=1, end_date=0, start_date=0,
-            extended_hours=True):
+            extended_hours=True, output="json"):
         """
         Gets the price history for a symbol.
         Args:
@@ -337,25 +473,58 @@ class TDClient(LevelOne):
         - start_date: Start date as millisconds since epoch. If start_date and end_date are
             provided, period should not be provided.
         - extended_hours: True to return extended hours data, false for regular market hours only.
+        - output: how the candles are returned
+            * json: the raw response (default)
+            * array: CandleArrays with one contiguous numpy column per field
+            * frame: pandas DataFrame indexed by timestamp
+        """
+        if output not in HISTORY_OUTPUTS:
+            raise ValueError("Invalid output passed to 'get_price_history'")
+        params = self.price_history_params(period_type, period, frequency_type,
+                frequency, end_date, start_date, extended_hours)
+        url = self.base_url + f"marketdata/{symbol}/pricehistory"
+        data = self.make_get_request(url, params=params)
+        return format_history(data, output, symbol=symbol)
+
+    def get_price_history_panel(self, symbols, **kwargs):
+        """
+        Gets price history for several symbols as a CandlePanel: one 2-D
+        array per field, aligned on a shared time axis. kwargs are passed
+        through to get_price_history.
+        """
+        histories = {}
+        for symbol in symbols:
+            histories[symbol] = self.get_price_history(symbol, output="array", **kwargs)
+        return CandlePanel(histories)
+
+    @staticmethod
+    def price_history_params(period_type, period, frequency_type, frequency,
+            end_date, start_date, extended_hours):
+        """
+        Validates get_price_history arguments and builds the query params.
+        Shared with the async client.
         """
         def validate_args(period_type, period, frequency_type, frequency, end_date, start_date):
             valid = True
-            # If period is provided then end_date and start_date shouldn't be
+            # If period is provided then end_date and start_date shouldn't be,
+            # otherwise both dates are needed
             if period is not None:
                 valid &= (end_date == 0 and start_date == 0)
+            else:
+                valid &= (end_date > 0 and start_date > 0)
 
             if period_type == "day":
                 valid &= frequency_type == "minute"
-                valid &= period in [1, 2, 3, 4, 5, 10]
+                valid &= period in [None, 1, 2, 3, 4, 5, 10]
             elif period_type == "month":
                 valid &= frequency_type in ["daily", "weekly"]
-                valid &= period in [1, 2, 3, 6]
+                valid &= period in [None, 1, 2, 3, 6]
             elif period_type == "year":
                 valid &= frequency_type in ["daily", "weekly", "monthly"]
-                valid &= period in [1, 2, 3, 5, 10, 15, 20]
+                valid &= period in [None, 1, 2, 3, 5, 10, 15, 20]
             elif period_type == "ytd":
                 valid &= frequency_type in ["daily", "weekly"]
-                valid &= period == 1
+                valid &= period in [None, 1]
 
             if frequency_type == "minute":
                 valid &= frequency in [1, 5, 10, 15, 30]
@@ -378,10 +547,9 @@ class TDClient(LevelOne):
             params["period"] = period
         else:
             params["endDate"] = end_date
-            params["startDate"] = start_data
+            params["startDate"] = start_date
 
-        url = BASE_URL + f"marketdata/{symbol}/pricehistory"
-        return self.make_get_request(url, params=params)
+        return params
 
     def get_market_hours(self, market, date):
         """
@@ -396,15 +564,39 @@ class TDClient(LevelOne):
         - date: the date for which market hours info is requested. Valid ISO-8601 formats are
             * yyyy-MM-dd
             * yyyy-MM-dd'T'HH:mm:ssz
+            A datetime.date or datetime.datetime is accepted too.
+        """
+        params = self.market_hours_params([market], date)
+        url = self.base_url + f"marketdata/{market}/hours"
+        return self.make_get_request(url, params={"date" : params["date"]})
+
+    def get_markets_hours(self, markets, date):
         """
-        raise NotImplementedError
+        Market hours for several markets on one date, in a single request.
+        The response has one entry per market, keyed by the lower case
+        market name.
+        """
+        params = self.market_hours_params(markets, date)
+        url = self.base_url + "marketdata/hours"
+        return self.make_get_request(url, params=params)
+
+    @staticmethod
+    def market_hours_params(markets, date):
+        if not markets or not set(markets) <= set(MARKETS):
+            raise ValueError("Invalid market passed to 'get_market_hours'")
+        if hasattr(date, "strftime"):
+            date = date.strftime("%Y-%m-%d")
+        return {
+            "markets" : ",".join(markets),
+            "date" : date,
+        }
 
     ###################################
     ######### ACCOUNT INFO ############
     ###################################
 
-    def get_account_info(self, positions=True, orders=True):
-        url = BASE_URL + f"accounts/{self._account_id}"
+    @staticmethod
+    def account_info_params(positions, orders):
         params = {}
         if positions:
             params["fields"] = "positions"
@@ -412,10 +604,24 @@ class TDClient(LevelOne):
                 params["fields"] = "positions,orders"
         elif orders:
             params["fields"] = "orders"
+        return params
+
+    def get_account_info(self, positions=True, orders=True):
+        url = self.base_url + f"accounts/{self._account_id}"
+        params = self.account_info_params(positions, orders)
         data = self.make_get_request(url, params=params)
 
         return data
 
+    def get_user_principals(self, fields="streamerSubscriptionKeys,streamerConnectionInfo"):
+        """
+        Gets user principal details, including what the streamer needs to
+        log in.
+        """
+        url = self.base_url + "userprincipals"
+        params = {"fields" : fields}
+        return self.make_get_request(url, params=params)
+
     def get_account_type(self):
         """
         Gets the basic type of the TD account.
@@ -424,11 +630,320 @@ class TDClient(LevelOne):
         data = self.get_account_info(positions=False, orders=False)
         return data["securitiesAccount"]["type"]
 
-    def get_transactions(self, start_date=None, end_date=None):
-        url = BASE_URL + f"accounts/{self._account_id}/transactions"
+    def get_transactions(self, start_date=None, end_date=None, transaction_type="ALL",
+            symbol=None, window_days=TRANSACTION_WINDOW_DAYS, priority=PRIORITY_LOW):
+        """
+        Yields the account's transactions between two dates, oldest first.
+
+        The range is requested `window_days` at a time, oldest window
+        first, so only one window of transactions is held in memory and the
+        caller can store each one as it arrives. Requests go on the low
+        priority lane by default so a long download doesn't hold up trading.
+
+        Args:
+        - start_date: first day, as a date, datetime or yyyy-MM-dd. Defaults
+            to TRANSACTION_HISTORY_DAYS before end_date.
+        - end_date: last day, included. Defaults to today.
+        - transaction_type: one of TRANSACTION_TYPES.
+        - symbol: only transactions for this symbol.
+        - window_days: days per request.
+        """
+        if transaction_type not in TRANSACTION_TYPES:
+            raise ValueError("Invalid transaction type passed to 'get_transactions'")
+        end_date = self.transaction_date(end_date) or datetime.now(timezone.utc).date()
+        start_date = (self.transaction_date(start_date)
+                or end_date - timedelta(days=TRANSACTION_HISTORY_DAYS))
+        url = self.base_url + f"accounts/{self._account_id}/transactions"
+        window_start = start_date
+        while window_start <= end_date:
+            window_end = min(window_start + timedelta(days=window_days - 1), end_date)
+            params = {
+                "type" : transaction_type,
+                "startDate" : window_start.strftime("%Y-%m-%d"),
+                "endDate" : window_end.strftime("%Y-%m-%d"),
+            }
+            if symbol is not None:
+                params["symbol"] = symbol
+            transactions = self.make_get_request(url, params=params, priority=priority)
+            # Dates are all UTC ISO-8601, so they sort as strings.
+            transactions.sort(key=lambda t : (t.get("transactionDate", ""), t.get("transactionId", 0)))
+            yield from transactions
+            window_start = window_end + timedelta(days=1)
+
+    @staticmethod
+    def transaction_date(date):
+        """
+        A get_transactions date argument as a datetime.date, or None.
+        """
+        if not date:
+            return None
+        if isinstance(date, str):
+            return datetime.strptime(date[:10], "%Y-%m-%d").date()
+        if isinstance(date, datetime):
+            return date.date()
+        return date
+
+    ###################################
+    ############# ORDERS ##############
+    ###################################
+
+    def orders_url(self, order_id=None):
+        url = self.base_url + f"accounts/{self._account_id}/orders"
+        return url if order_id is None else f"{url}/{order_id}"
+
+    def send_order_request(self, method, url, spec=None):
+        """
+        Sends an order request with a JSON body on the high priority lane
+        and returns the response. Raises OrderError if the API refuses it.
+        Timeouts and connection errors are raised as they are, since the
+        order may or may not have reached the API.
+        """
+        with METRICS.span("order_submit_seconds", method=method):
+            r = self._transport.request(method, url, json=spec, authenticated=True,
+                    priority=PRIORITY_HIGH, **self.token_sources())
+        if r.status_code >= 400:
+            logger.error(f"{method} {url} failed with {r.status_code}: {r.text}")
+            raise OrderError(f"{method} {url} failed with {r.status_code}")
+        return r
+
+    def reference_price(self, symbol):
+        """
+        Last price from the quote cache, for risk checks. Never makes a
+        request; None if there's no recent quote.
+        """
+        if self.cache is None:
+            return None
+        quote = self.cache.get(("quotes", symbol), REFERENCE_PRICE_MAX_AGE)
+        return quote.get("lastPrice") if quote else None
+
+    def place_order(self, symbol, quantity, instruction="BUY", order_type="MARKET", price=None,
+            stop_price=None, duration="DAY", session="NORMAL", client_order_id=None):
+        """
+        Places a single leg equity order. Returns its client order id,
+        which works with every other order call and in self.orders.
+        Args:
+        - instruction: BUY, SELL, BUY_TO_COVER or SELL_SHORT
+        - order_type: MARKET, LIMIT (needs price), STOP (needs stop_price)
+            or STOP_LIMIT (needs both)
+        - duration: DAY, GOOD_TILL_CANCEL or FILL_OR_KILL
+        - session: NORMAL, AM, PM or SEAMLESS
+        - client_order_id: id to place the order under. Placing again with
+            the same id doesn't send a second order, so retries are safe.
+        Raises RiskError if the order breaks the risk limits, OrderError
+        if the API rejects it.
+        """
+        spec = order_spec(symbol, quantity, instruction, order_type, price, stop_price,
+                duration, session)
+        return self.submit_order(spec, client_order_id)
+
+    def submit_order(self, spec, client_order_id=None):
+        """
+        Risk checks and sends an order spec (see td.orders.order_spec).
+
+        If `client_order_id` is already in the book nothing new is sent.
+        The one exception is an order whose last attempt got no answer
+        (status UNKNOWN): reconcile_order looks for it at the broker first,
+        and it's only sent again if it isn't there.
+        """
+        if client_order_id is not None:
+            order = self.orders.get(client_order_id)
+            if order is not None:
+                if order.status == UNKNOWN and not self.reconcile_order(order):
+                    self._send_order(order)
+                return client_order_id
+        else:
+            client_order_id = new_client_order_id()
+        order = Order(client_order_id, spec)
+        self.orders.reserve(order, self.risk)
+        self._send_order(order)
+        return client_order_id
+
+    def _send_order(self, order):
+        order.submitted = time.time()
+        self._log_order("order", order, NEW)
+        try:
+            r = self.send_order_request("POST", self.orders_url(), order.spec)
+        except OrderError:
+            self.orders.update_status(order, "REJECTED")
+            raise
+        except requests.RequestException:
+            self.orders.update_status(order, UNKNOWN)
+            raise
+        self.orders.set_order_id(order, order_id_from_location(r.headers.get("Location")))
+        self.orders.update_status(order, "ACCEPTED")
+
+    def place_orders(self, orders):
+        """
+        Places several orders at once. `orders` is a list of dicts of
+        place_order arguments. All of them are risk checked before any is
+        sent; if one fails nothing is sent and the RiskError is raised.
+        The requests then go out concurrently.
+
+        Returns the client order ids in the same order. Orders the API
+        rejected or that got no answer are left REJECTED or UNKNOWN in
+        self.orders rather than raising, so one bad order doesn't hide the
+        others.
+        """
+        batch = []
+        try:
+            for kwargs in orders:
+                kwargs = dict(kwargs)
+                client_order_id = kwargs.pop("client_order_id", None) or new_client_order_id()
+                order = Order(client_order_id, order_spec(**kwargs))
+                self.orders.reserve(order, self.risk)
+                batch.append(order)
+        except Exception:
+            for order in batch:
+                self.orders.discard(order)
+            raise
+
+        def send(order):
+            try:
+                self._send_order(order)
+            except (OrderError, requests.RequestException) as e:
+                logger.error(f"Order {order.client_order_id} failed: {e}")
+
+        if self._order_pool is None:
+            self._order_pool = ThreadPoolExecutor(max_workers=MAX_BATCH_WORKERS,
+                    thread_name_prefix="orders")
+        list(self._order_pool.map(send, batch))
+        return [order.client_order_id for order in batch]
+
+    def _open_order(self, order_id):
+        order = self.orders.get(order_id)
+        if order is None:
+            raise OrderError(f"Unknown order {order_id}")
+        if order.order_id is None:
+            raise OrderError(f"Order {order_id} has no broker order id yet")
+        return order
+
+    def replace_order(self, order_id, quantity=None, price=None, stop_price=None,
+            order_type=None, duration=None, client_order_id=None):
+        """
+        Replaces a working order with a new one; anything not given is kept
+        from the old order. The API cancels the old order (REPLACED) and
+        creates a new one. Returns the new order's client order id.
+        """
+        old = self._open_order(order_id)
+        if client_order_id is not None and self.orders.get(client_order_id) is not None:
+            return client_order_id
+        order_type = order_type or old.order_type
+        price = old.price if price is None else price
+        stop_price = old.stop_price if stop_price is None else stop_price
+        spec = order_spec(old.symbol, quantity or old.quantity, old.instruction, order_type,
+                price if order_type in ["LIMIT", "STOP_LIMIT"] else None,
+                stop_price if order_type in ["STOP", "STOP_LIMIT"] else None,
+                duration or old.spec.get("duration", "DAY"), old.spec.get("session", "NORMAL"))
+        order = Order(client_order_id or new_client_order_id(), spec)
+        order.replaces = old.client_order_id
+        self.orders.reserve(order, self.risk, replacing=old)
+        order.submitted = time.time()
+        self._log_order("replace", order, NEW)
+        try:
+            r = self.send_order_request("PUT", self.orders_url(old.order_id), spec)
+        except OrderError:
+            self.orders.update_status(order, "REJECTED")
+            raise
+        except requests.RequestException:
+            self.orders.update_status(order, UNKNOWN)
+            raise
+        old.replaced_by = order.client_order_id
+        self.orders.set_order_id(order, order_id_from_location(r.headers.get("Location")))
+        self.orders.update_status(order, "ACCEPTED")
+        self.orders.update_status(old, "REPLACED")
+        return order.client_order_id
+
+    def cancel_order(self, order_id):
+        """
+        Asks the API to cancel an order. The order goes to PENDING_CANCEL
+        (still counted as open by the risk checks) until the stream or
+        refresh_order reports it CANCELED. Returns False if the order had
+        already finished.
+        """
+        order = self._open_order(order_id)
+        if not order.is_open:
+            return False
+        self.send_order_request("DELETE", self.orders_url(order.order_id))
+        self._log_order("cancel", order, "PENDING_CANCEL")
+        self.orders.update_status(order, "PENDING_CANCEL")
+        return True
+
+    def get_order(self, order_id):
+        return self.make_get_request(self.orders_url(order_id), priority=PRIORITY_HIGH)
+
+    def get_orders(self, from_entered=None, to_entered=None, status=None, max_results=None):
+        """
+        Gets the account's orders. Dates are yyyy-MM-dd; the API defaults
+        to today.
+        """
         params = {}
-        # TODO
-        raise NotImplementedError
+        optional = {
+            "fromEnteredTime" : from_entered,
+            "toEnteredTime" : to_entered,
+            "status" : status,
+            "maxResults" : max_results,
+        }
+        for name, value in optional.items():
+            if value is not None:
+                params[name] = value
+        return self.make_get_request(self.orders_url(), params=params, priority=PRIORITY_HIGH)
+
+    def refresh_order(self, order_id):
+        """
+        Fetches one order and applies it to self.orders.
+        """
+        order = self._open_order(order_id)
+        return self.orders.apply_order(self.get_order(order.order_id))
+
+    def sync_orders(self):
+        """
+        Replaces the local positions and updates every order from an
+        account snapshot. Call on startup and after reconnecting the
+        stream; in between the stream keeps self.orders current.
+        """
+        self.orders.sync(self.get_account_info(positions=True, orders=True))
+        return self.orders
+
+    def reconcile_order(self, order):
+        """
+        Looks for an order whose submission got no answer among the
+        account's orders entered around the same time, matching on symbol,
+        instruction, quantity, type and price. Adopts and returns True if
+        found; otherwise sets it back to NEW so it can be sent again.
+        """
+        submitted = datetime.fromtimestamp(order.submitted or time.time(), timezone.utc)
+        window = timedelta(seconds=RECONCILE_WINDOW)
+        candidates = self.get_orders(from_entered=(submitted - window).strftime("%Y-%m-%d"),
+                to_entered=(submitted + window).strftime("%Y-%m-%d"))
+        for data in candidates:
+            order_id = str(data.get("orderId"))
+            if self.orders.get(order_id) is not None or not same_order(order, data):
+                continue
+            entered = parse_entered_time(data.get("enteredTime"))
+            if entered is not None and abs(entered - submitted) > window:
+                continue
+            self.orders.set_order_id(order, order_id)
+            self.orders.update_status(order, "ACCEPTED")
+            self.orders.apply_order(data)
+            return True
+        self.orders.update_status(order, NEW)
+        return False
+
+    def _log_order(self, event, order, status):
+        if self.journal is not None:
+            self.journal.log_order(event, order.client_order_id, order.symbol, order.instruction,
+                    order.order_type, order.quantity,
+                    math.nan if order.price is None else order.price, status)
+
+    def _order_filled(self, order, quantity, price):
+        if self.journal is not None:
+            self.journal.log_fill(order.client_order_id, order.symbol,
+                    signed(order.instruction, quantity), price)
+        if self.on_fill is not None:
+            self.on_fill(order.client_order_id, order)
+
+    def _order_status(self, order):
+        self._log_order("status", order, order.status)
 
     ####################################
     ############# MOVERS ###############
@@ -445,24 +960,28 @@ class TDClient(LevelOne):
         - direction: either 'up' or 'down'
         - change: either 'value' or 'percent'
         """
-        # Validate args
+        url = self.base_url + f"marketdata/{market}/movers"
+        params = self.movers_params(direction, change)
+        data = self.make_get_request(url, params=params)
+        
+        return data
+
+    @staticmethod
+    def movers_params(direction, change):
         if direction not in ["up", "down"] or change not in ["value", "percent"]:
             raise ValueError("Invalid argument passed to 'get_movers'")
-
-        url = BASE_URL + f"marketdata/{market}/movers"
-        params = {
+        return {
             "direction" : direction,
             "change" : change
         }
-        data = self.make_get_request(url, params=params)
-        
-        return data
 
     ####################################
     ######### OPTION CHAINS ############
     ####################################
 
-    def get_option_chain(self, symbol, contract_type, strike_count, strategy, interval, strike, option_range, from_date, to_date, exp_month, option_type, **kwargs):
+    def get_option_chain(self, symbol, contract_type="ALL", strike_count=None, include_quotes=False,
+            strategy="SINGLE", interval=None, strike=None, option_range="ALL", from_date=None,
+            to_date=None, exp_month="ALL", option_type="ALL", output="json", **kwargs):
         """
         This is a straighforward GET request but there's lots of arguments, so take a second here.
         Args:
@@ -488,7 +1007,7 @@ class TDClient(LevelOne):
             * ROLL
         - interval: strike interval for spread strategy chains
         - strike: provide a strike price to return options only at that strike price
-        - range: returns options for the given range.
+        - option_range: returns options for the given range.
             * ITM : in-the-money
             * NTM : near-the-money
             * OTM : out-of-the-money
@@ -510,6 +1029,10 @@ class TDClient(LevelOne):
             * S : standard contracts
             * NS : non-standard contracts
             * ALL : all contracts (TD default)
+        - output: how the chain is returned
+            * json: the raw response (default)
+            * chain: data.options.OptionChain, one numpy column per field
+            * frame: pandas DataFrame indexed by option symbol
 
         Keyword Arguments (applies only to the ANALYTICAL strategy)
         - volatility
@@ -517,8 +1040,58 @@ class TDClient(LevelOne):
         - interest_rate
         - days_to_expiration
 
+        OptionChain.analytical computes the same values locally, for the
+        whole chain at once.
         """
-        raise NotImplementedError
+        if output not in CHAIN_OUTPUTS:
+            raise ValueError("Invalid output passed to 'get_option_chain'")
+        params = self.option_chain_params(symbol, contract_type, strike_count, include_quotes,
+                strategy, interval, strike, option_range, from_date, to_date, exp_month,
+                option_type, **kwargs)
+        url = self.base_url + "marketdata/chains"
+        data = self.make_get_request(url, params=params)
+        return format_chain(data, output)
+
+    @staticmethod
+    def option_chain_params(symbol, contract_type, strike_count, include_quotes, strategy,
+            interval, strike, option_range, from_date, to_date, exp_month, option_type, **kwargs):
+        """
+        Validates get_option_chain arguments and builds the query params.
+        Shared with the async client.
+        """
+        valid = contract_type in ["CALL", "PUT", "ALL"]
+        valid &= strategy in OPTION_STRATEGIES
+        valid &= option_range in ["ITM", "NTM", "OTM", "SAK", "SBK", "SNK", "ALL"]
+        valid &= option_type in ["S", "NS", "ALL"]
+        valid &= exp_month in OPTION_MONTHS
+        valid &= set(kwargs) <= set(ANALYTICAL_PARAMS)
+        valid &= strategy == "ANALYTICAL" or not kwargs
+        if not valid:
+            logger.error("Invalid arguments passed to get_option_chain")
+            raise ValueError("Invalid arguments passed to 'get_option_chain'")
+
+        params = {
+            "symbol" : symbol,
+            "contractType" : contract_type,
+            "includeQuotes" : "TRUE" if include_quotes else "FALSE",
+            "strategy" : strategy,
+            "range" : option_range,
+            "expMonth" : exp_month,
+            "optionType" : option_type,
+        }
+        optional = {
+            "strikeCount" : strike_count,
+            "interval" : interval,
+            "strike" : strike,
+            "fromDate" : from_date,
+            "toDate" : to_date,
+        }
+        for name, value in optional.items():
+            if value is not None:
+                params[name] = value
+        for name, value in kwargs.items():
+            params[ANALYTICAL_PARAMS[name]] = value
+        return params
 
 if __name__ == "__main__":
     client = TDClient()
@@ -1,13 +1,67 @@
 import os
-import requests
 import sys
-import time
+import tempfile
+import threading
+from types import SimpleNamespace
 
-from td_client import TDClient
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.join(THISDIR, "..")
 
-BASE_URL = "https://api.tdameritrade.com/v1/oauth2"
+if CLIENT_DIR not in sys.path:
+    sys.path.append(CLIENT_DIR)
+
+from td.td_client import TDClient
+from td.token_manager import TokenManager
+
+TEST_CREDENTIALS = {
+    "CLIENT_ID" : "TESTCLIENT",
+    "REDIRECT_URI" : "http://localhost",
+    "ACCOUNT_ID" : "123456789",
+}
+
+class MemoryTokenStore():
+    """
+    In-memory stand-in for TokensEndpoint, holding a single tokens row.
+    """
+
+    def __init__(self, auth_token="mock-refresh-token", auth_token_end=None):
+        self._row = {
+            "auth_token" : auth_token,
+            "auth_token_end" : auth_token_end,
+            "session_token" : None,
+            "session_token_end" : None,
+        }
+        self._lock = threading.Lock()
+        self.reads = 0
+        self.writes = 0
+
+    def get(self, client_id):
+        with self._lock:
+            self.reads += 1
+            return SimpleNamespace(client=client_id, **self._row)
+
+    def update(self, client_id, new_values):
+        with self._lock:
+            self.writes += 1
+            self._row.update(new_values)
+        return True
 
 class TestClient(TDClient):
+    """
+    TDClient pointed at a local mock API (see benchmarks/mock_server.py),
+    with fixed credentials and tokens kept in memory instead of the DB.
+
+        with MockTDServer() as server:
+            client = TestClient(server.url)
+    """
+
+    def __init__(self, base_url, token_store=None, **kwargs):
+        super().__init__(base_url=base_url, **kwargs)
+        self.token_store = token_store if token_store is not None else MemoryTokenStore()
+        lock_path = os.path.join(tempfile.gettempdir(), f"basilisk_test_tokens_{os.getpid()}.lock")
+        self.tokens = TokenManager("test", self.request_access_token,
+                lock_path=lock_path, store=self.token_store)
 
-    def __init__(self):
-        super().__init__()
+    @staticmethod
+    def get_credentials_info():
+        return TEST_CREDENTIALS
@@ -0,0 +1,229 @@
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..", "..", "..", "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+DATA_DIR = os.path.join(SRC_DIR, "data")
+
+for path in [SRC_DIR, DATA_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.metrics import METRICS
+from data.tokens import TokensEndpoint
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+LOCK_DIR = os.path.join(BASE_DIR, "locks")
+
+# Refresh in the background this many seconds before the (already padded)
+# expiration stored with the token.
+DEFAULT_REFRESH_MARGIN = 120
+# How long to wait before trying again after a failed background refresh.
+RETRY_DELAY = 30
+
+def is_null(value):
+    return value is None or value == "null"
+
+@contextmanager
+def file_lock(path):
+    """
+    Exclusive lock on `path` shared between processes. A no-op where fcntl
+    isn't available.
+    """
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "a") as f:
+        fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(f, fcntl.LOCK_UN)
+
+class TokenManager():
+    """
+    Owns a client's access and refresh tokens.
+
+    Tokens are kept in memory and written through to the tokens table, so
+    the DB is only read on first use and when a token is about to expire.
+    Refreshes are single-flight: one caller does the network round-trip and
+    everyone else waiting gets its result. Processes coordinate through a
+    file lock and pick up a token another process already refreshed from the
+    DB instead of requesting their own.
+
+    Once a token is known a daemon thread refreshes it `refresh_margin`
+    seconds before it expires, so requests don't wait on a refresh.
+    """
+
+    def __init__(self, client_name, requester, refresh_margin=DEFAULT_REFRESH_MARGIN,
+            lock_path=None, store=None):
+        """
+        Args:
+        - client_name: row in the tokens table, e.g. "td".
+        - requester: callable taking a refresh token and returning a new
+            (access_token, access_end) pair from the broker.
+        - store: where tokens are persisted. Anything with TokensEndpoint's
+            get(client) and update(client, values); TokensEndpoint by default.
+        """
+        self.client_name = client_name
+        self.requester = requester
+        self.refresh_margin = refresh_margin
+        self.lock_path = lock_path or os.path.join(LOCK_DIR, f"{client_name}_tokens.lock")
+        self.store = store if store is not None else TokensEndpoint
+
+        self._access_token = None
+        self._access_end = None
+        self._refresh_token = None
+        self._generation = 0
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.refreshes = 0
+        self.db_reads = 0
+
+    def is_fresh(self, margin=0):
+        """
+        True if the in-memory access token is valid for at least `margin`
+        more seconds.
+        """
+        return self._access_token is not None and self._access_end > time.time() + margin
+
+    def access_token(self):
+        """
+        Returns a valid access token. Only blocks if the in-memory token is
+        missing or stale, e.g. on first use.
+        """
+        token = self._access_token
+        if token is not None and self._access_end > time.time():
+            return token
+        return self._load_or_refresh()
+
+    async def access_token_async(self):
+        token = self._access_token
+        if token is not None and self._access_end > time.time():
+            return token
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._load_or_refresh)
+
+    def refresh(self):
+        """
+        Forces a refresh, e.g. after the server rejected the token. Callers
+        that were waiting while someone else refreshed use that token.
+        """
+        generation = self._generation
+        with self._lock:
+            if self._generation != generation and self.is_fresh():
+                return self._access_token
+            with file_lock(self.lock_path):
+                return self._refresh_locked()
+
+    async def refresh_async(self):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self.refresh)
+
+    def refresh_token(self):
+        """
+        Returns the refresh token, reading it from the DB the first time.
+        """
+        if self._refresh_token is None:
+            try:
+                self._refresh_token = self._read_row().auth_token
+            except Exception as e:
+                logger.error(f"Failed to fetch refresh token: {e}")
+                return None
+        return self._refresh_token
+
+    def store_refresh_token(self, token, token_end):
+        self._refresh_token = token
+        data = {
+            "auth_token" : token,
+            "auth_token_end" : token_end,
+        }
+        return self.store.update(self.client_name, data)
+
+    def _read_row(self):
+        self.db_reads += 1
+        return self.store.get(self.client_name)
+
+    def _load_or_refresh(self, margin=0):
+        """
+        Makes sure the access token is valid for `margin` more seconds, taking
+        it from the DB if another process refreshed it, else refreshing it.
+        """
+        with self._lock, METRICS.span("token_load_seconds", client=self.client_name):
+            if self.is_fresh(margin):
+                return self._access_token
+            with file_lock(self.lock_path):
+                # Another process may already have refreshed the token.
+                row = self._read_row()
+                if not is_null(row.auth_token):
+                    self._refresh_token = row.auth_token
+                if (not is_null(row.session_token) and not is_null(row.session_token_end)
+                        and row.session_token_end > time.time() + margin):
+                    self._set_access_token(row.session_token, row.session_token_end)
+                    return self._access_token
+                return self._refresh_locked()
+
+    def _refresh_locked(self):
+        """
+        Requests a new access token and writes it through to the DB. Must be
+        called holding both locks. Returns None if the request fails.
+        """
+        try:
+            with METRICS.span("token_refresh_seconds", client=self.client_name):
+                token, token_end = self.requester(self.refresh_token())
+        except Exception as e:
+            logger.error(f"Refreshing access token failed with exception: {e}")
+            METRICS.counter("token_refresh_failures_total", client=self.client_name).inc()
+            return None
+        self.refreshes += 1
+        METRICS.counter("token_refreshes_total", client=self.client_name).inc()
+        self._set_access_token(token, token_end)
+        data = {
+            "session_token" : token,
+            "session_token_end" : token_end,
+        }
+        if not self.store.update(self.client_name, data):
+            logger.error("Failed to write refreshed access token to the DB")
+        return token
+
+    def _set_access_token(self, token, token_end):
+        self._access_token = token
+        self._access_end = token_end
+        self._generation += 1
+        self._start_background()
+
+    ###################################
+    ####### BACKGROUND REFRESH ########
+    ###################################
+
+    def _start_background(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+
+    def _refresh_loop(self):
+        while not self._stop.is_set():
+            due = self._access_end - self.refresh_margin
+            if self._stop.wait(max(0, due - time.time())):
+                break
+            if self._load_or_refresh(self.refresh_margin) is None:
+                self._stop.wait(RETRY_DELAY)
+
+    def stop(self):
+        self._stop.set()
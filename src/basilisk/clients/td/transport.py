@@ -0,0 +1,171 @@
+import logging
+import os
+import sys
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+CLIENT_DIR = os.path.join(THISDIR, "..")
+SRC_DIR = os.path.join(THISDIR, "..", "..", "..")
+
+for path in [SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.metrics import METRICS
+from td.scheduler import SCHEDULER, parse_retry_after, priority_for
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 16
+DEFAULT_CONNECT_TIMEOUT = 3.05
+DEFAULT_READ_TIMEOUT = 10
+DEFAULT_MAX_THROTTLE_RETRIES = 3
+
+# Metric label for each API path we call. First match wins.
+ENDPOINTS = [
+    ("oauth2/token", "oauth2/token"),
+    ("pricehistory", "pricehistory"),
+    ("marketdata/quotes", "quotes"),
+    ("movers", "movers"),
+    ("transactions", "transactions"),
+    ("orders", "orders"),
+    ("accounts", "accounts"),
+    ("instruments", "instruments"),
+    ("userprincipals", "userprincipals"),
+    ("chains", "chains"),
+    ("hours", "hours"),
+]
+
+def endpoint_for(url):
+    for fragment, label in ENDPOINTS:
+        if fragment in url:
+            return label
+    return "other"
+
+def record_request(endpoint, status, elapsed, queued):
+    """
+    Records one HTTP attempt: network time, time spent waiting on the
+    rate limiter, and a count by status code.
+    """
+    METRICS.histogram("td_request_seconds", endpoint=endpoint).record(elapsed)
+    METRICS.histogram("td_scheduler_wait_seconds", endpoint=endpoint).record(queued)
+    METRICS.counter("td_requests_total", endpoint=endpoint, status=status).inc()
+    if status == 429:
+        METRICS.counter("td_retries_total", endpoint=endpoint, reason="throttled").inc()
+
+class Transport():
+    """
+    Pooled, keep-alive HTTP transport shared by every request a client makes.
+    A single requests.Session is reused so TCP+TLS connections are kept open
+    between calls instead of being re-established each time.
+
+    Authenticated requests get a bearer token from `token_provider`. If the
+    server answers 401 we call `token_refresher` once and retry the request
+    with the new token. Both can be given per request instead, so clients
+    with different credentials can share one transport.
+
+    Every request first takes a token from the RequestScheduler (the process
+    wide one by default). A 429 pauses the scheduler for the Retry-After
+    period and the request is sent again, up to `max_throttle_retries` times.
+
+    If a `journal` (data.journal.AuditLog) is set, every request sent,
+    including throttled attempts, is logged with its status and latency.
+    Latencies and retries are also recorded in data.metrics.METRICS.
+    """
+
+    def __init__(self, token_provider=None, token_refresher=None,
+            pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE,
+            connect_timeout=DEFAULT_CONNECT_TIMEOUT, read_timeout=DEFAULT_READ_TIMEOUT,
+            scheduler=None, max_throttle_retries=DEFAULT_MAX_THROTTLE_RETRIES, journal=None):
+        self.token_provider = token_provider
+        self.token_refresher = token_refresher
+        self.timeout = (connect_timeout, read_timeout)
+        self.scheduler = scheduler if scheduler is not None else SCHEDULER
+        self.max_throttle_retries = max_throttle_retries
+        self.journal = journal
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def auth_headers(self, token):
+        return {"Authorization": f"Bearer {token}"}
+
+    def send(self, method, url, priority, **kwargs):
+        """
+        Sends one request once the scheduler lets it through, waiting out and
+        retrying 429 responses.
+        """
+        endpoint = endpoint_for(url)
+        for _ in range(self.max_throttle_retries + 1):
+            queued = time.perf_counter()
+            self.scheduler.acquire(priority)
+            start = time.perf_counter()
+            r = self.session.request(method, url, timeout=self.timeout, **kwargs)
+            elapsed = time.perf_counter() - start
+            record_request(endpoint, r.status_code, elapsed, start - queued)
+            if self.journal is not None:
+                self.journal.log_request(method, url, r.status_code, elapsed,
+                        priority, len(r.content))
+            if r.status_code != 429:
+                break
+            self.scheduler.throttle(parse_retry_after(r.headers.get("Retry-After")))
+        return r
+
+    def request(self, method, url, params=None, data=None, headers=None,
+            authenticated=False, priority=None, json=None, token_provider=None,
+            token_refresher=None):
+        """
+        Sends a request over the pooled session and returns the response.
+        If `authenticated` is set the Authorization header is filled in from
+        the token provider (`token_provider`, else the transport's), and a
+        401 triggers a single refresh-and-retry with `token_refresher`.
+        `priority` picks the scheduler lane; by default it's chosen from the url.
+        `json` is sent as a JSON body (orders) instead of form `data`.
+        """
+        if priority is None:
+            priority = priority_for(url)
+        token_provider = token_provider or self.token_provider
+        token_refresher = token_refresher or self.token_refresher
+        if authenticated:
+            headers = dict(headers or {})
+            with METRICS.span("td_token_lookup_seconds"):
+                token = token_provider()
+            headers.update(self.auth_headers(token))
+
+        r = self.send(method, url, priority, params=params, data=data, json=json, headers=headers)
+
+        if r.status_code == 401 and authenticated and token_refresher is not None:
+            logger.info(f"Request to {url} returned 401, refreshing access token and retrying")
+            METRICS.counter("td_retries_total", endpoint=endpoint_for(url), reason="unauthorized").inc()
+            token = token_refresher()
+            if token is not None:
+                headers.update(self.auth_headers(token))
+                r = self.send(method, url, priority, params=params, data=data, json=json, headers=headers)
+
+        return r
+
+    def get(self, url, params=None, headers=None, authenticated=False, priority=None, **tokens):
+        return self.request("GET", url, params=params, headers=headers,
+                authenticated=authenticated, priority=priority, **tokens)
+
+    def post(self, url, data=None, headers=None, authenticated=False, priority=None, **tokens):
+        return self.request("POST", url, data=data, headers=headers,
+                authenticated=authenticated, priority=priority, **tokens)
+
+    def put(self, url, json=None, headers=None, authenticated=False, priority=None, **tokens):
+        return self.request("PUT", url, json=json, headers=headers,
+                authenticated=authenticated, priority=priority, **tokens)
+
+    def delete(self, url, headers=None, authenticated=False, priority=None, **tokens):
+        return self.request("DELETE", url, headers=headers,
+                authenticated=authenticated, priority=priority, **tokens)
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,283 @@
+import argparse
+import logging
+import marshal
+import os
+import signal
+import socket
+import socketserver
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import Future, ThreadPoolExecutor
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..", "..")
+LOG_DIR = os.path.join(BASE_DIR, "logs")
+SRC_DIR = os.path.join(THISDIR, "..")
+CLIENT_DIR = os.path.join(THISDIR, "clients")
+
+for path in [SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from data.metrics import METRICS
+from td.cache import TTLCache
+from td.gateway_client import (CALL, DEFAULT_SOCKET_PATH, ERROR, GATEWAY_METHODS, HELLO, RESULT,
+        STATS, compatible, hello_payload, recv_frame, send_frame)
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_WORKERS = 32
+DEFAULT_COALESCE_WINDOW = 0.005
+
+# Seconds a finished call's result is reused for an identical call from any
+# session. Quotes and fundamentals are left to the client's own TTLCache,
+# which already knows how stale each field may be; account data is always
+# fetched fresh.
+RESULT_TTLS = {
+    "get_price_history" : 30,
+    "get_movers" : 30,
+    "get_option_chain" : 5,
+    "get_market_hours" : 3600,
+    "get_markets_hours" : 3600,
+    "get_user_principals" : 3600,
+}
+
+def call_key(method, args, kwargs):
+    """
+    Identifies a call: equal keys mean the same request to the API.
+    """
+    return marshal.dumps((method, args, sorted(kwargs.items())))
+
+class Gateway():
+    """
+    Owns one broker client and runs market data and account calls for any
+    number of sessions connected over a Unix socket (see
+    td.gateway_client for the protocol and the session side).
+
+    One client means one connection pool, one rate limit budget and one
+    token refresh for the whole host. On top of that:
+    - identical calls in flight at the same time, from any sessions, are
+        sent once and every caller gets the result;
+    - results of some calls are reused for a few seconds (RESULT_TTLS);
+    - the client's quote cache and coalescer are shared by all sessions,
+        so overlapping quote requests merge into one batched request.
+
+    Args:
+    - client: the TDClient making the requests.
+    - socket_path: where to listen. Only this user can connect.
+    - workers: calls run at the same time.
+    - result_ttls: overrides RESULT_TTLS.
+    """
+
+    def __init__(self, client, socket_path=DEFAULT_SOCKET_PATH, workers=DEFAULT_WORKERS,
+            result_ttls=None):
+        self.client = client
+        self.socket_path = socket_path
+        self.result_ttls = dict(RESULT_TTLS if result_ttls is None else result_ttls)
+        self.results = TTLCache()
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gateway")
+        self.counts = Counter()
+        self.sessions = {}
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    ### Calls
+
+    def call(self, method, args, kwargs):
+        """
+        Runs one call for a session, sharing identical in-flight calls and
+        recent results.
+        """
+        if method not in GATEWAY_METHODS:
+            raise ValueError(f"The gateway doesn't serve '{method}'")
+        key = call_key(method, args, kwargs)
+        ttl = self.result_ttls.get(method, 0)
+        if ttl:
+            result = self.results.get(key, ttl)
+            if result is not None:
+                self._count("cached", method)
+                return result
+        with self._lock:
+            future = self._inflight.get(key)
+            leader = future is None
+            if leader:
+                future = self._inflight[key] = Future()
+        if not leader:
+            self._count("deduplicated", method)
+            return future.result()
+
+        self._count("sent", method)
+        try:
+            result = getattr(self.client, method)(*args, **kwargs)
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        else:
+            if ttl:
+                self.results.put(key, result)
+            future.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._inflight[key]
+
+    def _count(self, outcome, method):
+        with self._lock:
+            self.counts[outcome] += 1
+        METRICS.counter("gateway_calls_total", method=method, outcome=outcome).inc()
+
+    def stats(self):
+        with self._lock:
+            stats = {
+                "sessions" : len(self.sessions),
+                "inflight" : len(self._inflight),
+            }
+            stats.update(self.counts)
+        stats["results"] = self.results.stats()
+        cache = getattr(self.client, "cache", None)
+        if cache is not None:
+            stats["cache"] = cache.stats()
+        return stats
+
+    ### Sessions
+
+    def _serve_session(self, sock):
+        """
+        Reads one session's requests and runs each on the worker pool, so a
+        slow call doesn't hold up the session's other calls.
+        """
+        send_lock = threading.Lock()
+
+        def reply(request_id, kind, payload):
+            try:
+                with send_lock:
+                    send_frame(sock, request_id, kind, payload)
+            except OSError:
+                # The session went away; its reader loop notices too.
+                pass
+
+        def run(request_id, method, args, kwargs):
+            try:
+                result = self.call(method, args, kwargs)
+            except Exception as e:
+                reply(request_id, ERROR, (type(e).__name__, str(e)))
+                return
+            try:
+                reply(request_id, RESULT, result)
+            except ValueError as e:
+                reply(request_id, ERROR, (type(e).__name__, f"Can't send the result of {method}: {e}"))
+
+        _, kind, hello = recv_frame(sock)
+        if kind != HELLO or not isinstance(hello, dict) or not compatible(hello):
+            reply(0, ERROR, ("GatewayError", f"Incompatible session {hello!r}, gateway is {hello_payload()}"))
+            return
+        name = hello.get("name") or "session"
+        reply(0, HELLO, hello_payload("gateway"))
+        with self._lock:
+            self.sessions[sock] = name
+        logger.info(f"Session {name} connected")
+        try:
+            while True:
+                request_id, kind, payload = recv_frame(sock)
+                if kind == CALL:
+                    method, args, kwargs = payload
+                    self.pool.submit(run, request_id, method, args, kwargs)
+                elif kind == STATS:
+                    reply(request_id, RESULT, self.stats())
+                else:
+                    reply(request_id, ERROR, ("GatewayError", f"Unknown message kind {kind}"))
+        except (OSError, ValueError, EOFError, RuntimeError):
+            # Disconnected, garbled, or the gateway is stopping.
+            pass
+        finally:
+            with self._lock:
+                self.sessions.pop(sock, None)
+            logger.info(f"Session {name} disconnected")
+
+    def start(self):
+        """
+        Starts listening on a background thread.
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.socket_path)), exist_ok=True)
+        if os.path.exists(self.socket_path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.socket_path)
+            except OSError:
+                # Left behind by a gateway that didn't shut down cleanly.
+                os.unlink(self.socket_path)
+            else:
+                raise RuntimeError(f"A gateway is already listening on {self.socket_path}")
+            finally:
+                probe.close()
+
+        gateway = self
+
+        class Handler(socketserver.BaseRequestHandler):
+            def handle(self):
+                gateway._serve_session(self.request)
+
+        old_umask = os.umask(0o177)
+        try:
+            self._server = socketserver.ThreadingUnixStreamServer(self.socket_path, Handler)
+        finally:
+            os.umask(old_umask)
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True,
+                name="gateway-server")
+        self._thread.start()
+        logger.info(f"Gateway listening on {self.socket_path}")
+        return self
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._thread.join()
+            with self._lock:
+                sessions = list(self.sessions)
+            for sock in sessions:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+            self._server = None
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+        self.pool.shutdown(wait=False)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--socket", default=DEFAULT_SOCKET_PATH,
+            help="Unix socket to listen on")
+    parser.add_argument("--workers", type=int, default=DEFAULT_WORKERS,
+            help="calls run at the same time")
+    parser.add_argument("--coalesce-window", type=float, default=DEFAULT_COALESCE_WINDOW,
+            help="seconds to gather quote requests into one batch")
+    args = parser.parse_args()
+
+    logging.basicConfig(filename=os.path.join(LOG_DIR, "gateway.log"), level=logging.INFO)
+    from td.td_client import TDClient
+
+    client = TDClient(coalesce_window=args.coalesce_window, pool_maxsize=args.workers)
+    gateway = Gateway(client, args.socket, workers=args.workers).start()
+    stop = threading.Event()
+    for signum in (signal.SIGINT, signal.SIGTERM):
+        signal.signal(signum, lambda *_ : stop.set())
+    while not stop.wait(60):
+        logger.info(f"Gateway stats {gateway.stats()}")
+    gateway.stop()
+    client.tokens.stop()
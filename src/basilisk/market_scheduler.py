@@ -0,0 +1,175 @@
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(THISDIR, "..")
+
+if SRC_DIR not in sys.path:
+    sys.path.append(SRC_DIR)
+
+from data.market_calendar import now_ms
+from data.resample import MARKET_TZ
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+# Seconds before the open that warm-up hooks run.
+DEFAULT_WARM_UP_LEAD = 300
+# Longest a suspended loop sleeps before checking the calendar again, in
+# case its hours changed.
+MAX_SUSPEND = 3600
+# Seconds after a bar boundary before the bar is fetched, so the API has
+# finished it.
+BAR_SETTLE_DELAY = 2.0
+
+def next_boundary(interval, now=None, delay=0.0):
+    """
+    The next multiple of `interval` seconds after `now` (default now) in
+    New York time, plus `delay`, as epoch seconds. Bars of any length line
+    up with the exchange clock, not with whenever the process started.
+    """
+    now = time.time() if now is None else now
+    offset = datetime.fromtimestamp(now, MARKET_TZ).utcoffset().total_seconds()
+    local = now + offset
+    boundary = (local // interval + 1) * interval - offset + delay
+    if boundary - interval > now:
+        # The delay put the previous boundary still ahead of us.
+        boundary -= interval
+    return boundary
+
+def sleep_until(when, stop):
+    """
+    Waits until epoch seconds `when` or until `stop` is set. Returns False
+    if stopped.
+    """
+    while not stop.is_set():
+        delay = when - time.time()
+        if delay <= 0:
+            return True
+        stop.wait(min(delay, MAX_SUSPEND))
+    return False
+
+class MarketScheduler():
+    """
+    Tells polling loops when their market is open, using a MarketCalendar.
+    The runner and the feeds ask it before each tick and sleep through the
+    closed hours instead of polling quotes overnight and on weekends.
+
+    A background thread refreshes the calendar once a day and, `lead`
+    seconds before each session of `market` opens, runs the warm-up hooks
+    (e.g. refresh the access token, fill the quote and fundamentals caches,
+    backfill the candle store) so the first ticks of the day don't wait on
+    them.
+
+    Args:
+    - calendar: the MarketCalendar.
+    - market: market whose open triggers the warm-up hooks.
+    - extended_hours: whether pre and post market count as open for it.
+    - lead: seconds before the open to warm up.
+    """
+
+    def __init__(self, calendar, market="EQUITY", extended_hours=False, lead=DEFAULT_WARM_UP_LEAD):
+        self.calendar = calendar
+        self.market = market
+        self.extended_hours = extended_hours
+        self.lead = lead
+        self.warmed = None
+        self._warm_ups = []
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="market-scheduler")
+
+    def is_open(self, market=None, extended_hours=None, when=None):
+        """
+        Whether `market` is open at epoch seconds `when` (default now).
+        """
+        market = self.market if market is None else market
+        extended_hours = self.extended_hours if extended_hours is None else extended_hours
+        return self.calendar.is_open(market, None if when is None else int(when * 1000),
+                extended_hours)
+
+    def seconds_until_open(self, market=None, extended_hours=None):
+        """
+        0 while `market` is open, else seconds to its next session (capped
+        at MAX_SUSPEND if the calendar knows of none).
+        """
+        market = self.market if market is None else market
+        extended_hours = self.extended_hours if extended_hours is None else extended_hours
+        now = now_ms()
+        opens = self.calendar.next_open(market, now, extended_hours)
+        if opens is None:
+            return MAX_SUSPEND
+        return max(0.0, (opens - now) / 1000)
+
+    def wait_until_open(self, stop, market=None, extended_hours=None):
+        """
+        Blocks while `market` is closed. Returns True once it's open, False
+        if `stop` (a threading.Event) was set first.
+        """
+        while not stop.is_set():
+            delay = self.seconds_until_open(market, extended_hours)
+            if delay <= 0:
+                return True
+            logger.info(f"{market or self.market} closed, polling resumes in {delay / 60:.0f} min")
+            stop.wait(min(delay, MAX_SUSPEND))
+        return False
+
+    def add_warm_up(self, hook):
+        """
+        Registers a callable to run before each open.
+        """
+        self._warm_ups.append(hook)
+        return hook
+
+    def warm_up(self):
+        for hook in self._warm_ups:
+            try:
+                hook()
+            except Exception as e:
+                logger.error(f"Warm-up {getattr(hook, '__name__', hook)} failed with exception: {e}")
+
+    def next_warm_up(self):
+        """
+        Epoch seconds to run the warm-up for the next session start, and
+        that start (epoch ms), or (None, None).
+        """
+        now = now_ms()
+        opens = self.calendar.next_open(self.market, now, self.extended_hours)
+        if opens is not None and opens <= now:
+            # Open now: the next warm-up is for the session after this one.
+            closes = self.calendar.next_close(self.market, now, self.extended_hours)
+            opens = self.calendar.next_open(self.market, closes, self.extended_hours)
+        if opens is None:
+            return None, None
+        return opens / 1000 - self.lead, opens
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.calendar.refresh()
+                when, opens = self.next_warm_up()
+            except Exception as e:
+                logger.error(f"Market scheduler failed with exception: {e}")
+                when, opens = None, None
+            if when is not None and when <= time.time() and opens != self.warmed:
+                logger.info(f"Warming up for the {self.market} open")
+                self.warm_up()
+                self.warmed = opens
+                continue
+            # Wake for the warm-up or, at the latest, to refresh the calendar.
+            wake = time.time() + MAX_SUSPEND
+            if when is not None and opens != self.warmed:
+                wake = min(wake, when)
+            sleep_until(wake, self._stop)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
@@ -0,0 +1,174 @@
+import heapq
+import logging
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import contextmanager
+
+from data.metrics import METRICS
+from data.quote_table import attach_worker
+from market_scheduler import MAX_SUSPEND
+
+logger = logging.getLogger(__name__)
+
+class StrategyRunner():
+    """
+    Runs many strategies at once, each on its own schedule.
+
+    Every strategy gets its own slot in a thread pool, so a strategy that
+    takes longer than its interval only skips its own ticks and never holds
+    up anyone else's. CPU-bound strategies do their `compute` step in a
+    process pool to get around the GIL. All strategies share the client
+    objects (and so their caches) they were built with.
+
+    With `quote_table` (the name of a SharedQuoteTable) every process pool
+    worker maps the table at startup, and `compute` can read the latest
+    quotes through data.quote_table.worker_quotes() without any requests
+    of its own.
+
+    With a MarketScheduler, a strategy isn't ticked while its `market` is
+    closed; its next tick is put off until the open instead.
+
+    If a strategy's client has a quote coalescer, each tick runs inside a
+    coalescer tick that starts by fetching all of the strategy's `symbols`,
+    so its quote calls during the tick don't make requests of their own.
+    """
+
+    def __init__(self, strats, cpu_workers=None, quote_table=None, scheduler=None):
+        self.strats = list(strats)
+        self.io_pool = ThreadPoolExecutor(max_workers=max(1, len(self.strats)),
+                thread_name_prefix="strat")
+        self.cpu_pool = None
+        if any(getattr(strat, "cpu_bound", False) for strat in self.strats):
+            if quote_table is not None:
+                self.cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers,
+                        initializer=attach_worker, initargs=(quote_table,))
+            else:
+                self.cpu_pool = ProcessPoolExecutor(max_workers=cpu_workers)
+        self._inflight = {}
+        self.ticks = {id(strat) : 0 for strat in self.strats}
+        self.skipped = {id(strat) : 0 for strat in self.strats}
+        self.suspended = {id(strat) : 0 for strat in self.strats}
+        self.scheduler = scheduler
+        self._stop = threading.Event()
+
+    def run_tick(self, strat):
+        """
+        Runs one tick of `strat`. Called on a worker thread.
+        """
+        name = type(strat).__name__
+        try:
+            with METRICS.span("strategy_tick_seconds", strategy=name), self.quote_tick(strat):
+                if getattr(strat, "cpu_bound", False):
+                    with METRICS.span("strategy_prepare_seconds", strategy=name):
+                        inputs = strat.prepare()
+                    with METRICS.span("strategy_compute_seconds", strategy=name):
+                        result = self.cpu_pool.submit(strat.compute, inputs).result()
+                    strat.handle(result)
+                else:
+                    strat.run()
+        except Exception as e:
+            METRICS.counter("strategy_errors_total", strategy=name).inc()
+            logger.error(f"Strategy {name} failed with exception: {e}", exc_info=True)
+
+    @staticmethod
+    @contextmanager
+    def quote_tick(strat):
+        """
+        Coalescer tick for `strat`'s client, with its symbols prefetched. A
+        failed prefetch is logged and the strategy fetches its own quotes.
+        """
+        coalescer = getattr(getattr(strat, "client", None), "coalescer", None)
+        if coalescer is None:
+            yield
+            return
+        with coalescer.tick():
+            symbols = getattr(strat, "symbols", None)
+            if symbols:
+                try:
+                    coalescer.prefetch(symbols)
+                except Exception as e:
+                    logger.error(f"Quote prefetch for {type(strat).__name__} failed with "
+                            f"exception: {e}")
+            yield
+
+    def submit(self, strat):
+        """
+        Starts a tick of `strat` unless its previous one is still running.
+        Returns True if a tick was started.
+        """
+        future = self._inflight.get(id(strat))
+        if future is not None and not future.done():
+            self.skipped[id(strat)] += 1
+            METRICS.counter("strategy_skipped_ticks_total", strategy=type(strat).__name__).inc()
+            logger.warning(f"Strategy {type(strat).__name__} overran its interval, skipping tick")
+            return False
+        self._inflight[id(strat)] = self.io_pool.submit(self.run_tick, strat)
+        self.ticks[id(strat)] += 1
+        return True
+
+    def closed_for(self, strat):
+        """
+        Seconds until the market `strat` trades opens, 0 if it's open or
+        there's no scheduler.
+        """
+        market = getattr(strat, "market", None)
+        if self.scheduler is None or market is None:
+            return 0
+        extended_hours = getattr(strat, "extended_hours", False)
+        if self.scheduler.is_open(market, extended_hours):
+            return 0
+        return min(self.scheduler.seconds_until_open(market, extended_hours), MAX_SUSPEND)
+
+    def run(self, duration=None, max_ticks=None):
+        """
+        Ticks every strategy at its own interval until `duration` seconds
+        have passed or each strategy has been ticked `max_ticks` times
+        (forever if neither is given), or until stop() is called.
+        Strategies with no interval are event-driven and aren't ticked; with
+        only those, this waits for `duration` or stop() while the event bus
+        drives them.
+        """
+        start = time.monotonic()
+        schedule = [(start, i) for i, strat in enumerate(self.strats)
+                if getattr(strat, "interval", 1.0) is not None]
+        heapq.heapify(schedule)
+        if not schedule:
+            self._stop.wait(duration)
+        try:
+            while schedule and not self._stop.is_set():
+                due, i = heapq.heappop(schedule)
+                if duration is not None and due - start >= duration:
+                    break
+                delay = due - time.monotonic()
+                if delay > 0 and self._stop.wait(delay):
+                    break
+                strat = self.strats[i]
+                closed_for = self.closed_for(strat)
+                if closed_for > 0:
+                    self.suspended[id(strat)] += 1
+                    heapq.heappush(schedule, (time.monotonic() + closed_for, i))
+                    continue
+                self.submit(strat)
+                if max_ticks is not None and self.ticks[id(strat)] >= max_ticks:
+                    continue
+                heapq.heappush(schedule, (due + getattr(strat, "interval", 1.0), i))
+        finally:
+            self.wait()
+
+    def stop(self):
+        """
+        Makes run() return after the ticks in progress finish. Safe to call
+        from a signal handler.
+        """
+        self._stop.set()
+
+    def wait(self):
+        for future in list(self._inflight.values()):
+            future.result()
+
+    def shutdown(self):
+        self.wait()
+        self.io_pool.shutdown()
+        if self.cpu_pool is not None:
+            self.cpu_pool.shutdown()
@@ -0,0 +1,288 @@
+import asyncio
+import json
+import logging
+import numbers
+import os
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..", "..")
+SRC_DIR = os.path.join(THISDIR, "..")
+CLIENT_DIR = os.path.join(THISDIR, "clients")
+SCREENER_DIR = os.path.join(BASE_DIR, "screener")
+
+for path in [SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+from td.scheduler import PRIORITY_LOW
+
+logger = logging.getLogger(__name__)
+
+DAY_IN_SEC = 24 * 60 * 60
+DEFAULT_FUNDAMENTALS_MAX_AGE = DAY_IN_SEC
+DEFAULT_CONCURRENCY = 4
+
+class ScreenTable():
+    """
+    Columnar table of screening data: a `symbol` array plus one float64
+    column per numeric field, aligned by row. Missing values are NaN, so
+    comparisons on them are simply False.
+
+        table.filter("peRatio < 20 and marketCap > 1000").sort("volatility").head(50)
+    """
+
+    def __init__(self, symbols, columns):
+        self.symbols = np.asarray(symbols, dtype=object)
+        self.columns = {name : np.asarray(values, dtype=np.float64)
+                for name, values in columns.items()}
+
+    @classmethod
+    def from_records(cls, records, symbols=None):
+        """
+        Builds a table from a dict of symbol to flat dict of fields (e.g. a
+        quotes response). Every numeric field becomes a column.
+        """
+        symbols = list(records) if symbols is None else list(symbols)
+        names = []
+        seen = set()
+        for symbol in symbols:
+            for name, value in records.get(symbol, {}).items():
+                if name not in seen and isinstance(value, numbers.Real) and not isinstance(value, bool):
+                    seen.add(name)
+                    names.append(name)
+        columns = {name : np.full(len(symbols), np.nan) for name in names}
+        for i, symbol in enumerate(symbols):
+            record = records.get(symbol)
+            if not record:
+                continue
+            for name in names:
+                value = record.get(name)
+                if isinstance(value, numbers.Real) and not isinstance(value, bool):
+                    columns[name][i] = value
+        return cls(symbols, columns)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def __getitem__(self, name):
+        if name == "symbol":
+            return self.symbols
+        return self.columns[name]
+
+    def __contains__(self, name):
+        return name == "symbol" or name in self.columns
+
+    def take(self, rows):
+        return ScreenTable(self.symbols[rows],
+                {name : values[rows] for name, values in self.columns.items()})
+
+    def join(self, other):
+        """
+        Adds `other`'s columns, matched on symbol. Rows `other` doesn't have
+        get NaN. Columns already in this table win.
+        """
+        index = {symbol : i for i, symbol in enumerate(other.symbols)}
+        rows = np.array([index.get(symbol, -1) for symbol in self.symbols], dtype=np.int64)
+        present = rows >= 0
+        columns = dict(self.columns)
+        for name, values in other.columns.items():
+            if name in columns:
+                continue
+            joined = np.full(len(self), np.nan)
+            joined[present] = values[rows[present]]
+            columns[name] = joined
+        return ScreenTable(self.symbols, columns)
+
+    def mask(self, condition):
+        """
+        Evaluates a filter to a boolean array. `condition` can be:
+        - an expression over column names, e.g. "lastPrice > 5 and beta < 1.5",
+            evaluated on whole columns with pandas.eval;
+        - a callable taking the table and returning a boolean array;
+        - a boolean array.
+        """
+        if isinstance(condition, str):
+            result = pd.eval(condition, local_dict=dict(self.columns, symbol=self.symbols))
+        elif callable(condition):
+            result = condition(self)
+        else:
+            result = condition
+        result = np.asarray(result, dtype=bool)
+        if result.shape != (len(self),):
+            raise ValueError(f"Filter {condition!r} didn't produce one value per row")
+        return result
+
+    def filter(self, *conditions):
+        """
+        Rows matching every condition (see `mask`).
+        """
+        keep = np.ones(len(self), dtype=bool)
+        for condition in conditions:
+            keep &= self.mask(condition)
+        return self.take(np.flatnonzero(keep))
+
+    def sort(self, by, descending=False):
+        """
+        Sorts on a column, NaNs last.
+        """
+        values = self.columns[by]
+        order = np.argsort(-values if descending else values, kind="stable")
+        return self.take(order)
+
+    def head(self, n):
+        return self.take(slice(0, n))
+
+    def to_frame(self):
+        return pd.DataFrame(self.columns, index=pd.Index(self.symbols, name="symbol"), copy=False)
+
+    def save(self, path, **meta):
+        """
+        Writes the table (and any metadata, e.g. when it was fetched) to a
+        .npz file.
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        names = list(self.columns)
+        tmp = path + ".tmp.npz"
+        np.savez(tmp, symbols=self.symbols.astype(str), names=np.array(names, dtype=str),
+                meta=np.array(json.dumps(meta)), **{f"column_{i}" : self.columns[name]
+                for i, name in enumerate(names)})
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Reads a table written by `save`. Returns (table, meta).
+        """
+        with np.load(path) as data:
+            names = [str(name) for name in data["names"]]
+            columns = {name : data[f"column_{i}"] for i, name in enumerate(names)}
+            table = cls(data["symbols"].astype(object), columns)
+            meta = json.loads(str(data["meta"]))
+        return table, meta
+
+def fundamental_records(response):
+    """
+    Flattens an instruments response to symbol -> fundamental fields.
+    """
+    return {symbol : entry.get("fundamental", entry) for symbol, entry in response.items()}
+
+def load_universe(path):
+    """
+    Reads a universe file: one symbol per line, blank lines and # comments
+    ignored.
+    """
+    symbols = []
+    with open(path) as f:
+        for line in f:
+            symbol = line.split("#", 1)[0].strip().upper()
+            if symbol and symbol not in symbols:
+                symbols.append(symbol)
+    return symbols
+
+class Screener():
+    """
+    Scans a universe of symbols using fundamentals and quotes fetched in
+    batches of up to 500 symbols per request. With `concurrency` > 1 the
+    batches go out in parallel through an AsyncTDClient; either way they
+    share the client's rate limiter and run in its low priority lane so
+    live trading requests go first.
+
+    Fundamentals only change daily, so they are kept on disk under
+    `cache_dir` and reused for `fundamentals_max_age` seconds. The last
+    quotes are kept too and reused if a scan passes `quotes_max_age`.
+    A scan of 5,000 symbols is 10 fundamentals and 10 quotes requests.
+    """
+
+    def __init__(self, client, universe, cache_dir=SCREENER_DIR,
+            fundamentals_max_age=DEFAULT_FUNDAMENTALS_MAX_AGE, concurrency=DEFAULT_CONCURRENCY):
+        self.client = client
+        self.universe = list(dict.fromkeys(universe))
+        self.cache_dir = cache_dir
+        self.fundamentals_max_age = fundamentals_max_age
+        self.concurrency = concurrency
+
+    def cache_path(self, name):
+        return os.path.join(self.cache_dir, f"{name}.npz")
+
+    def _cached(self, name, max_age):
+        """
+        The cached table `name` if it's younger than `max_age` and covers
+        the whole universe, cut down to the universe's rows in its order.
+        """
+        path = self.cache_path(name)
+        if not max_age or not os.path.exists(path):
+            return None
+        try:
+            table, meta = ScreenTable.load(path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Ignoring unreadable screener cache {path}: {e}")
+            return None
+        if time.time() - meta.get("fetched", 0) > max_age:
+            return None
+        if not set(self.universe) <= set(meta.get("universe", [])):
+            return None
+        index = {symbol : i for i, symbol in enumerate(table.symbols)}
+        if any(symbol not in index for symbol in self.universe):
+            return None
+        return table.take(np.array([index[symbol] for symbol in self.universe], dtype=np.int64))
+
+    def _fetch(self, kind):
+        symbols = self.universe
+        if self.concurrency > 1:
+            from td.async_client import AsyncTDClient
+
+            async def fetch():
+                async with AsyncTDClient(self.client, concurrency=self.concurrency) as client:
+                    if kind == "fundamentals":
+                        return await client.get_fundamentals_many(symbols, priority=PRIORITY_LOW)
+                    return await client.get_quotes_many(symbols, priority=PRIORITY_LOW)
+
+            return asyncio.run(fetch())
+        if kind == "fundamentals":
+            return self.client.get_fundamentals_many(symbols, priority=PRIORITY_LOW)
+        return self.client.fetch_quotes(symbols, priority=PRIORITY_LOW)
+
+    def _load(self, kind, max_age, records):
+        table = self._cached(kind, max_age)
+        if table is not None:
+            logger.info(f"Using cached {kind} for {len(self.universe)} symbols")
+            return table
+        start = time.time()
+        response = self._fetch(kind)
+        table = ScreenTable.from_records(records(response), symbols=self.universe)
+        table.save(self.cache_path(kind), fetched=start, universe=self.universe)
+        logger.info(f"Fetched {kind} for {len(self.universe)} symbols in {time.time() - start:.1f}s")
+        return table
+
+    def fundamentals(self, max_age=None):
+        if max_age is None:
+            max_age = self.fundamentals_max_age
+        return self._load("fundamentals", max_age, fundamental_records)
+
+    def quotes(self, max_age=0):
+        return self._load("quotes", max_age, lambda response : response)
+
+    def table(self, quotes_max_age=0):
+        """
+        Quotes and fundamentals for the whole universe in one table. Quote
+        fields win where both have a column of the same name.
+        """
+        return self.quotes(quotes_max_age).join(self.fundamentals())
+
+    def scan(self, *conditions, sort=None, descending=False, limit=None, quotes_max_age=0):
+        """
+        Returns the rows of the universe table matching every condition
+        (expressions, callables or masks, see ScreenTable.mask), optionally
+        sorted and cut to `limit` rows.
+        """
+        result = self.table(quotes_max_age).filter(*conditions)
+        if sort is not None:
+            result = result.sort(sort, descending=descending)
+        if limit is not None:
+            result = result.head(limit)
+        return result
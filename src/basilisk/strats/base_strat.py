@@ -0,0 +1,67 @@
+class Strategy():
+    """
+    Base class for strategies run by a BasiliskSession.
+
+    Event-driven strategies list their `symbols` and implement `on_quote`,
+    `on_bar` (with a `timeframe`) and/or `on_fill`. The session's event bus
+    calls these on the strategy's own thread with data fetched once for all
+    strategies. `on_fill` gets the client order id and td.orders.Order of
+    every fill on the strategy's client.
+
+    Polling strategies implement `run`, which is called every `interval`
+    seconds on a worker thread and may use the shared client freely.
+
+    CPU-heavy strategies set `cpu_bound = True` and split each tick in three:
+    `prepare` gathers inputs with the client on a worker thread, `compute`
+    does the number crunching in a separate process (so it must be a
+    staticmethod taking and returning picklable values), and `handle` acts
+    on the result back in the session process. When the session runs with
+    shared quotes, `compute` can read the latest quotes for the cpu-bound
+    strategies' symbols from data.quote_table.worker_quotes().
+
+    Strategies are only ticked while their `market` is open (regular hours,
+    or extended hours too with `extended_hours`); set `market = None` to
+    run around the clock. `warm_up` is called a few minutes before each
+    open, e.g. to load data the first tick needs.
+    """
+    # Data the strategy needs from a client, matched against client.provides.
+    requires = []
+    # Symbols whose quotes and bars are delivered to the callbacks.
+    symbols = []
+    # Bar size delivered to on_bar, e.g. "1min", "5min", "1h" or "1d"; None
+    # for no bars. Every size is resampled from the same 1-minute bars.
+    timeframe = None
+    # Seconds between calls to run. None for purely event-driven strategies.
+    interval = 1.0
+    cpu_bound = False
+    # Market whose hours the strategy trades in, one of td_client.MARKETS.
+    market = "EQUITY"
+    extended_hours = False
+
+    def __init__(self, client):
+        self.client = client
+
+    def run(self):
+        pass
+
+    def warm_up(self):
+        pass
+
+    def on_quote(self, symbol, quote):
+        pass
+
+    def on_bar(self, symbol, bar):
+        pass
+
+    def on_fill(self, order_id, fill):
+        pass
+
+    def prepare(self):
+        return None
+
+    @staticmethod
+    def compute(inputs):
+        raise NotImplementedError
+
+    def handle(self, result):
+        pass
@@ -6,13 +6,16 @@ THISDIR = os.path.dirname(os.path.abspath(__file__))
 BASE_DIR = os.path.join(THISDIR, "..", "..", "..")
 SRC_DIR = os.path.join(THISDIR, "..", "..")
 
-class ExampleStrat():
-    requires = ["equity"]
+if THISDIR not in sys.path:
+    sys.path.append(THISDIR)
+
+from base_strat import Strategy
 
-    def __init__(self, client):
-        self.client = client
+class ExampleStrat(Strategy):
+    requires = ["equity"]
+    symbols = ["AAPL"]
+    interval = None
 
-    def run(self):
-        symbol = "AAPL"
-        vol = self.client.get_volatility(symbol)
+    def on_quote(self, symbol, quote):
+        vol = quote["volatility"]
         print(f"{symbol} volatility: {vol}")
@@ -2,10 +2,10 @@ import configparser
 from contextlib import contextmanager
 import os
 import sys
-from sqlalchemy import Column, ForeignKey, Integer, String
+from sqlalchemy import Column, Float, ForeignKey, Index, Integer, String
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship, sessionmaker
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 import sqlite3 as sl
 
 THISDIR = os.path.dirname(os.path.abspath(__file__))
@@ -19,13 +19,34 @@ def get_db_location():
     config.read(os.path.join(CONFDIR, "db.conf"))
     return os.path.join(BASEDIR, str(config["LOCATION"]["location"]))
 
-ENGINE = create_engine(f"sqlite:///{get_db_location()}")
+# Applied to every new SQLite connection. WAL lets readers carry on while the
+# writer thread commits, and synchronous=NORMAL is durable under WAL without
+# an fsync per commit.
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",
+    "PRAGMA busy_timeout=5000",
+]
+
+def make_engine(url):
+    engine = create_engine(url)
+
+    @event.listens_for(engine, "connect")
+    def set_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+        cursor.close()
+
+    return engine
+
+ENGINE = make_engine(f"sqlite:///{get_db_location()}")
+SESSION_FACTORY = sessionmaker(bind=ENGINE, expire_on_commit=False)
 
 @contextmanager
 def db_session():
-    global ENGINE
-    SESSION_FACTORY = sessionmaker(bind=ENGINE,expire_on_commit=False)
-
     session = SESSION_FACTORY()
     try:
         yield session
@@ -63,4 +84,62 @@ class Tokens(Base):
         self.session_token = session_token
         self.session_token_end = session_token_end
 
+class QuoteLog(Base):
+    __tablename__ = "quote_log"
+    id = Column(Integer, primary_key=True)
+    time = Column(Integer)
+    symbol = Column(String)
+    bid = Column(Float)
+    ask = Column(Float)
+    last = Column(Float)
+    volume = Column(Float)
+    __table_args__ = (Index("ix_quote_log_symbol_time", "symbol", "time"),)
+
+class OrderLog(Base):
+    __tablename__ = "order_log"
+    id = Column(Integer, primary_key=True)
+    time = Column(Integer)
+    order_id = Column(String)
+    symbol = Column(String)
+    instruction = Column(String)
+    quantity = Column(Float)
+    order_type = Column(String)
+    price = Column(Float)
+    status = Column(String)
+    __table_args__ = (Index("ix_order_log_order_id", "order_id"),)
+
+class FillLog(Base):
+    __tablename__ = "fill_log"
+    id = Column(Integer, primary_key=True)
+    time = Column(Integer)
+    order_id = Column(String)
+    symbol = Column(String)
+    quantity = Column(Float)
+    price = Column(Float)
+    __table_args__ = (Index("ix_fill_log_order_id", "order_id"),)
+
+class TransactionLog(Base):
+    __tablename__ = "transaction_log"
+    # transactionId from the API, so a transaction downloaded twice is stored once.
+    id = Column(Integer, primary_key=True)
+    time = Column(Integer)
+    type = Column(String)
+    sub_type = Column(String)
+    description = Column(String)
+    order_id = Column(String)
+    symbol = Column(String)
+    asset_type = Column(String)
+    instruction = Column(String)
+    quantity = Column(Float)
+    price = Column(Float)
+    cost = Column(Float)
+    fees = Column(Float)
+    net_amount = Column(Float)
+    # The whole transaction as JSON.
+    data = Column(String)
+    __table_args__ = (
+        Index("ix_transaction_log_time", "time"),
+        Index("ix_transaction_log_symbol_time", "symbol", "time"),
+    )
+
 Base.metadata.create_all(ENGINE)
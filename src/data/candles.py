@@ -0,0 +1,313 @@
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASEDIR = os.path.join(THISDIR, "..", "..")
+CANDLE_DIR = os.path.join(BASEDIR, "candles")
+
+CANDLE_DTYPE = np.dtype([
+    ("datetime", "<i8"),
+    ("open", "<f8"),
+    ("high", "<f8"),
+    ("low", "<f8"),
+    ("close", "<f8"),
+    ("volume", "<f8"),
+])
+
+MINUTE_IN_MS = 60 * 1000
+DAY_IN_MS = 24 * 60 * MINUTE_IN_MS
+BAR_LENGTHS = {
+    "minute"  : MINUTE_IN_MS,
+    "daily"   : DAY_IN_MS,
+    "weekly"  : 7 * DAY_IN_MS,
+    "monthly" : 31 * DAY_IN_MS,
+}
+# How far back the first download for a symbol goes, by frequency type.
+INITIAL_PERIODS = {
+    "minute"  : ("day", 10),
+    "daily"   : ("year", 20),
+    "weekly"  : ("year", 20),
+    "monthly" : ("year", 20),
+}
+
+HISTORY_OUTPUTS = ["json", "array", "frame"]
+
+CANDLE_FIELDS = CANDLE_DTYPE.names
+PRICE_FIELDS = CANDLE_FIELDS[1:]
+
+def candles_to_array(payload):
+    """
+    Converts a pricehistory response (or its candle list) to a structured
+    array with CANDLE_DTYPE.
+    """
+    candles = payload["candles"] if isinstance(payload, dict) else payload
+    records = np.empty(len(candles), dtype=CANDLE_DTYPE)
+    for field in CANDLE_FIELDS:
+        records[field] = np.fromiter((c[field] for c in candles),
+                dtype=CANDLE_DTYPE[field], count=len(candles))
+    return records
+
+class CandleArrays():
+    """
+    Struct-of-arrays view of a candle history: one contiguous column per
+    field, int64 epoch ms for `datetime` and float64 for the rest. Indicator
+    code can work on the columns directly without touching per-bar objects.
+    """
+
+    def __init__(self, datetime, open, high, low, close, volume, symbol=None):
+        self.symbol = symbol
+        self.datetime = np.ascontiguousarray(datetime, dtype=np.int64)
+        self.open = np.ascontiguousarray(open, dtype=np.float64)
+        self.high = np.ascontiguousarray(high, dtype=np.float64)
+        self.low = np.ascontiguousarray(low, dtype=np.float64)
+        self.close = np.ascontiguousarray(close, dtype=np.float64)
+        self.volume = np.ascontiguousarray(volume, dtype=np.float64)
+
+    @classmethod
+    def from_records(cls, records, symbol=None):
+        """
+        Builds the columns from a CANDLE_DTYPE structured array, e.g. one
+        returned by CandleStore.read.
+        """
+        return cls(*(records[field] for field in CANDLE_FIELDS), symbol=symbol)
+
+    @classmethod
+    def from_payload(cls, payload, symbol=None):
+        """
+        Parses a pricehistory response straight into columns.
+        """
+        candles = payload["candles"] if isinstance(payload, dict) else payload
+        if symbol is None and isinstance(payload, dict):
+            symbol = payload.get("symbol")
+        n = len(candles)
+        columns = [np.fromiter((c[field] for c in candles), dtype=CANDLE_DTYPE[field], count=n)
+                for field in CANDLE_FIELDS]
+        return cls(*columns, symbol=symbol)
+
+    def __len__(self):
+        return len(self.datetime)
+
+    def to_records(self):
+        records = np.empty(len(self), dtype=CANDLE_DTYPE)
+        for field in CANDLE_FIELDS:
+            records[field] = getattr(self, field)
+        return records
+
+    def to_frame(self):
+        """
+        Returns a DataFrame indexed by UTC timestamp that wraps the columns.
+        """
+        index = pd.DatetimeIndex(pd.to_datetime(self.datetime, unit="ms", utc=True),
+                name="datetime")
+        return pd.DataFrame({field : getattr(self, field) for field in PRICE_FIELDS},
+                index=index, copy=False)
+
+class CandlePanel():
+    """
+    Candles for several symbols aligned on one time axis. Each price field
+    is a 2-D float64 array of shape (len(datetime), len(symbols)); bars a
+    symbol doesn't have are NaN.
+    """
+
+    def __init__(self, histories):
+        """
+        Args:
+        - histories: dict of symbol to CandleArrays.
+        """
+        self.symbols = list(histories)
+        columns = [histories[symbol] for symbol in self.symbols]
+        if columns:
+            self.datetime = np.unique(np.concatenate([c.datetime for c in columns]))
+        else:
+            self.datetime = np.empty(0, dtype=np.int64)
+        shape = (len(self.datetime), len(self.symbols))
+        for field in PRICE_FIELDS:
+            setattr(self, field, np.full(shape, np.nan))
+        for j, candles in enumerate(columns):
+            rows = np.searchsorted(self.datetime, candles.datetime)
+            for field in PRICE_FIELDS:
+                getattr(self, field)[rows, j] = getattr(candles, field)
+
+    def __getitem__(self, symbol):
+        j = self.symbols.index(symbol)
+        present = ~np.isnan(self.close[:, j])
+        return CandleArrays(self.datetime[present],
+                *(getattr(self, field)[present, j] for field in PRICE_FIELDS), symbol=symbol)
+
+    def to_frame(self):
+        """
+        Returns a DataFrame with (field, symbol) column MultiIndex.
+        """
+        index = pd.DatetimeIndex(pd.to_datetime(self.datetime, unit="ms", utc=True),
+                name="datetime")
+        return pd.concat({field : pd.DataFrame(getattr(self, field), index=index,
+                columns=self.symbols) for field in PRICE_FIELDS}, axis=1)
+
+def format_history(payload, output, symbol=None):
+    """
+    Returns a pricehistory response as requested by get_price_history's
+    `output` argument: "json" (unchanged), "array" (CandleArrays) or "frame"
+    (DataFrame).
+    """
+    if output not in HISTORY_OUTPUTS:
+        raise ValueError(f"Invalid output '{output}' for price history")
+    if output == "json":
+        return payload
+    candles = CandleArrays.from_payload(payload, symbol=symbol)
+    if output == "array":
+        return candles
+    return candles.to_frame()
+
+def now_ms():
+    return int(time.time() * 1000)
+
+class CandleStore():
+    """
+    On-disk candle history, one flat file of CANDLE_DTYPE records per
+    symbol and frequency:
+
+        <root>/<frequency_type>_<frequency>/<SYMBOL>.bin
+
+    Records are kept sorted by datetime and only ever appended, so reads
+    memory-map the file and binary search the range without parsing it.
+    """
+
+    def __init__(self, root=CANDLE_DIR):
+        self.root = root
+        self._lock = threading.Lock()
+
+    def path(self, symbol, frequency_type="minute", frequency=1):
+        return os.path.join(self.root, f"{frequency_type}_{frequency}", f"{symbol}.bin")
+
+    def count(self, symbol, frequency_type="minute", frequency=1):
+        path = self.path(symbol, frequency_type, frequency)
+        if not os.path.exists(path):
+            return 0
+        return os.path.getsize(path) // CANDLE_DTYPE.itemsize
+
+    def read(self, symbol, start=None, end=None, frequency_type="minute", frequency=1):
+        """
+        Returns the stored candles with start <= datetime < end (ms since
+        epoch, either bound optional) as a read-only memory-mapped array.
+        """
+        n = self.count(symbol, frequency_type, frequency)
+        if n == 0:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        candles = np.memmap(self.path(symbol, frequency_type, frequency),
+                dtype=CANDLE_DTYPE, mode="r", shape=(n,))
+        times = candles["datetime"]
+        lo = 0 if start is None else int(np.searchsorted(times, start, side="left"))
+        hi = n if end is None else int(np.searchsorted(times, end, side="left"))
+        return candles[lo:hi]
+
+    def resample(self, symbol, timeframe, start=None, end=None, extended_hours=True,
+            partial=True):
+        """
+        Bars of any timeframe ("5min", "2h", "1d", ("weekly", 1), ...) built
+        from the stored 1-minute history, so higher frequencies don't need
+        their own downloads. See data.resample.resample.
+        """
+        from data.resample import resample
+
+        return resample(self.read(symbol, start=start, end=end), timeframe,
+                extended_hours=extended_hours, partial=partial)
+
+    def last_timestamp(self, symbol, frequency_type="minute", frequency=1):
+        """
+        Returns the datetime of the newest stored candle, or None.
+        """
+        n = self.count(symbol, frequency_type, frequency)
+        if n == 0:
+            return None
+        with open(self.path(symbol, frequency_type, frequency), "rb") as f:
+            f.seek((n - 1) * CANDLE_DTYPE.itemsize)
+            last = np.frombuffer(f.read(CANDLE_DTYPE.itemsize), dtype=CANDLE_DTYPE)
+        return int(last["datetime"][0])
+
+    def append(self, symbol, candles, frequency_type="minute", frequency=1):
+        """
+        Appends candles newer than the last stored one. Returns the number of
+        candles written.
+        """
+        candles = np.asarray(candles, dtype=CANDLE_DTYPE)
+        with self._lock:
+            last = self.last_timestamp(symbol, frequency_type, frequency)
+            if last is not None:
+                candles = candles[candles["datetime"] > last]
+            if len(candles) == 0:
+                return 0
+            candles = np.sort(candles, order="datetime")
+            path = self.path(symbol, frequency_type, frequency)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(candles.tobytes())
+        return len(candles)
+
+    def history_request(self, symbol, frequency_type="minute", frequency=1,
+            extended_hours=True):
+        """
+        Returns the get_price_history kwargs needed to bring `symbol` up to
+        date. The first download asks for the longest period the API allows;
+        after that only the tail after the newest stored candle is requested.
+        """
+        kwargs = {
+            "frequency_type" : frequency_type,
+            "frequency" : frequency,
+            "extended_hours" : extended_hours,
+        }
+        last = self.last_timestamp(symbol, frequency_type, frequency)
+        period_type, period = INITIAL_PERIODS[frequency_type]
+        kwargs["period_type"] = period_type
+        if last is None:
+            kwargs["period"] = period
+        else:
+            kwargs["period"] = None
+            kwargs["start_date"] = last + 1
+            kwargs["end_date"] = now_ms()
+        return kwargs
+
+    def store_history(self, symbol, payload, frequency_type="minute", frequency=1):
+        """
+        Appends the completed candles of a pricehistory response. Candles
+        that are still forming are left for the next backfill.
+        Returns the number of candles added.
+        """
+        candles = candles_to_array(payload)
+        bar_length = BAR_LENGTHS[frequency_type] * frequency
+        complete = candles[candles["datetime"] + bar_length <= now_ms()]
+        return self.append(symbol, complete, frequency_type, frequency)
+
+    def backfill(self, client, symbol, frequency_type="minute", frequency=1,
+            extended_hours=True):
+        """
+        Brings the stored history for `symbol` up to date, downloading only
+        what's missing. Returns the number of candles added.
+        """
+        kwargs = self.history_request(symbol, frequency_type, frequency, extended_hours)
+        payload = client.get_price_history(symbol, **kwargs)
+        return self.store_history(symbol, payload, frequency_type, frequency)
+
+    def backfill_many(self, client, symbols, **kwargs):
+        """
+        Backfills each symbol in turn. Returns a dict of symbol to the number
+        of candles added.
+        """
+        return {symbol : self.backfill(client, symbol, **kwargs) for symbol in symbols}
+
+    async def backfill_many_async(self, client, symbols, frequency_type="minute",
+            frequency=1, extended_hours=True, limit=None):
+        """
+        Same as backfill_many but downloads concurrently through an
+        AsyncTDClient.
+        """
+        async def backfill(symbol):
+            kwargs = self.history_request(symbol, frequency_type, frequency, extended_hours)
+            payload = await client.get_price_history(symbol, **kwargs)
+            return self.store_history(symbol, payload, frequency_type, frequency)
+
+        added = await client.gather([backfill(symbol) for symbol in symbols], limit=limit)
+        return dict(zip(symbols, added))
@@ -0,0 +1,372 @@
+import math
+
+import numpy as np
+
+# Minute bars over a 6.5 hour session, 252 sessions a year.
+BARS_PER_YEAR = 252 * 390
+
+# The streaming and batch paths below use the same floating point operations
+# in the same order, so warming up from stored history and streaming the
+# same bars one at a time give bit-identical values:
+# - rolling sums are updated as sum += (new - evicted), which np.cumsum
+#   reproduces exactly over the array of differences (accumulate is strictly
+#   sequential);
+# - recursive filters (EMA, Wilder smoothing) run the same scalar recurrence
+#   in both paths;
+# - returns are simple returns (x / prev - 1) rather than log returns, since
+#   np.log and math.log may round differently.
+
+class RingBuffer():
+    """
+    Fixed size window over a float64 array. `push` overwrites the oldest
+    value once full and returns the value it evicted (0.0 while filling).
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.values = np.zeros(size)
+        self.count = 0
+        self._head = 0
+
+    def push(self, value):
+        evicted = float(self.values[self._head]) if self.count >= self.size else 0.0
+        self.values[self._head] = value
+        self._head = (self._head + 1) % self.size
+        self.count += 1
+        return evicted
+
+    @property
+    def full(self):
+        return self.count >= self.size
+
+    def window(self):
+        """
+        The buffered values, oldest first.
+        """
+        if self.count < self.size:
+            return self.values[:self.count].copy()
+        return np.roll(self.values, -self._head)
+
+    def load(self, history, count):
+        """
+        Sets the buffer to the last `size` values of `history`, as if all
+        `count` values had been pushed.
+        """
+        tail = np.asarray(history, dtype=np.float64)[-self.size:]
+        self.values[:] = 0.0
+        self.values[:len(tail)] = tail
+        self.count = count
+        self._head = len(tail) % self.size
+
+def rolling_sums(values, period):
+    """
+    Running window sums exactly as RingBuffer-based streaming computes them.
+    """
+    diffs = np.array(values, dtype=np.float64)
+    if len(diffs) > period:
+        diffs[period:] -= values[:-period]
+    return np.cumsum(diffs)
+
+class Indicator():
+    """
+    Base class for indicators updated one bar at a time in O(1).
+
+    `update(value)` takes the next input (the bar's `field`, close by
+    default) and returns the new value, NaN until enough bars have been
+    seen. `batch(values)` computes the whole series over an array without
+    touching the indicator's state, and `warm_up(values)` does the same and
+    leaves the indicator as if it had streamed `values`.
+    """
+    field = "close"
+
+    def __init__(self, field="close"):
+        self.field = field
+        self.value = math.nan
+        self.count = 0
+
+    @property
+    def ready(self):
+        return not math.isnan(self.value)
+
+    def update_bar(self, bar):
+        return self.update(float(bar[self.field]))
+
+    def update(self, value):
+        raise NotImplementedError
+
+    def batch(self, values):
+        raise NotImplementedError
+
+    def warm_up(self, values):
+        raise NotImplementedError
+
+class SMA(Indicator):
+    """
+    Simple moving average over `period` bars.
+    """
+
+    def __init__(self, period, field="close"):
+        super().__init__(field)
+        self.period = period
+        self._window = RingBuffer(period)
+        self._sum = 0.0
+
+    def update(self, value):
+        self._sum += value - self._window.push(value)
+        self.count += 1
+        self.value = self._sum / self.period if self.count >= self.period else math.nan
+        return self.value
+
+    def batch(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        out = rolling_sums(values, self.period) / self.period
+        out[:self.period - 1] = np.nan
+        return out
+
+    def warm_up(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        out = self.batch(values)
+        if len(values):
+            self._sum = float(rolling_sums(values, self.period)[-1])
+            self._window.load(values, len(values))
+            self.count = len(values)
+            self.value = float(out[-1])
+        return out
+
+class EMA(Indicator):
+    """
+    Exponential moving average with alpha = 2 / (period + 1), seeded with
+    the first value. NaN until `period` bars have been seen.
+    """
+
+    def __init__(self, period, field="close"):
+        super().__init__(field)
+        self.period = period
+        self.alpha = 2.0 / (period + 1)
+        self._ema = math.nan
+
+    def update(self, value):
+        if self.count == 0:
+            self._ema = value
+        else:
+            self._ema = self._ema + self.alpha * (value - self._ema)
+        self.count += 1
+        self.value = self._ema if self.count >= self.period else math.nan
+        return self.value
+
+    def _run(self, values):
+        alpha = self.alpha
+        out = np.empty(len(values))
+        ema = math.nan
+        for i, value in enumerate(values.tolist()):
+            ema = value if i == 0 else ema + alpha * (value - ema)
+            out[i] = ema
+        return out, ema
+
+    def batch(self, values):
+        out, _ = self._run(np.asarray(values, dtype=np.float64))
+        out[:self.period - 1] = np.nan
+        return out
+
+    def warm_up(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        out, ema = self._run(values)
+        out[:self.period - 1] = np.nan
+        if len(values):
+            self._ema = ema
+            self.count = len(values)
+            self.value = float(out[-1])
+        return out
+
+class RSI(Indicator):
+    """
+    Wilder's relative strength index. The first average gain and loss are
+    plain means over `period` changes, then smoothed with
+    avg = (avg * (period - 1) + change) / period.
+    """
+
+    def __init__(self, period=14, field="close"):
+        super().__init__(field)
+        self.period = period
+        self._prev = math.nan
+        self._gain = 0.0
+        self._loss = 0.0
+
+    @staticmethod
+    def _rsi(gain, loss):
+        if loss == 0.0:
+            return 100.0 if gain > 0.0 else 50.0
+        return 100.0 - 100.0 / (1.0 + gain / loss)
+
+    def _step(self, value):
+        """
+        Advances the state by one value. Shared by update and batch so both
+        paths do the same arithmetic.
+        """
+        n = self.count
+        self.count += 1
+        if n == 0:
+            self._prev = value
+            return math.nan
+        change = value - self._prev
+        self._prev = value
+        gain = change if change > 0.0 else 0.0
+        loss = -change if change < 0.0 else 0.0
+        if n <= self.period:
+            self._gain += gain
+            self._loss += loss
+            if n < self.period:
+                return math.nan
+            self._gain /= self.period
+            self._loss /= self.period
+        else:
+            self._gain = (self._gain * (self.period - 1) + gain) / self.period
+            self._loss = (self._loss * (self.period - 1) + loss) / self.period
+        return self._rsi(self._gain, self._loss)
+
+    def update(self, value):
+        self.value = self._step(value)
+        return self.value
+
+    def batch(self, values):
+        scratch = RSI(self.period, self.field)
+        return scratch.warm_up(values)
+
+    def warm_up(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        self.count = 0
+        self._gain = 0.0
+        self._loss = 0.0
+        out = np.empty(len(values))
+        for i, value in enumerate(values.tolist()):
+            out[i] = self._step(value)
+        if len(values):
+            self.value = float(out[-1])
+        return out
+
+class Volatility(Indicator):
+    """
+    Annualized standard deviation of the last `period` simple returns.
+    """
+
+    def __init__(self, period=20, bars_per_year=BARS_PER_YEAR, field="close"):
+        super().__init__(field)
+        self.period = period
+        self.scale = math.sqrt(bars_per_year)
+        self._prev = math.nan
+        self._returns = RingBuffer(period)
+        self._squares = RingBuffer(period)
+        self._sum = 0.0
+        self._sum_sq = 0.0
+
+    def _volatility(self, total, total_sq):
+        n = self.period
+        variance = (total_sq - total * total / n) / (n - 1)
+        return math.sqrt(variance if variance > 0.0 else 0.0) * self.scale
+
+    def update(self, value):
+        self.count += 1
+        if self.count == 1:
+            self._prev = value
+            return self.value
+        r = value / self._prev - 1.0
+        self._prev = value
+        square = r * r
+        self._sum += r - self._returns.push(r)
+        self._sum_sq += square - self._squares.push(square)
+        if self._returns.full:
+            self.value = self._volatility(self._sum, self._sum_sq)
+        return self.value
+
+    def _sums(self, values):
+        returns = values[1:] / values[:-1] - 1.0
+        squares = returns * returns
+        return returns, squares, rolling_sums(returns, self.period), rolling_sums(squares, self.period)
+
+    def batch(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        out = np.full(len(values), np.nan)
+        if len(values) <= self.period:
+            return out
+        _, _, sums, sums_sq = self._sums(values)
+        n = self.period
+        variance = (sums_sq - sums * sums / n) / (n - 1)
+        np.maximum(variance, 0.0, out=variance)
+        out[1:] = np.sqrt(variance) * self.scale
+        out[:n] = np.nan
+        return out
+
+    def warm_up(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        out = self.batch(values)
+        if len(values):
+            self.count = len(values)
+            self._prev = float(values[-1])
+            self.value = float(out[-1])
+        if len(values) > 1:
+            returns, squares, sums, sums_sq = self._sums(values)
+            self._sum = float(sums[-1])
+            self._sum_sq = float(sums_sq[-1])
+            self._returns.load(returns, len(returns))
+            self._squares.load(squares, len(squares))
+        return out
+
+class IndicatorSet():
+    """
+    Named indicators for one symbol, all fed the same bars:
+
+        indicators = IndicatorSet({"sma": SMA(20), "rsi": RSI(14)})
+        indicators.warm_up(store.read("AAPL"))
+        ...
+        values = indicators.update(bar)   # {"sma": ..., "rsi": ...}
+    """
+
+    def __init__(self, indicators):
+        self.indicators = dict(indicators)
+
+    def __getitem__(self, name):
+        return self.indicators[name]
+
+    def update(self, bar):
+        """
+        Feeds one bar (a CandleStore record or dict with the candle fields)
+        to every indicator and returns their new values.
+        """
+        return {name : indicator.update_bar(bar) for name, indicator in self.indicators.items()}
+
+    def values(self):
+        return {name : indicator.value for name, indicator in self.indicators.items()}
+
+    def batch(self, candles):
+        """
+        Computes every indicator over a history (structured array or
+        CandleArrays) without changing any state.
+        """
+        return {name : indicator.batch(column(candles, indicator.field))
+                for name, indicator in self.indicators.items()}
+
+    def warm_up(self, candles):
+        """
+        Brings every indicator up to date with a history, leaving them ready
+        to stream the bars that follow it. Returns the batch values.
+        """
+        return {name : indicator.warm_up(column(candles, indicator.field))
+                for name, indicator in self.indicators.items()}
+
+    def warm_up_from_store(self, store, symbol, start=None, frequency_type="minute", frequency=1):
+        """
+        Warms up from the candle store. Returns the time of the last bar
+        used (or None), so a feed can resume from the bar after it.
+        """
+        records = np.array(store.read(symbol, start=start, frequency_type=frequency_type,
+                frequency=frequency))
+        self.warm_up(records)
+        return int(records["datetime"][-1]) if len(records) else None
+
+def column(candles, field):
+    """
+    One field of a history given as a structured array or CandleArrays.
+    """
+    if isinstance(candles, np.ndarray):
+        return candles[field]
+    return getattr(candles, field)
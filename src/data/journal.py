@@ -0,0 +1,330 @@
+import math
+import os
+import threading
+import time
+from urllib.parse import urlsplit
+
+import numpy as np
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASEDIR = os.path.join(THISDIR, "..", "..")
+JOURNAL_DIR = os.path.join(BASEDIR, "journal")
+
+# Every segment starts with a fixed header followed by packed records.
+# `count` is only bumped after a record has been written, so a reader never
+# sees a partial record even if the writer dies mid-append.
+HEADER_SIZE = 64
+HEADER_DTYPE = np.dtype([
+    ("magic", "S8"),
+    ("record_size", "<u4"),
+    ("version", "<u4"),
+    ("count", "<u8"),
+    ("created", "<i8"),
+])
+MAGIC = b"BSKJRNL1"
+VERSION = 1
+
+DEFAULT_SEGMENT_BYTES = 64 * 1024 * 1024
+
+# Times are ns since epoch.
+QUOTE_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("symbol", "S12"),
+    ("bid", "<f8"),
+    ("ask", "<f8"),
+    ("last", "<f8"),
+    ("bid_size", "<f8"),
+    ("ask_size", "<f8"),
+    ("volume", "<f8"),
+])
+REQUEST_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("method", "S8"),
+    ("path", "S64"),
+    ("status", "<i2"),
+    ("priority", "<i2"),
+    ("elapsed", "<f8"),
+    ("size", "<i8"),
+])
+ORDER_DTYPE = np.dtype([
+    ("time", "<i8"),
+    ("event", "S8"),
+    ("order_id", "S24"),
+    ("symbol", "S12"),
+    ("instruction", "S12"),
+    ("order_type", "S12"),
+    ("quantity", "<f8"),
+    ("price", "<f8"),
+    ("status", "S16"),
+])
+
+ORDER_EVENTS = ["order", "replace", "cancel", "fill", "status"]
+
+def segment_paths(directory, name):
+    """
+    Segment files for journal `name`, oldest first.
+    """
+    if not os.path.isdir(directory):
+        return []
+    prefix = f"{name}-"
+    files = [f for f in os.listdir(directory) if f.startswith(prefix) and f.endswith(".bin")]
+    return [os.path.join(directory, f) for f in sorted(files)]
+
+def read_segment(path, dtype):
+    """
+    Maps the committed records of one segment read-only. The returned array
+    is a view of the file, nothing is copied.
+    """
+    dtype = np.dtype(dtype)
+    header = np.fromfile(path, dtype=HEADER_DTYPE, count=1)
+    if len(header) == 0 or header["magic"][0] != MAGIC:
+        raise ValueError(f"{path} is not a journal segment")
+    if header["record_size"][0] != dtype.itemsize:
+        raise ValueError(f"{path} holds {header['record_size'][0]} byte records, "
+                f"expected {dtype.itemsize}")
+    count = int(header["count"][0])
+    if count == 0:
+        return np.empty(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r", offset=HEADER_SIZE, shape=(count,))
+
+def read_journal(name, dtype, root=JOURNAL_DIR, start=None, end=None):
+    """
+    Reads every segment of journal `name` into one structured array,
+    optionally limited to records with start <= time <= end (ns). A single
+    unfiltered segment comes back as a zero-copy view.
+    """
+    parts = []
+    for path in segment_paths(os.path.join(root, name), name):
+        records = read_segment(path, dtype)
+        if start is not None or end is not None:
+            mask = np.ones(len(records), dtype=bool)
+            if start is not None:
+                mask &= records["time"] >= start
+            if end is not None:
+                mask &= records["time"] <= end
+            if not mask.all():
+                records = records[mask]
+        if len(records):
+            parts.append(records)
+    if not parts:
+        return np.empty(0, dtype=dtype)
+    if len(parts) == 1:
+        return parts[0]
+    return np.concatenate(parts)
+
+class Journal():
+    """
+    Append-only journal of fixed size records. Records are written straight
+    into a memory-mapped segment file; once a segment is full a new one is
+    started, so a day of activity is a handful of flat files that
+    read_journal maps back as NumPy structured arrays.
+
+    Appending after a restart continues the last segment if it has room.
+    """
+
+    def __init__(self, name, dtype, root=JOURNAL_DIR, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.name = name
+        self.dtype = np.dtype(dtype)
+        self.directory = os.path.join(root, name)
+        self.capacity = max(1, (segment_bytes - HEADER_SIZE) // self.dtype.itemsize)
+        self.path = None
+        self._map = None
+        self._header = None
+        self._records = None
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def _open(self, path, create):
+        size = HEADER_SIZE + self.capacity * self.dtype.itemsize
+        if create:
+            with open(path, "wb") as f:
+                f.truncate(size)
+        mapped = np.memmap(path, dtype=np.uint8, mode="r+")
+        header = mapped[:HEADER_DTYPE.itemsize].view(HEADER_DTYPE)
+        if create:
+            header["magic"] = MAGIC
+            header["record_size"] = self.dtype.itemsize
+            header["version"] = VERSION
+            header["created"] = time.time_ns()
+        capacity = (len(mapped) - HEADER_SIZE) // self.dtype.itemsize
+        self._map = mapped
+        self._header = header
+        self._records = mapped[HEADER_SIZE:HEADER_SIZE + capacity * self.dtype.itemsize].view(self.dtype)
+        self._count = int(header["count"][0])
+        self.path = path
+
+    def _next_segment(self):
+        paths = segment_paths(self.directory, self.name)
+        if paths:
+            last = os.path.basename(paths[-1])
+            number = int(last[len(self.name) + 1:-len(".bin")]) + 1
+        else:
+            number = 1
+        return os.path.join(self.directory, f"{self.name}-{number:06d}.bin")
+
+    def _ensure_segment(self):
+        if self._records is not None and self._count < len(self._records):
+            return
+        if self._records is None:
+            os.makedirs(self.directory, exist_ok=True)
+            paths = segment_paths(self.directory, self.name)
+            if paths:
+                header = np.fromfile(paths[-1], dtype=HEADER_DTYPE, count=1)
+                if (len(header) and header["magic"][0] == MAGIC
+                        and header["record_size"][0] == self.dtype.itemsize):
+                    self._open(paths[-1], create=False)
+                    if self._count < len(self._records):
+                        return
+        self._close_segment()
+        self._open(self._next_segment(), create=True)
+
+    def _close_segment(self):
+        if self._map is not None:
+            self._map.flush()
+        self._map = None
+        self._header = None
+        self._records = None
+        self._count = 0
+
+    def append(self, record):
+        """
+        Appends one record, given as a tuple in dtype field order.
+        """
+        with self._lock:
+            self._ensure_segment()
+            self._records[self._count] = record
+            self._count += 1
+            self._header["count"] = self._count
+
+    def append_many(self, records):
+        """
+        Appends a structured array (or anything convertible to one).
+        """
+        records = np.asarray(records, dtype=self.dtype)
+        with self._lock:
+            written = 0
+            while written < len(records):
+                self._ensure_segment()
+                n = min(len(records) - written, len(self._records) - self._count)
+                self._records[self._count:self._count + n] = records[written:written + n]
+                self._count += n
+                self._header["count"] = self._count
+                written += n
+
+    def read(self, start=None, end=None):
+        return read_journal(self.name, self.dtype, os.path.dirname(self.directory), start, end)
+
+    def flush(self):
+        with self._lock:
+            if self._map is not None:
+                self._map.flush()
+
+    def close(self):
+        with self._lock:
+            self._close_segment()
+
+class AuditLog():
+    """
+    The quote, request and order journals for one session, under
+    `<root>/quotes`, `<root>/requests` and `<root>/orders`. Segment files are
+    only created once something is logged to them.
+    """
+
+    def __init__(self, root=JOURNAL_DIR, segment_bytes=DEFAULT_SEGMENT_BYTES):
+        self.root = root
+        self.quotes = Journal("quotes", QUOTE_DTYPE, root, segment_bytes)
+        self.requests = Journal("requests", REQUEST_DTYPE, root, segment_bytes)
+        self.orders = Journal("orders", ORDER_DTYPE, root, segment_bytes)
+
+    def log_quote(self, symbol, quote):
+        """
+        Logs a quote dict keyed by REST quote field names (bidPrice,
+        askPrice, ...). Missing fields are stored as NaN.
+        """
+        get = quote.get
+        self.quotes.append((
+            time.time_ns(),
+            symbol,
+            get("bidPrice", math.nan),
+            get("askPrice", math.nan),
+            get("lastPrice", math.nan),
+            get("bidSize", math.nan),
+            get("askSize", math.nan),
+            get("totalVolume", math.nan),
+        ))
+
+    def log_request(self, method, url, status, elapsed, priority=-1, size=0):
+        self.requests.append((
+            time.time_ns(),
+            method,
+            urlsplit(url).path,
+            status,
+            priority,
+            elapsed,
+            size,
+        ))
+
+    def log_order(self, event, order_id, symbol="", instruction="", order_type="",
+            quantity=math.nan, price=math.nan, status=""):
+        """
+        Logs an order event, one of ORDER_EVENTS.
+        """
+        if event not in ORDER_EVENTS:
+            raise ValueError("Invalid event passed to 'log_order'")
+        self.orders.append((
+            time.time_ns(),
+            event,
+            str(order_id),
+            symbol,
+            instruction,
+            order_type,
+            quantity,
+            price,
+            status,
+        ))
+
+    def log_fill(self, order_id, symbol, quantity, price):
+        self.log_order("fill", order_id, symbol, quantity=quantity, price=price, status="FILLED")
+
+    def flush(self):
+        for journal in [self.quotes, self.requests, self.orders]:
+            journal.flush()
+
+    def close(self):
+        for journal in [self.quotes, self.requests, self.orders]:
+            journal.close()
+
+class CombinedLog():
+    """
+    Hands every event to several logs, e.g. an AuditLog and a
+    data.writer.DatabaseLog, for clients that take a single journal.
+    """
+
+    def __init__(self, *logs):
+        self.logs = logs
+
+    def log_quote(self, symbol, quote):
+        for log in self.logs:
+            log.log_quote(symbol, quote)
+
+    def log_request(self, method, url, status, elapsed, priority=-1, size=0):
+        for log in self.logs:
+            log.log_request(method, url, status, elapsed, priority, size)
+
+    def log_order(self, event, order_id, symbol="", instruction="", order_type="",
+            quantity=math.nan, price=math.nan, status=""):
+        for log in self.logs:
+            log.log_order(event, order_id, symbol, instruction, order_type, quantity, price,
+                    status)
+
+    def log_fill(self, order_id, symbol, quantity, price):
+        for log in self.logs:
+            log.log_fill(order_id, symbol, quantity, price)
+
+    def flush(self):
+        for log in self.logs:
+            log.flush()
+
+    def close(self):
+        for log in self.logs:
+            log.close()
@@ -0,0 +1,247 @@
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from data.resample import EXTENDED_SESSION, MARKET_TZ, REGULAR_SESSION
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..", "..")
+CALENDAR_DIR = os.path.join(BASE_DIR, "calendar")
+CALENDAR_PATH = os.path.join(CALENDAR_DIR, "market_hours.json")
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+MARKETS = ["EQUITY", "OPTION", "FUTURE", "FOREX", "BOND"]
+REGULAR = "regularMarket"
+# Days fetched ahead on each refresh, today included. A week always reaches
+# past a weekend plus a holiday.
+DEFAULT_DAYS = 7
+# Days of past hours kept.
+KEEP_DAYS = 7
+
+def to_ms(timestamp):
+    """
+    Epoch ms of an ISO-8601 time with a UTC offset, as in sessionHours.
+    """
+    return int(datetime.fromisoformat(timestamp).timestamp() * 1000)
+
+def now_ms():
+    return int(time.time() * 1000)
+
+def market_date(when=None):
+    """
+    The New York date at epoch ms `when` (default now).
+    """
+    seconds = time.time() if when is None else when / 1000
+    return datetime.fromtimestamp(seconds, MARKET_TZ).date()
+
+def local_ms(day, minute):
+    """
+    Epoch ms of `minute` minutes after midnight New York time on `day`.
+    """
+    local = datetime(day.year, day.month, day.day) + timedelta(minutes=minute)
+    return int(local.replace(tzinfo=MARKET_TZ).timestamp() * 1000)
+
+def parse_market_hours(response):
+    """
+    Flattens a market hours response to market -> sorted [start, end, name]
+    sessions (epoch ms), across all of a market's products. A closed market
+    has no sessions.
+    """
+    markets = {}
+    for market, products in response.items():
+        sessions = markets.setdefault(market.upper(), [])
+        for product in products.values():
+            if not product.get("isOpen", False):
+                continue
+            for name, spans in (product.get("sessionHours") or {}).items():
+                for span in spans:
+                    sessions.append([to_ms(span["start"]), to_ms(span["end"]), name])
+        sessions.sort()
+    return markets
+
+def fallback_sessions(market, day):
+    """
+    Sessions assumed for a day the calendar has no hours for: weekday
+    equity hours for EQUITY and OPTION, and open all day for the others,
+    so missing data never stops a strategy that should be running.
+    """
+    if market not in ("EQUITY", "OPTION"):
+        return [[local_ms(day, 0), local_ms(day, 24 * 60), REGULAR]]
+    if day.weekday() >= 5:
+        return []
+    sessions = [[local_ms(day, REGULAR_SESSION[0]), local_ms(day, REGULAR_SESSION[1]), REGULAR]]
+    if market == "EQUITY":
+        sessions.insert(0, [local_ms(day, EXTENDED_SESSION[0]), local_ms(day, REGULAR_SESSION[0]),
+                "preMarket"])
+        sessions.append([local_ms(day, REGULAR_SESSION[1]), local_ms(day, EXTENDED_SESSION[1]),
+                "postMarket"])
+    return sessions
+
+def merge(sessions):
+    """
+    Joins touching or overlapping [start, end) spans.
+    """
+    merged = []
+    for start, end in sorted(sessions):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+class MarketCalendar():
+    """
+    Trading sessions for each market over the coming days, from the market
+    hours endpoint. The hours are fetched once a day for `days` days ahead
+    (one request per day covering every market) and kept on disk, so a
+    restart doesn't fetch them again.
+
+    Times are epoch ms. Sessions named regularMarket are the regular
+    session; with extended_hours the pre and post market sessions count
+    too.
+
+        calendar = MarketCalendar(client)
+        calendar.refresh()
+        calendar.is_open("EQUITY")
+        calendar.next_open("EQUITY")
+    """
+
+    def __init__(self, client, markets=MARKETS, days=DEFAULT_DAYS, path=CALENDAR_PATH):
+        self.client = client
+        self.markets = list(markets)
+        self.days = days
+        self.path = path
+        self.refreshed = None
+        self._hours = {}
+        self._lock = threading.Lock()
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path) as f:
+                saved = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable market calendar {self.path}: {e}")
+            return
+        with self._lock:
+            self._hours = saved.get("hours", {})
+            self.refreshed = saved.get("refreshed")
+
+    def save(self):
+        if self.path is None:
+            return
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        with self._lock:
+            saved = {"refreshed" : self.refreshed, "hours" : self._hours}
+        tmp = self.path + ".tmp"
+        with open(tmp, "w") as f:
+            json.dump(saved, f)
+        os.replace(tmp, self.path)
+
+    def fetch(self, day):
+        """
+        market -> sessions for one day.
+        """
+        if hasattr(self.client, "get_markets_hours"):
+            return parse_market_hours(self.client.get_markets_hours(self.markets, day))
+        hours = {}
+        for market in self.markets:
+            hours.update(parse_market_hours(self.client.get_market_hours(market, day)))
+        return hours
+
+    def refresh(self, force=False):
+        """
+        Fetches the hours from today on, unless that's already been done
+        today. Days that fail to fetch keep what was there before; markets
+        missing from a response use fallback_sessions for that day. Returns
+        True if anything was fetched.
+        """
+        today = market_date()
+        if not force and self.refreshed == today.isoformat():
+            return False
+        fetched = 0
+        for i in range(self.days):
+            day = today + timedelta(days=i)
+            try:
+                hours = self.fetch(day)
+            except Exception as e:
+                logger.error(f"Failed to fetch market hours for {day}: {e}")
+                continue
+            missing = [market for market in self.markets if market not in hours]
+            if missing:
+                logger.warning(f"No {', '.join(missing)} hours for {day}, assuming the usual ones")
+            with self._lock:
+                for market in self.markets:
+                    if market in hours:
+                        self._hours.setdefault(market, {})[day.isoformat()] = hours[market]
+                    else:
+                        # Left unset, so fallback_sessions covers the day.
+                        self._hours.get(market, {}).pop(day.isoformat(), None)
+            fetched += 1
+        if not fetched:
+            return False
+        oldest = (today - timedelta(days=KEEP_DAYS)).isoformat()
+        with self._lock:
+            for days in self._hours.values():
+                for key in [key for key in days if key < oldest]:
+                    del days[key]
+            if fetched == self.days:
+                self.refreshed = today.isoformat()
+        self.save()
+        logger.info(f"Market calendar refreshed for {fetched} days from {today}")
+        return True
+
+    def sessions(self, market, day, extended_hours=False):
+        """
+        [start, end] spans `market` trades on New York date `day`, with
+        touching sessions joined.
+        """
+        with self._lock:
+            sessions = self._hours.get(market, {}).get(day.isoformat())
+        if sessions is None:
+            sessions = fallback_sessions(market, day)
+        return merge([(start, end) for start, end, name in sessions
+                if extended_hours or name == REGULAR])
+
+    def _spans(self, market, when, extended_hours, days):
+        """
+        Spans from the day before `when` (sessions can start the evening
+        before their date) to `days` days after.
+        """
+        day = market_date(when)
+        spans = []
+        for i in range(-1, days + 1):
+            spans.extend(self.sessions(market, day + timedelta(days=i), extended_hours))
+        return merge(spans)
+
+    def is_open(self, market="EQUITY", when=None, extended_hours=False):
+        when = now_ms() if when is None else when
+        return any(start <= when < end for start, end in self._spans(market, when, extended_hours, 1))
+
+    def next_open(self, market="EQUITY", when=None, extended_hours=False, horizon=14):
+        """
+        `when` (default now) if the market is open then, else the start of
+        its next session within `horizon` days, or None.
+        """
+        when = now_ms() if when is None else when
+        for start, end in self._spans(market, when, extended_hours, horizon):
+            if end > when:
+                return max(start, when)
+        return None
+
+    def next_close(self, market="EQUITY", when=None, extended_hours=False, horizon=14):
+        """
+        End of the session open at `when`, or of the next one.
+        """
+        when = now_ms() if when is None else when
+        for start, end in self._spans(market, when, extended_hours, horizon):
+            if end > when:
+                return end
+        return None
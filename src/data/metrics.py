@@ -0,0 +1,305 @@
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+# Histograms cover 1us to ~1 hour. Each power of two is split into
+# SUB_BUCKETS linear buckets, so any recorded value is off by at most
+# 1/SUB_BUCKETS (~1.6%) - the same trade-off HdrHistogram makes, with a fixed
+# bucket count and O(1) recording.
+DEFAULT_LOWEST = 1e-6
+DEFAULT_HIGHEST = 3600.0
+SUB_BUCKETS = 64
+
+DEFAULT_QUANTILES = [0.5, 0.9, 0.99, 0.999]
+
+class Counter():
+    """
+    Monotonic count, e.g. retries or cache hits.
+    """
+    kind = "counter"
+
+    def __init__(self):
+        self.value = 0
+        self._lock = threading.Lock()
+
+    def inc(self, n=1):
+        with self._lock:
+            self.value += n
+
+    def snapshot(self):
+        return {"value" : self.value}
+
+    def reset(self):
+        with self._lock:
+            self.value = 0
+
+class Histogram():
+    """
+    Log-linear histogram of durations in seconds. Values below `lowest` go in
+    the first bucket and values above `highest` in the last one; min, max
+    and sum are always exact.
+    """
+    kind = "histogram"
+
+    def __init__(self, lowest=DEFAULT_LOWEST, highest=DEFAULT_HIGHEST):
+        self.lowest = lowest
+        self.highest = highest
+        self.magnitudes = max(1, math.ceil(math.log2(highest / lowest)) + 1)
+        self.counts = [0] * (self.magnitudes * SUB_BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._lock = threading.Lock()
+
+    def bucket(self, value):
+        if value <= self.lowest:
+            return 0
+        mantissa, exponent = math.frexp(value / self.lowest)
+        index = (exponent - 1) * SUB_BUCKETS + int((mantissa - 0.5) * 2 * SUB_BUCKETS)
+        return min(index, len(self.counts) - 1)
+
+    def bucket_value(self, index):
+        """
+        Upper edge of bucket `index`, in seconds.
+        """
+        exponent, sub = divmod(index, SUB_BUCKETS)
+        return self.lowest * 2 ** exponent * (1 + (sub + 1) / SUB_BUCKETS)
+
+    def record(self, value):
+        index = self.bucket(value)
+        with self._lock:
+            self.counts[index] += 1
+            self.count += 1
+            self.sum += value
+            if value < self.min:
+                self.min = value
+            if value > self.max:
+                self.max = value
+
+    def percentile(self, q):
+        """
+        Value at quantile `q` (0 to 1), accurate to the bucket width.
+        """
+        with self._lock:
+            if self.count == 0:
+                return math.nan
+            rank = max(1, math.ceil(q * self.count))
+            seen = 0
+            for index, n in enumerate(self.counts):
+                seen += n
+                if seen >= rank:
+                    return min(max(self.bucket_value(index), self.min), self.max)
+            return self.max
+
+    def merge(self, other):
+        with self._lock:
+            for index, n in enumerate(other.counts):
+                self.counts[index] += n
+            self.count += other.count
+            self.sum += other.sum
+            self.min = min(self.min, other.min)
+            self.max = max(self.max, other.max)
+
+    def snapshot(self, quantiles=DEFAULT_QUANTILES):
+        summary = {
+            "count" : self.count,
+            "sum" : self.sum,
+            "min" : self.min if self.count else math.nan,
+            "max" : self.max if self.count else math.nan,
+        }
+        for q in quantiles:
+            summary[f"p{q * 100:g}"] = self.percentile(q)
+        return summary
+
+    def reset(self):
+        with self._lock:
+            self.counts = [0] * len(self.counts)
+            self.count = 0
+            self.sum = 0.0
+            self.min = math.inf
+            self.max = -math.inf
+
+class Span():
+    """
+    Times a with block into a histogram.
+    """
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.record(time.perf_counter() - self.start)
+        return False
+
+class NullSpan():
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_SPAN = NullSpan()
+
+def format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+
+class Registry():
+    """
+    Process-wide set of named metrics. Each metric is identified by its name
+    and labels, and is created on first use:
+
+        METRICS.counter("td_retries_total", reason="throttle").inc()
+        with METRICS.span("td_json_decode_seconds", endpoint="quotes"):
+            ...
+
+    When `enabled` is False spans do no timing and counters and histograms
+    handed out are shared throwaway ones, so instrumented code costs next to
+    nothing.
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self._metrics = {}
+        self._lock = threading.Lock()
+        self._null_counter = Counter()
+        self._null_histogram = Histogram()
+        self._server = None
+
+    def _get(self, cls, name, labels):
+        key = (name, tuple(sorted(labels.items())))
+        metric = self._metrics.get(key)
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.get(key)
+                if metric is None:
+                    metric = cls()
+                    self._metrics[key] = metric
+        if not isinstance(metric, cls):
+            raise TypeError(f"Metric {name} is a {metric.kind}, not a {cls.kind}")
+        return metric
+
+    def counter(self, name, **labels):
+        if not self.enabled:
+            return self._null_counter
+        return self._get(Counter, name, labels)
+
+    def histogram(self, name, **labels):
+        if not self.enabled:
+            return self._null_histogram
+        return self._get(Histogram, name, labels)
+
+    def span(self, name, **labels):
+        """
+        Context manager recording how long the block takes in histogram
+        `name`.
+        """
+        if not self.enabled:
+            return NULL_SPAN
+        return Span(self.histogram(name, **labels))
+
+    def timed(self, name, **labels):
+        """
+        Decorator version of span.
+        """
+        def decorator(func):
+            def wrapper(*args, **kwargs):
+                with self.span(name, **labels):
+                    return func(*args, **kwargs)
+            wrapper.__name__ = func.__name__
+            wrapper.__doc__ = func.__doc__
+            return wrapper
+        return decorator
+
+    def items(self):
+        with self._lock:
+            return sorted(self._metrics.items(), key=lambda item: item[0])
+
+    def dump(self):
+        """
+        Snapshot of every metric as {"name{labels}": {...}}.
+        """
+        return {name + format_labels(labels) : metric.snapshot()
+                for (name, labels), metric in self.items()}
+
+    def to_prometheus(self):
+        """
+        Every metric in the Prometheus text exposition format. Histograms are
+        exported as summaries with DEFAULT_QUANTILES.
+        """
+        lines = []
+        typed = set()
+        for (name, labels), metric in self.items():
+            if name not in typed:
+                kind = "counter" if metric.kind == "counter" else "summary"
+                lines.append(f"# TYPE {name} {kind}")
+                typed.add(name)
+            if metric.kind == "counter":
+                lines.append(f"{name}{format_labels(labels)} {metric.value}")
+                continue
+            for q in DEFAULT_QUANTILES:
+                value = metric.percentile(q)
+                if math.isnan(value):
+                    continue
+                quantile_labels = labels + (("quantile", f"{q:g}"),)
+                lines.append(f"{name}{format_labels(quantile_labels)} {value:.9g}")
+            lines.append(f"{name}_sum{format_labels(labels)} {metric.sum:.9g}")
+            lines.append(f"{name}_count{format_labels(labels)} {metric.count}")
+        return "\n".join(lines) + "\n"
+
+    def write_prometheus(self, path):
+        """
+        Writes the Prometheus text to `path`, e.g. for node_exporter's
+        textfile collector. The file is replaced atomically.
+        """
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            f.write(self.to_prometheus())
+        os.replace(tmp, path)
+
+    def serve(self, port, host="127.0.0.1"):
+        """
+        Serves the Prometheus text on http://host:port/metrics from a
+        background thread. Returns the server.
+        """
+        registry = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                body = registry.to_prometheus().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._server = ThreadingHTTPServer((host, port), MetricsHandler)
+        thread = threading.Thread(target=self._server.serve_forever, daemon=True, name="metrics")
+        thread.start()
+        return self._server
+
+    def stop(self):
+        if self._server is not None:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def reset(self):
+        for _, metric in self.items():
+            metric.reset()
+
+METRICS = Registry()
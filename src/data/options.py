@@ -0,0 +1,364 @@
+import datetime as dt
+import math
+
+import numpy as np
+import pandas as pd
+
+CHAIN_OUTPUTS = ["json", "chain", "frame"]
+
+DAYS_PER_YEAR = 365.0
+
+# Column name -> contract field in a marketdata/chains response.
+CONTRACT_FIELDS = {
+    "strike" : "strikePrice",
+    "expiration" : "expirationDate",
+    "days" : "daysToExpiration",
+    "bid" : "bid",
+    "ask" : "ask",
+    "last" : "last",
+    "mark" : "mark",
+    "bid_size" : "bidSize",
+    "ask_size" : "askSize",
+    "volume" : "totalVolume",
+    "open_interest" : "openInterest",
+    "iv" : "volatility",
+    "delta" : "delta",
+    "gamma" : "gamma",
+    "theta" : "theta",
+    "vega" : "vega",
+    "rho" : "rho",
+    "theoretical" : "theoreticalOptionValue",
+    "multiplier" : "multiplier",
+}
+GREEKS = ["delta", "gamma", "theta", "vega", "rho"]
+
+# Abramowitz & Stegun 7.1.26, absolute error below 1.5e-7. Plenty for
+# pricing and greeks and keeps scipy out of the dependencies.
+_ERF_P = 0.3275911
+_ERF_A = (0.254829592, -0.284496736, 1.421413741, -1.453152027, 1.061405429)
+
+def erf(x):
+    """
+    Vectorized error function.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    sign = np.sign(x)
+    x = np.abs(x)
+    t = 1.0 / (1.0 + _ERF_P * x)
+    a1, a2, a3, a4, a5 = _ERF_A
+    poly = ((((a5 * t + a4) * t + a3) * t + a2) * t + a1) * t
+    return sign * (1.0 - poly * np.exp(-x * x))
+
+def norm_cdf(x):
+    return 0.5 * (1.0 + erf(np.asarray(x) / math.sqrt(2.0)))
+
+def norm_pdf(x):
+    x = np.asarray(x, dtype=np.float64)
+    return np.exp(-0.5 * x * x) / math.sqrt(2.0 * math.pi)
+
+def black_scholes(spot, strike, years, rate, volatility, is_call, dividend=0.0):
+    """
+    Black-Scholes prices and greeks for arrays of European options, all
+    arguments broadcast together. `rate`, `dividend` and `volatility` are
+    annual decimals (0.05, not 5).
+
+    Returns a dict of arrays: price, delta, gamma, theta (per calendar day),
+    vega and rho (per 1 point of volatility / rate), the units the TD API
+    reports greeks in. Expired options (years <= 0) or zero volatility are
+    priced at their discounted intrinsic value.
+    """
+    spot, strike, years, rate, volatility, dividend, is_call = np.broadcast_arrays(
+            *(np.asarray(a, dtype=np.float64) for a in (spot, strike, years, rate, volatility, dividend)),
+            np.asarray(is_call, dtype=bool))
+    sign = np.where(is_call, 1.0, -1.0)
+
+    live = (years > 0) & (volatility > 0)
+    t = np.where(live, years, 1.0)
+    vol = np.where(live, volatility, 1.0)
+    sqrt_t = np.sqrt(t)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        d1 = (np.log(spot / strike) + (rate - dividend + 0.5 * vol * vol) * t) / (vol * sqrt_t)
+    d2 = d1 - vol * sqrt_t
+
+    spot_discount = np.exp(-dividend * t)
+    strike_discount = np.exp(-rate * t)
+    nd1 = norm_cdf(sign * d1)
+    nd2 = norm_cdf(sign * d2)
+    pdf = norm_pdf(d1)
+
+    price = sign * (spot * spot_discount * nd1 - strike * strike_discount * nd2)
+    delta = sign * spot_discount * nd1
+    gamma = spot_discount * pdf / (spot * vol * sqrt_t)
+    theta = (-spot * spot_discount * pdf * vol / (2.0 * sqrt_t)
+            - sign * rate * strike * strike_discount * nd2
+            + sign * dividend * spot * spot_discount * nd1) / DAYS_PER_YEAR
+    vega = spot * spot_discount * pdf * sqrt_t / 100.0
+    rho = sign * strike * t * strike_discount * nd2 / 100.0
+
+    if not live.all():
+        dead = ~live
+        years_left = np.maximum(years, 0.0)
+        forward = spot * np.exp(-dividend * years_left) - strike * np.exp(-rate * years_left)
+        price = np.where(dead, np.maximum(sign * forward, 0.0), price)
+        itm = sign * forward > 0
+        delta = np.where(dead, np.where(itm, sign, 0.0), delta)
+        gamma = np.where(dead, 0.0, gamma)
+        theta = np.where(dead, 0.0, theta)
+        vega = np.where(dead, 0.0, vega)
+        rho = np.where(dead, 0.0, rho)
+
+    return {
+        "price" : price,
+        "delta" : delta,
+        "gamma" : gamma,
+        "theta" : theta,
+        "vega" : vega,
+        "rho" : rho,
+    }
+
+def to_day(value):
+    """
+    Normalizes an expiry given as "yyyy-mm-dd", a date/datetime, a
+    datetime64 or epoch milliseconds to numpy datetime64[D].
+    """
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return np.datetime64(int(value), "ms").astype("datetime64[D]")
+    if isinstance(value, dt.datetime):
+        value = value.date()
+    return np.datetime64(value, "D")
+
+def _number(value):
+    """
+    Contract values are sometimes "NaN" strings or -999 placeholders.
+    """
+    if value is None or isinstance(value, str):
+        try:
+            value = float(value)
+        except (TypeError, ValueError):
+            return math.nan
+    if value == -999.0:
+        return math.nan
+    return value
+
+def _column(contracts, field, n):
+    """
+    One float64 column. Tries the plain conversion first and only falls
+    back to cleaning values one by one if the API sent strings or nulls.
+    """
+    try:
+        values = np.fromiter((c.get(field, math.nan) for c in contracts), dtype=np.float64, count=n)
+    except (TypeError, ValueError):
+        values = np.fromiter((_number(c.get(field)) for c in contracts), dtype=np.float64, count=n)
+    values[values == -999.0] = math.nan
+    return values
+
+class OptionChain():
+    """
+    Struct-of-arrays view of a marketdata/chains response: one contiguous
+    NumPy column per contract field (see CONTRACT_FIELDS) plus `symbols`,
+    `expiry` (datetime64[D]) and `is_call`. Implied volatility is stored as
+    a decimal. Rows are sorted by expiry, then calls before puts, then
+    strike, so lookups by expiry and strike are binary searches.
+
+        chain = client.get_option_chain("SPY", output="chain")
+        front = chain.for_expiry(chain.expiries()[0])
+        i = chain.find("2021-01-15", 380, "CALL")
+        chain.delta[i]
+    """
+
+    def __init__(self, symbols, expiry, is_call, columns, underlying=None,
+            underlying_price=math.nan, interest_rate=math.nan):
+        self.underlying = underlying
+        self.underlying_price = underlying_price
+        self.interest_rate = interest_rate
+        order = np.lexsort((columns["strike"], ~np.asarray(is_call, dtype=bool),
+                np.asarray(expiry, dtype="datetime64[D]")))
+        self.symbols = np.asarray(symbols, dtype=object)[order]
+        self.expiry = np.asarray(expiry, dtype="datetime64[D]")[order]
+        self.is_call = np.asarray(is_call, dtype=bool)[order]
+        self.columns = list(columns)
+        self._index = None
+        for name, values in columns.items():
+            dtype = np.int64 if name == "expiration" else np.float64
+            setattr(self, name, np.ascontiguousarray(np.asarray(values, dtype=dtype)[order]))
+
+    @classmethod
+    def from_payload(cls, payload):
+        """
+        Flattens the nested callExpDateMap / putExpDateMap of a chains
+        response in a single pass.
+        """
+        contracts = []
+        expiries = []
+        for key in ("callExpDateMap", "putExpDateMap"):
+            for expiry, strikes in payload.get(key, {}).items():
+                # Keys look like "2021-01-15:3" (date:days to expiration).
+                day = expiry.split(":", 1)[0]
+                for options in strikes.values():
+                    contracts.extend(options)
+                    expiries.extend([day] * len(options))
+        n = len(contracts)
+        columns = {}
+        for name, field in CONTRACT_FIELDS.items():
+            if name == "expiration":
+                columns[name] = np.fromiter((c.get(field, 0) for c in contracts), dtype=np.int64, count=n)
+            else:
+                columns[name] = _column(contracts, field, n)
+        columns["iv"] /= 100.0
+        is_call = np.fromiter((c.get("putCall") == "CALL" for c in contracts), dtype=bool, count=n)
+        symbols = [c.get("symbol") for c in contracts]
+        return cls(symbols, np.array(expiries, dtype="datetime64[D]"), is_call, columns,
+                underlying=payload.get("symbol"),
+                underlying_price=_number(payload.get("underlyingPrice")),
+                interest_rate=_number(payload.get("interestRate", math.nan)) / 100.0)
+
+    def __len__(self):
+        return len(self.symbols)
+
+    def take(self, rows):
+        """
+        A new chain with the given rows (index array, mask or slice).
+        """
+        chain = OptionChain.__new__(OptionChain)
+        chain.underlying = self.underlying
+        chain.underlying_price = self.underlying_price
+        chain.interest_rate = self.interest_rate
+        chain.columns = self.columns
+        chain._index = None
+        chain.symbols = self.symbols[rows]
+        chain.expiry = self.expiry[rows]
+        chain.is_call = self.is_call[rows]
+        for name in self.columns:
+            setattr(chain, name, getattr(self, name)[rows])
+        return chain
+
+    def expiries(self):
+        return np.unique(self.expiry)
+
+    def _ranges(self):
+        """
+        expiry -> (start, first put, end) rows, keyed by both datetime64[D]
+        and "yyyy-mm-dd". Built on first use.
+        """
+        if self._index is None:
+            days, starts = np.unique(self.expiry, return_index=True)
+            ends = np.append(starts[1:], len(self))
+            calls = np.add.reduceat(self.is_call, starts) if len(starts) else starts
+            self._index = {}
+            for day, start, end, count in zip(days, starts.tolist(), ends.tolist(), np.asarray(calls).tolist()):
+                self._index[day] = self._index[str(day)] = (start, start + count, end)
+        return self._index
+
+    def _rows(self, expiry):
+        ranges = self._ranges()
+        try:
+            return ranges[expiry]
+        except (KeyError, TypeError):
+            return ranges.get(to_day(expiry), (0, 0, 0))
+
+    def _expiry_range(self, expiry):
+        start, _, end = self._rows(expiry)
+        return start, end
+
+    def _side_range(self, expiry, put_call):
+        """
+        Row range holding one expiry's calls or puts, sorted by strike.
+        """
+        start, split, end = self._rows(expiry)
+        if put_call == "CALL" or put_call == "C":
+            return start, split
+        if put_call == "PUT" or put_call == "P":
+            return split, end
+        raise ValueError(f"Invalid put_call '{put_call}', expected CALL or PUT")
+
+    def for_expiry(self, expiry, put_call=None):
+        """
+        Contracts expiring on `expiry`, optionally only CALL or PUT.
+        """
+        if put_call is None:
+            start, end = self._expiry_range(expiry)
+        else:
+            start, end = self._side_range(expiry, put_call)
+        return self.take(slice(start, end))
+
+    def calls(self):
+        return self.take(np.flatnonzero(self.is_call))
+
+    def puts(self):
+        return self.take(np.flatnonzero(~self.is_call))
+
+    def strikes(self, expiry):
+        return np.unique(self.strike[slice(*self._expiry_range(expiry))])
+
+    def find(self, expiry, strike, put_call):
+        """
+        Row of the contract with this expiry, strike and type, or -1.
+        """
+        start, end = self._side_range(expiry, put_call)
+        i = start + int(self.strike[start:end].searchsorted(strike))
+        if i < end and self.strike[i] == strike:
+            return i
+        return -1
+
+    def nearest(self, expiry, strike, put_call):
+        """
+        Row of the contract with the strike closest to `strike` for this
+        expiry and type, or -1 if there are none.
+        """
+        start, end = self._side_range(expiry, put_call)
+        if start == end:
+            return -1
+        i = start + int(np.searchsorted(self.strike[start:end], strike))
+        if i == end or (i > start and strike - self.strike[i - 1] <= self.strike[i] - strike):
+            i -= 1
+        return i
+
+    def years(self, now=None):
+        """
+        Time to expiry of each contract in years, from `now` (epoch ms,
+        default the current time) to the expiration timestamp.
+        """
+        if now is None:
+            now = int(dt.datetime.now(dt.timezone.utc).timestamp() * 1000)
+        return np.maximum(self.expiration - now, 0) / (DAYS_PER_YEAR * 24 * 60 * 60 * 1000)
+
+    def analytical(self, volatility=None, underlying_price=None, interest_rate=None,
+            days_to_expiration=None, dividend=0.0):
+        """
+        Black-Scholes prices and greeks for every contract, like the API's
+        ANALYTICAL strategy computes them, with the same optional
+        overrides. Defaults are each contract's own IV, the chain's
+        underlying price and interest rate, and its days to expiration.
+        `volatility` and `interest_rate` are decimals and may be arrays.
+        """
+        return black_scholes(
+                self.underlying_price if underlying_price is None else underlying_price,
+                self.strike,
+                self.days / DAYS_PER_YEAR if days_to_expiration is None
+                    else np.asarray(days_to_expiration, dtype=np.float64) / DAYS_PER_YEAR,
+                (0.0 if math.isnan(self.interest_rate) else self.interest_rate)
+                    if interest_rate is None else interest_rate,
+                self.iv if volatility is None else volatility,
+                self.is_call,
+                dividend)
+
+    def to_frame(self):
+        frame = pd.DataFrame({name : getattr(self, name) for name in self.columns}, copy=False)
+        frame.insert(0, "put_call", np.where(self.is_call, "CALL", "PUT"))
+        frame.insert(0, "expiry", self.expiry)
+        frame.index = pd.Index(self.symbols, name="symbol")
+        return frame
+
+def format_chain(payload, output):
+    """
+    Returns a chains response as requested by get_option_chain's `output`
+    argument: "json" (unchanged), "chain" (OptionChain) or "frame".
+    """
+    if output not in CHAIN_OUTPUTS:
+        raise ValueError(f"Invalid output '{output}' for option chain")
+    if output == "json":
+        return payload
+    chain = OptionChain.from_payload(payload)
+    if output == "chain":
+        return chain
+    return chain.to_frame()
@@ -0,0 +1,413 @@
+import logging
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_TABLE_NAME = "basilisk_quotes"
+DEFAULT_CAPACITY = 1024
+
+# Numeric quote fields kept in the table, one float64 column each.
+QUOTE_FIELDS = [
+    "bidPrice",
+    "askPrice",
+    "lastPrice",
+    "bidSize",
+    "askSize",
+    "lastSize",
+    "openPrice",
+    "highPrice",
+    "lowPrice",
+    "closePrice",
+    "mark",
+    "netChange",
+    "totalVolume",
+    "volatility",
+    "52WkHigh",
+    "52WkLow",
+    "quoteTimeInLong",
+    "tradeTimeInLong",
+]
+
+MAGIC = 0x42534b51   # "BSKQ"
+LAYOUT_VERSION = 1
+SYMBOL_DTYPE = np.dtype("S16")
+FIELD_DTYPE = np.dtype("S32")
+
+# Header slots, one int64 each.
+H_MAGIC = 0
+H_VERSION = 1
+H_CAPACITY = 2
+H_FIELDS = 3
+H_COUNT = 4
+H_SEQ = 5
+H_UPDATED = 6
+HEADER_SLOTS = 8
+HEADER_BYTES = HEADER_SLOTS * 8
+
+# Reader spins this many times on a busy seqlock before yielding the CPU.
+SPINS_BEFORE_YIELD = 100
+
+class QuoteTableError(Exception):
+    pass
+
+def now_ms():
+    return int(time.time() * 1000)
+
+def table_size(capacity, n_fields):
+    return (HEADER_BYTES + n_fields * FIELD_DTYPE.itemsize
+            + capacity * SYMBOL_DTYPE.itemsize + capacity * n_fields * 8)
+
+_register_lock = threading.Lock()
+
+def open_segment(name):
+    """
+    Attaches to an existing segment without registering it with the
+    resource tracker, which would otherwise unlink it when a reader exits.
+    """
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        # Python < 3.13 has no track argument. Unregistering afterwards
+        # isn't an option: forked readers share the owner's tracker.
+        with _register_lock:
+            register = resource_tracker.register
+            resource_tracker.register = lambda *args : None
+            try:
+                return shared_memory.SharedMemory(name=name)
+            finally:
+                resource_tracker.register = register
+
+class SharedQuoteTable():
+    """
+    Latest quotes for a set of symbols in shared memory, written by one
+    process and read by any number of others without copying the table or
+    going through a pipe.
+
+    The segment is a fixed layout of numpy views: an int64 header (sizes,
+    symbol count, sequence number, last update time), the field names, one
+    16 byte symbol name per row and a capacity x fields float64 block.
+    Missing values are NaN.
+
+    Writes and reads are coordinated by a seqlock on the header's sequence
+    number. The writer makes it odd, updates the rows, then makes it even
+    again; a reader copies what it needs and retries if the number was odd
+    or changed meanwhile. Readers never block the writer and always see a
+    whole batch of quotes from one poll.
+
+        table = SharedQuoteTable.create(symbols=["AAPL", "MSFT"])   # owner
+        table.write(client.get_quote("AAPL", "MSFT"))
+
+        table = SharedQuoteTable.attach()                           # readers
+        table.get_quote("AAPL")["AAPL"]["bidPrice"]
+    """
+
+    def __init__(self, segment, owner=False):
+        self.segment = segment
+        self.owner = owner
+        buf = segment.buf
+        self.header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=buf)
+        if self.header[H_MAGIC] != MAGIC or self.header[H_VERSION] != LAYOUT_VERSION:
+            raise QuoteTableError(f"Shared memory {segment.name} isn't a quote table")
+        self.capacity = int(self.header[H_CAPACITY])
+        n_fields = int(self.header[H_FIELDS])
+        offset = HEADER_BYTES
+        names = np.ndarray((n_fields,), dtype=FIELD_DTYPE, buffer=buf, offset=offset)
+        self.fields = [name.decode() for name in names]
+        offset += n_fields * FIELD_DTYPE.itemsize
+        self.names = np.ndarray((self.capacity,), dtype=SYMBOL_DTYPE, buffer=buf, offset=offset)
+        offset += self.capacity * SYMBOL_DTYPE.itemsize
+        self.values = np.ndarray((self.capacity, n_fields), dtype=np.float64, buffer=buf,
+                offset=offset)
+        self._columns = {field : i for i, field in enumerate(self.fields)}
+        self._index = {}
+        self._count = 0
+        # Serializes writer threads of the owning process.
+        self._write_lock = threading.Lock()
+
+    @classmethod
+    def create(cls, name=DEFAULT_TABLE_NAME, symbols=(), capacity=DEFAULT_CAPACITY,
+            fields=QUOTE_FIELDS):
+        """
+        Creates the segment. An old segment of the same name left behind by
+        a crashed owner is replaced.
+        """
+        fields = list(fields)
+        capacity = max(capacity, len(symbols))
+        size = table_size(capacity, len(fields))
+        try:
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            logger.warning(f"Replacing stale shared quote table {name}")
+            stale = open_segment(name)
+            stale.close()
+            stale.unlink()
+            segment = shared_memory.SharedMemory(name=name, create=True, size=size)
+        header = np.ndarray((HEADER_SLOTS,), dtype=np.int64, buffer=segment.buf)
+        header[:] = 0
+        header[H_CAPACITY] = capacity
+        header[H_FIELDS] = len(fields)
+        np.ndarray((len(fields),), dtype=FIELD_DTYPE, buffer=segment.buf,
+                offset=HEADER_BYTES)[:] = [field.encode() for field in fields]
+        header[H_VERSION] = LAYOUT_VERSION
+        header[H_MAGIC] = MAGIC
+        del header
+        table = cls(segment, owner=True)
+        table.values[:] = np.nan
+        table.add_symbols(symbols)
+        return table
+
+    @classmethod
+    def attach(cls, name=DEFAULT_TABLE_NAME):
+        return cls(open_segment(name))
+
+    @property
+    def name(self):
+        return self.segment.name
+
+    @property
+    def updated(self):
+        """
+        Time of the last write, ms since epoch (0 if never written).
+        """
+        return int(self.header[H_UPDATED])
+
+    def age(self):
+        """
+        Seconds since the last write.
+        """
+        updated = self.updated
+        return float("inf") if not updated else (now_ms() - updated) / 1000
+
+    ### Writer
+
+    def add_symbols(self, symbols):
+        """
+        Gives each new symbol a row. Returns the rows of `symbols`.
+        Raises QuoteTableError if the table is full.
+        """
+        with self._write_lock:
+            return self._add_symbols(symbols)
+
+    def _add_symbols(self, symbols):
+        new = {}
+        for symbol in symbols:
+            if symbol in self._index or symbol in new:
+                continue
+            if self._count + len(new) >= self.capacity:
+                raise QuoteTableError(f"Quote table {self.name} is full ({self.capacity} symbols)")
+            if len(symbol.encode()) > SYMBOL_DTYPE.itemsize:
+                raise QuoteTableError(f"Symbol {symbol} is too long for the quote table")
+            new[symbol] = self._count + len(new)
+        if new:
+            self._begin()
+            self.names[self._count:self._count + len(new)] = [symbol.encode() for symbol in new]
+            self._count += len(new)
+            self.header[H_COUNT] = self._count
+            self._end()
+            self._index.update(new)
+        return [self._index[symbol] for symbol in symbols]
+
+    def write(self, quotes):
+        """
+        Stores a {symbol : quote} dict such as get_quote returns, as one
+        atomic update. Fields a quote lacks are set to NaN.
+        """
+        if not self.owner:
+            raise QuoteTableError("Only the process that created the quote table writes to it")
+        symbols = list(quotes)
+        fields = self.fields
+        try:
+            block = np.array([[quote.get(field, np.nan) for field in fields]
+                    for quote in quotes.values()], dtype=np.float64).reshape(len(symbols), len(fields))
+        except (TypeError, ValueError):
+            # Some field isn't a number; keep the ones that are.
+            block = np.full((len(symbols), len(fields)), np.nan)
+            for i, quote in enumerate(quotes.values()):
+                for j, field in enumerate(fields):
+                    value = quote.get(field)
+                    if isinstance(value, (int, float)):
+                        block[i, j] = value
+        with self._write_lock:
+            rows = self._add_symbols(symbols)
+            self._begin()
+            self.values[rows] = block
+            self.header[H_UPDATED] = now_ms()
+            self._end()
+
+    def _begin(self):
+        self.header[H_SEQ] += 1
+
+    def _end(self):
+        self.header[H_SEQ] += 1
+
+    ### Readers
+
+    def _read(self, fn):
+        """
+        Runs `fn` (which must only copy out of the table) until it sees no
+        concurrent write.
+        """
+        spins = 0
+        while True:
+            seq = int(self.header[H_SEQ])
+            if not seq & 1:
+                result = fn()
+                if int(self.header[H_SEQ]) == seq:
+                    return result
+            spins += 1
+            if spins % SPINS_BEFORE_YIELD == 0:
+                time.sleep(0)
+
+    def _refresh_index(self):
+        def names():
+            count = int(self.header[H_COUNT])
+            return count, self.names[:count].copy()
+
+        count, names = self._read(names)
+        self._index = {name.decode() : row for row, name in enumerate(names)}
+        self._count = count
+
+    def rows(self, symbols):
+        """
+        Row of each symbol, -1 for symbols not in the table.
+        """
+        if not self.owner and int(self.header[H_COUNT]) != self._count:
+            self._refresh_index()
+        return np.array([self._index.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+
+    def symbols(self):
+        if not self.owner and int(self.header[H_COUNT]) != self._count:
+            self._refresh_index()
+        return list(self._index)
+
+    def array(self, symbols=None, fields=None):
+        """
+        Consistent copy of the values as a (symbols x fields) float64 array,
+        NaN for symbols not in the table. Defaults to every symbol and field.
+        """
+        symbols = self.symbols() if symbols is None else list(symbols)
+        rows = self.rows(symbols)
+        if fields is None:
+            columns = slice(None)
+            width = len(self.fields)
+        else:
+            columns = np.array([self._columns[field] for field in fields], dtype=np.int64)
+            width = len(columns)
+        present = rows >= 0
+        take = rows if present.all() else rows[present]
+        if fields is None:
+            values = self._read(lambda : self.values[take])
+        else:
+            values = self._read(lambda : self.values[take[:, None], columns])
+        if len(take) == len(rows):
+            return values
+        out = np.full((len(symbols), width), np.nan)
+        out[present] = values
+        return out
+
+    def get_quote(self, *symbols, field=None):
+        """
+        Same shape as TDClient.get_quote: {symbol : {field : value}} for the
+        symbols in the table, or {symbol : value} of one `field` (raising
+        KeyError for a symbol not in the table). Values are floats.
+        """
+        rows = self.rows(symbols)
+        if field is not None:
+            if (rows < 0).any():
+                raise KeyError(symbols[int(np.argmax(rows < 0))])
+            column = self._columns[field]
+            values = self._read(lambda : self.values[rows, column])
+            return dict(zip(symbols, values.tolist()))
+        symbols = [symbol for symbol, row in zip(symbols, rows) if row >= 0]
+        rows = rows[rows >= 0]
+        values = self._read(lambda : self.values[rows])
+        gaps = np.isnan(values).any(axis=1).tolist()
+        fields = self.fields
+        data = {}
+        for symbol, quote, gap in zip(symbols, values.tolist(), gaps):
+            if gap:
+                quote = {name : value for name, value in zip(fields, quote) if value == value}
+            else:
+                quote = dict(zip(fields, quote))
+            quote["symbol"] = symbol
+            data[symbol] = quote
+        return data
+
+    def close(self):
+        """
+        Unmaps the table. The owner also removes the segment.
+        """
+        self.header = self.names = self.values = None
+        self.segment.close()
+        if self.owner:
+            try:
+                self.segment.unlink()
+            except FileNotFoundError:
+                pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+class QuoteTableWriter():
+    """
+    Polls quotes for `symbols` with one batched request per interval and
+    writes them to a SharedQuoteTable created by this process, so every
+    process reading the table shares one set of requests. Several writers
+    (e.g. one per client) can share a table.
+    """
+
+    def __init__(self, client, symbols, table, interval=1.0):
+        self.client = client
+        self.symbols = sorted(set(symbols))
+        self.interval = interval
+        self.table = table
+        self.table.add_symbols(self.symbols)
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True, name="quote-table")
+
+    def poll(self):
+        self.table.write(self.client.get_quote(*self.symbols))
+
+    def _run(self):
+        next_tick = time.monotonic()
+        while not self._stop.is_set():
+            try:
+                self.poll()
+            except Exception as e:
+                logger.error(f"Quote table poll failed with exception: {e}")
+            next_tick += self.interval
+            self._stop.wait(max(0, next_tick - time.monotonic()))
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+### Process pool workers
+
+_worker_table = None
+
+def attach_worker(name=DEFAULT_TABLE_NAME):
+    """
+    Process pool initializer: maps the quote table once per worker.
+    """
+    global _worker_table
+    _worker_table = SharedQuoteTable.attach(name)
+
+def worker_quotes():
+    """
+    The quote table mapped by attach_worker in this process, or None.
+    """
+    return _worker_table
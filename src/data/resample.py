@@ -0,0 +1,286 @@
+import re
+from datetime import datetime, timezone
+
+import numpy as np
+from dateutil import tz
+
+from data.candles import CANDLE_DTYPE, MINUTE_IN_MS, DAY_IN_MS
+
+MARKET_TZ = tz.gettz("America/New_York")
+
+# Session bounds in minutes after local midnight, [open, close).
+REGULAR_SESSION = (9 * 60 + 30, 16 * 60)
+EXTENDED_SESSION = (4 * 60, 20 * 60)
+
+UNITS = ["minute", "daily", "weekly", "monthly"]
+TIMEFRAME_PATTERN = re.compile(r"^(\d+)\s*(m|min|h|d|w|mo)$")
+UNIT_ALIASES = {
+    "m" : ("minute", 1),
+    "min" : ("minute", 1),
+    "h" : ("minute", 60),
+    "d" : ("daily", 1),
+    "w" : ("weekly", 1),
+    "mo" : ("monthly", 1),
+}
+
+class Timeframe():
+    """
+    A bar size: `unit` is one of the get_price_history frequency types
+    (minute, daily, weekly, monthly) and `count` how many of them per bar.
+    Intraday bars can be any number of minutes; daily and longer bars are
+    always one unit.
+    """
+
+    def __init__(self, unit, count=1):
+        if unit not in UNITS or count < 1 or (unit != "minute" and count != 1):
+            raise ValueError(f"Invalid timeframe {count} {unit}")
+        self.unit = unit
+        self.count = int(count)
+
+    @property
+    def name(self):
+        """
+        Same naming as the CandleStore directories, e.g. minute_5.
+        """
+        return f"{self.unit}_{self.count}"
+
+    def __repr__(self):
+        return f"Timeframe({self.unit!r}, {self.count})"
+
+    def __eq__(self, other):
+        return isinstance(other, Timeframe) and (self.unit, self.count) == (other.unit, other.count)
+
+    def __hash__(self):
+        return hash((self.unit, self.count))
+
+def parse_timeframe(value):
+    """
+    Accepts a Timeframe, a (frequency_type, frequency) pair as passed to
+    get_price_history, or a string like "3min", "5m", "2h", "1d", "1w"
+    or "1mo".
+    """
+    if isinstance(value, Timeframe):
+        return value
+    if isinstance(value, tuple):
+        return Timeframe(*value)
+    match = TIMEFRAME_PATTERN.match(str(value).strip().lower())
+    if match is None:
+        raise ValueError(f"Invalid timeframe '{value}'")
+    unit, scale = UNIT_ALIASES[match.group(2)]
+    return Timeframe(unit, int(match.group(1)) * scale)
+
+def session_bounds(extended_hours):
+    return EXTENDED_SESSION if extended_hours else REGULAR_SESSION
+
+_offsets = {}
+
+def utc_offsets(times):
+    """
+    Market timezone UTC offset in ms for each epoch ms time. Offsets are
+    looked up once per UTC day at noon. DST switches at 2am local, before
+    any session opens, so the noon offset holds for every session minute.
+    """
+    days = times // DAY_IN_MS
+    unique, inverse = np.unique(days, return_inverse=True)
+    offsets = np.empty(len(unique), dtype=np.int64)
+    for i, day in enumerate(unique.tolist()):
+        offset = _offsets.get(day)
+        if offset is None:
+            noon = datetime.fromtimestamp(day * 86400 + 43200, timezone.utc).astimezone(MARKET_TZ)
+            offset = _offsets[day] = int(noon.utcoffset().total_seconds() * 1000)
+        offsets[i] = offset
+    return offsets[inverse]
+
+def local_midnight_utc(local_days):
+    """
+    Epoch ms of local midnight for each local day number.
+    """
+    unique, inverse = np.unique(local_days, return_inverse=True)
+    starts = np.empty(len(unique), dtype=np.int64)
+    for i, day in enumerate(unique.tolist()):
+        date = datetime.fromtimestamp(day * 86400, timezone.utc).date()
+        midnight = datetime(date.year, date.month, date.day, tzinfo=MARKET_TZ)
+        starts[i] = int(midnight.timestamp() * 1000)
+    return starts[inverse]
+
+def period_start(when, timeframe):
+    """
+    Epoch ms of local midnight on the first day a bar of `timeframe`
+    holding epoch ms `when` can start: the day itself for intraday and
+    daily bars, the Monday for weekly and the 1st for monthly ones.
+    """
+    local = datetime.fromtimestamp(when / 1000, timezone.utc).astimezone(MARKET_TZ).date()
+    if timeframe.unit == "weekly":
+        local = local.fromordinal(local.toordinal() - local.weekday())
+    elif timeframe.unit == "monthly":
+        local = local.replace(day=1)
+    return int(datetime(local.year, local.month, local.day, tzinfo=MARKET_TZ).timestamp() * 1000)
+
+def bucket(times, timeframe, extended_hours=True):
+    """
+    Assigns minute bar times to bars of `timeframe`. Returns
+
+    - in_session: mask of the times inside the session
+    and, for those times only,
+    - keys: bar id, increasing with time
+    - starts: bar start time (epoch ms)
+    - last: whether the time is the final minute of its bar. Weekly and
+        monthly bars are never known to be finished from their own minutes.
+
+    Intraday bars are anchored at the session open and cut at the close,
+    so 2 hour regular-hours bars are 9:30, 11:30, 13:30 and 15:30-16:00.
+    Daily and longer bars start at local midnight (Mondays for weekly,
+    the 1st for monthly), in UTC epoch ms.
+    """
+    times = np.asarray(times, dtype=np.int64)
+    local = times + utc_offsets(times)
+    day = local // DAY_IN_MS
+    minute = (local - day * DAY_IN_MS) // MINUTE_IN_MS
+    open_minute, close_minute = session_bounds(extended_hours)
+    in_session = (minute >= open_minute) & (minute < close_minute)
+    local, day, minute = local[in_session], day[in_session], minute[in_session]
+    times = times[in_session]
+
+    if timeframe.unit == "minute":
+        n = timeframe.count
+        index = (minute - open_minute) // n
+        keys = day * 1440 + index
+        start_minute = open_minute + index * n
+        starts = times - (minute - start_minute) * MINUTE_IN_MS
+        end_minute = np.minimum(start_minute + n, close_minute)
+        last = minute + 1 >= end_minute
+    elif timeframe.unit == "daily":
+        keys = day
+        starts = local_midnight_utc(day)
+        last = minute + 1 >= close_minute
+    elif timeframe.unit == "weekly":
+        # Epoch day 0 was a Thursday; shifting by 3 makes weeks start Monday.
+        keys = (day + 3) // 7
+        starts = local_midnight_utc(keys * 7 - 3)
+        last = np.zeros(len(keys), dtype=bool)
+    else:
+        months = day.astype("datetime64[D]").astype("datetime64[M]")
+        keys = months.astype(np.int64)
+        starts = local_midnight_utc(months.astype("datetime64[D]").astype(np.int64))
+        last = np.zeros(len(keys), dtype=bool)
+    return in_session, keys, starts, last
+
+def aggregate(candles, keys, starts):
+    """
+    OHLCV of consecutive runs of equal keys: first open, max high, min
+    low, last close, summed volume.
+    """
+    n = len(candles)
+    out = np.empty(0 if n == 0 else int(np.count_nonzero(keys[1:] != keys[:-1])) + 1,
+            dtype=CANDLE_DTYPE)
+    if n == 0:
+        return out
+    first = np.concatenate(([0], np.flatnonzero(keys[1:] != keys[:-1]) + 1))
+    last = np.append(first[1:], n) - 1
+    out["datetime"] = starts[first]
+    out["open"] = candles["open"][first]
+    out["high"] = np.maximum.reduceat(candles["high"], first)
+    out["low"] = np.minimum.reduceat(candles["low"], first)
+    out["close"] = candles["close"][last]
+    out["volume"] = np.add.reduceat(candles["volume"], first)
+    return out
+
+def resample(candles, timeframe, extended_hours=True, partial=True):
+    """
+    Builds `timeframe` bars from 1-minute CANDLE_DTYPE records sorted by
+    time (e.g. CandleStore.read). Bars outside the session are dropped,
+    so extended_hours=False gives regular-hours bars from a download that
+    included extended hours.
+
+    The last bar may still be forming; pass partial=False to leave it out
+    unless its final minute is there.
+    """
+    timeframe = parse_timeframe(timeframe)
+    candles = np.asarray(candles, dtype=CANDLE_DTYPE)
+    in_session, keys, starts, last = bucket(candles["datetime"], timeframe, extended_hours)
+    bars = aggregate(candles[in_session], keys, starts)
+    if not partial and len(bars) and not last[-1]:
+        bars = bars[:-1]
+    return bars
+
+class BarAggregator():
+    """
+    Builds `timeframe` bars one minute bar at a time, giving the same bars
+    as `resample` over the same minutes:
+
+        aggregator = BarAggregator("5min")
+        aggregator.warm_up(store.read("AAPL"))
+        for bar in aggregator.update(minute_bar):
+            ...   # each bar that just finished
+
+    A bar is finished by its own last minute (intraday and daily bars) or
+    by the first minute of the next bar.
+    """
+
+    def __init__(self, timeframe, extended_hours=True):
+        self.timeframe = parse_timeframe(timeframe)
+        self.extended_hours = extended_hours
+        self.current = None
+        self._key = None
+
+    def warm_up(self, candles):
+        """
+        Starts from a minute history: the unfinished last bar of it becomes
+        the current bar. Returns the finished bars.
+        """
+        candles = np.asarray(candles, dtype=CANDLE_DTYPE)
+        in_session, keys, starts, last = bucket(candles["datetime"], self.timeframe,
+                self.extended_hours)
+        bars = aggregate(candles[in_session], keys, starts)
+        self.current = None
+        self._key = None
+        if len(bars) and not last[-1]:
+            self.current = bars[-1].copy()
+            self._key = int(keys[-1])
+            bars = bars[:-1]
+        return bars
+
+    def update(self, candle):
+        """
+        Adds one minute bar (a CANDLE_DTYPE record or dict with the candle
+        fields). Returns an array of the bars it finished, usually empty.
+        """
+        in_session, keys, starts, last = bucket(np.array([int(candle["datetime"])]),
+                self.timeframe, self.extended_hours)
+        if not in_session[0]:
+            return np.empty(0, dtype=CANDLE_DTYPE)
+        key = int(keys[0])
+        done = []
+        if self.current is not None and key != self._key:
+            done.append(self.current)
+            self.current = None
+        if self.current is None:
+            self.current = np.zeros((), dtype=CANDLE_DTYPE)
+            self.current["datetime"] = starts[0]
+            self.current["open"] = candle["open"]
+            self.current["high"] = candle["high"]
+            self.current["low"] = candle["low"]
+            self.current["close"] = candle["close"]
+            self.current["volume"] = candle["volume"]
+            self._key = key
+        else:
+            bar = self.current
+            bar["high"] = max(bar["high"], candle["high"])
+            bar["low"] = min(bar["low"], candle["low"])
+            bar["close"] = candle["close"]
+            bar["volume"] = bar["volume"] + candle["volume"]
+        if last[0]:
+            done.append(self.current)
+            self.current = None
+            self._key = None
+        return np.array(done, dtype=CANDLE_DTYPE)
+
+    def flush(self):
+        """
+        Returns the bar being built (as a one element array, or empty) and
+        forgets it, e.g. to close out a weekly bar at the end of the week.
+        """
+        bar = self.current
+        self.current = None
+        self._key = None
+        return np.array([] if bar is None else [bar], dtype=CANDLE_DTYPE)
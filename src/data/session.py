@@ -2,49 +2,45 @@ import os
 import sys
 
 import basilisk_data as bd
+from data.writer import shared_writer
 
 THISDIR = os.path.dirname(os.path.abspath(__file__))
 BASEDIR = os.path.join(THISDIR, "..", "..")
 
 class SessionEndpoint:
+    """
+    Session rows are written through the shared write-behind writer, so
+    recording a session never waits on the DB.
+    """
+
     @staticmethod
     def get(session_id):
+        # Anything still buffered for the session goes in first.
+        shared_writer().flush()
         with bd.db_session() as db:
-            obj = db.query(bd.BasiliskSession).filter(bd.BasiliskSession.id == session_id).one()
+            obj = (db.query(bd.BasiliskSession)
+                    .filter(bd.BasiliskSession.session_id == session_id).one())
         return obj
 
     @staticmethod
     def update(session_id, new_values):
-        with bd.db_session() as db:
-            try:
-                update_stmt = (
-                    update(bd.BasiliskSession.__table__)
-                    .where(bd.BasiliskSession.session_id == session_id)
-                    .values(**new_values)
-                )
-                result = db.execute(update_stmt)
-                if result.rowcount == 0:
-                    print("Failed to update db.")
-                    return False
-            except:
-                print("Failed to update db.")
-                return False
-        return True
+        try:
+            return shared_writer().update(bd.BasiliskSession, "session_id", session_id, new_values)
+        except Exception as e:
+            print(f"Failed to update db. Exception: {e}")
+            return False
 
     @staticmethod
     def insert(body):
-        with bd.db_session() as db:
-            try:
-                session = bd.BasiliskSession(
-                    int(body["session_id"]),
-                    body["clients"],
-                    body["strats"]
-                )
-                db.add(session)
-            except Exception as e:
-                print(f"Failed to update db. Exception: {e}")
-                return False
-        return True
+        try:
+            return shared_writer().write(bd.BasiliskSession, {
+                "session_id" : int(body["session_id"]),
+                "clients" : body["clients"],
+                "strats" : body["strats"],
+            })
+        except Exception as e:
+            print(f"Failed to update db. Exception: {e}")
+            return False
 
 if __name__ == "__main__":
     pass
@@ -4,20 +4,28 @@ import sys
 from sqlalchemy import update
 
 import basilisk_data as bd
+from data.metrics import METRICS
 
 THISDIR = os.path.dirname(os.path.abspath(__file__))
 BASEDIR = os.path.join(THISDIR, "..", "..")
 
 class TokensEndpoint:
+    """
+    Reads and updates go straight to the database in their own short
+    transaction rather than through the write-behind writer: they run under
+    the token locks, and other processes read the row as soon as the token
+    file lock is released.
+    """
+
     @staticmethod
     def get(client_id):
-        with bd.db_session() as db:
+        with METRICS.span("db_seconds", table="tokens", op="get"), bd.db_session() as db:
             obj = db.query(bd.Tokens).filter(bd.Tokens.client == client_id).one()
         return obj
 
     @staticmethod
     def update(client_id, new_values):
-        with bd.db_session() as db:
+        with METRICS.span("db_seconds", table="tokens", op="update"), bd.db_session() as db:
             try:
                 update_stmt = (
                     update(bd.Tokens.__table__)
@@ -28,8 +36,8 @@ class TokensEndpoint:
                 if result.rowcount == 0:
                     print("Failed to update db.")
                     return False
-            except:
-                print("Failed to update db.")
+            except Exception as e:
+                print(f"Failed to update db. Exception: {e}")
                 return False
         return True
 
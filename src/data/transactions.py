@@ -0,0 +1,185 @@
+import argparse
+import json
+import logging
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+
+from sqlalchemy import func, select
+
+THISDIR = os.path.dirname(os.path.abspath(__file__))
+BASE_DIR = os.path.join(THISDIR, "..", "..")
+SRC_DIR = os.path.join(BASE_DIR, "src")
+CLIENT_DIR = os.path.join(SRC_DIR, "basilisk", "clients")
+
+for path in [THISDIR, SRC_DIR, CLIENT_DIR]:
+    if path not in sys.path:
+        sys.path.append(path)
+
+import basilisk_data as bd
+from data.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+logger.setLevel(logging.INFO)
+
+DEFAULT_BATCH_SIZE = 500
+# Days before the newest stored transaction that a sync asks for again. The
+# API filters by whole days, and late postings can land on a day already
+# synced; re-downloaded transactions are skipped by id.
+DEFAULT_OVERLAP_DAYS = 1
+
+def transaction_time(transaction):
+    """
+    Epoch ms of a transaction's transactionDate (e.g.
+    2021-03-01T15:30:00+0000).
+    """
+    date = transaction.get("transactionDate")
+    if not date:
+        return None
+    return int(datetime.strptime(date, "%Y-%m-%dT%H:%M:%S%z").timestamp() * 1000)
+
+def transaction_row(transaction):
+    """
+    Flattens a transaction to a transaction_log row.
+    """
+    item = transaction.get("transactionItem") or {}
+    instrument = item.get("instrument") or {}
+    fees = transaction.get("fees") or {}
+    return {
+        "id" : transaction["transactionId"],
+        "time" : transaction_time(transaction),
+        "type" : transaction.get("type"),
+        "sub_type" : transaction.get("transactionSubType"),
+        "description" : transaction.get("description"),
+        "order_id" : None if transaction.get("orderId") is None else str(transaction["orderId"]),
+        "symbol" : instrument.get("symbol"),
+        "asset_type" : instrument.get("assetType"),
+        "instruction" : item.get("instruction"),
+        "quantity" : item.get("amount"),
+        "price" : item.get("price"),
+        "cost" : item.get("cost"),
+        "fees" : sum(value for value in fees.values() if isinstance(value, (int, float))),
+        "net_amount" : transaction.get("netAmount"),
+        "data" : json.dumps(transaction, separators=(",", ":")),
+    }
+
+class TransactionSync():
+    """
+    Keeps the transaction_log table up to date with the account's history.
+
+    The first sync downloads the whole history the API serves; after that
+    each sync starts from the day of the newest stored transaction, so only
+    new activity is fetched. Transactions are streamed from
+    client.get_transactions and written `batch_size` at a time, oldest
+    first, each batch in its own commit: memory stays flat however long
+    the history is, and an interrupted sync resumes where it stopped.
+
+        sync = TransactionSync(client)
+        sync.sync()
+        for row in sync.transactions(symbol="AAPL"):
+            ...
+
+    Args:
+    - client: a client with get_transactions.
+    - engine: SQLAlchemy engine, the session database by default.
+    - batch_size: rows per commit.
+    - overlap_days: see DEFAULT_OVERLAP_DAYS.
+    """
+
+    def __init__(self, client, engine=None, batch_size=DEFAULT_BATCH_SIZE,
+            overlap_days=DEFAULT_OVERLAP_DAYS):
+        self.client = client
+        self.engine = engine if engine is not None else bd.ENGINE
+        self.batch_size = batch_size
+        self.overlap_days = overlap_days
+        self.table = bd.TransactionLog.__table__
+
+    def last_synced(self):
+        """
+        Epoch ms of the newest stored transaction, or None.
+        """
+        with self.engine.connect() as connection:
+            return connection.execute(select(func.max(self.table.c.time))).scalar()
+
+    def start_date(self):
+        """
+        First day the next sync asks for, or None for the whole history.
+        """
+        last = self.last_synced()
+        if last is None:
+            return None
+        day = datetime.fromtimestamp(last / 1000, timezone.utc).date()
+        return day - timedelta(days=self.overlap_days)
+
+    def _write(self, rows):
+        """
+        Inserts rows not already stored. Returns how many were new.
+        """
+        with METRICS.span("db_seconds", table="transaction_log", op="insert"):
+            with self.engine.begin() as connection:
+                result = connection.execute(self.table.insert().prefix_with("OR IGNORE"), rows)
+        return result.rowcount
+
+    def sync(self, end_date=None, **kwargs):
+        """
+        Downloads and stores the transactions since the last sync, up to
+        `end_date` (default today). Extra kwargs (window_days, priority) go
+        to get_transactions. Returns the number of new transactions.
+
+        Syncs always cover every transaction: the next one resumes from the
+        newest stored transaction, so a sync filtered by symbol or type
+        would make it skip the others' history. Filtered downloads go
+        straight to client.get_transactions.
+        """
+        if kwargs.get("symbol") is not None or kwargs.get("transaction_type", "ALL") != "ALL":
+            raise ValueError("'sync' always stores every transaction; "
+                    "call get_transactions for a filtered download")
+        kwargs.pop("symbol", None)
+        kwargs.pop("transaction_type", None)
+        start_date = self.start_date()
+        logger.info(f"Syncing transactions from {start_date or 'the start of the history'}")
+        added = 0
+        batch = []
+        for transaction in self.client.get_transactions(start_date, end_date, **kwargs):
+            batch.append(transaction_row(transaction))
+            if len(batch) >= self.batch_size:
+                added += self._write(batch)
+                batch = []
+        if batch:
+            added += self._write(batch)
+        METRICS.counter("transactions_synced_total").inc(added)
+        logger.info(f"Stored {added} new transactions")
+        return added
+
+    def transactions(self, symbol=None, start=None, end=None):
+        """
+        Yields stored transactions as dicts, oldest first, optionally for one
+        symbol and from `start` up to `end` (epoch ms). Rows are read off the
+        cursor as they're consumed, not loaded all at once.
+        """
+        query = select(self.table).order_by(self.table.c.time, self.table.c.id)
+        if symbol is not None:
+            query = query.where(self.table.c.symbol == symbol)
+        if start is not None:
+            query = query.where(self.table.c.time >= start)
+        if end is not None:
+            query = query.where(self.table.c.time < end)
+        with self.engine.connect() as connection:
+            for row in connection.execution_options(stream_results=True).execute(query):
+                yield dict(row._mapping)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--end-date", default=None,
+            help="last day to sync, yyyy-MM-dd (default: today)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    from td.td_client import TDClient
+
+    client = TDClient()
+    try:
+        TransactionSync(client).sync(end_date=args.end_date)
+    finally:
+        client.tokens.stop()
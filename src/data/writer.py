@@ -0,0 +1,314 @@
+import atexit
+import logging
+import math
+import threading
+import time
+from collections import deque
+
+from sqlalchemy import bindparam
+
+import basilisk_data as bd
+from data.metrics import METRICS
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_BATCH_SIZE = 1000
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Most rows held in memory before write() starts blocking the caller.
+DEFAULT_MAX_PENDING = 100000
+# Rows that failed to write on their own, kept for inspection.
+DEAD_LETTER_SIZE = 1000
+
+INSERT = "insert"
+UPDATE = "update"
+
+class WriteBehindWriter():
+    """
+    Buffers rows in memory and writes them on a dedicated thread, one
+    transaction per flush and one executemany per run of the same
+    statement. A flush happens once `batch_size` rows are waiting or
+    `flush_interval` seconds have passed, whichever comes first.
+
+    Writes to the same table are applied in the order they were queued;
+    writes to different tables may be reordered to batch them. If a batch
+    fails, its rows are retried one at a time and the ones that still fail
+    go to `dead_letters` instead of taking the rest down with them.
+
+        writer = WriteBehindWriter().start()
+        writer.write(bd.QuoteLog, {"time": t, "symbol": "AAPL", "bid": 1.0})
+        writer.update(bd.Tokens, "client", "td", {"session_token": token}, wait=True)
+        ...
+        writer.close()
+    """
+
+    def __init__(self, engine=None, batch_size=DEFAULT_BATCH_SIZE,
+            flush_interval=DEFAULT_FLUSH_INTERVAL, max_pending=DEFAULT_MAX_PENDING):
+        self.engine = engine if engine is not None else bd.ENGINE
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        # [key, rows, outcome] runs in queue order, and the index of the
+        # last run touching each table. A waited write gets a run of its own
+        # with an outcome dict its caller reads once the run is written.
+        self._groups = []
+        self._last = {}
+        self._pending = 0
+        self._cond = threading.Condition()
+        # Held while a batch is taken and written, so batches commit in the
+        # order they were taken whichever thread writes them.
+        self._write_lock = threading.Lock()
+        self._closed = False
+        self._thread = threading.Thread(target=self._run, daemon=True, name="db-writer")
+
+        self.rows_written = 0
+        self.flushes = 0
+        self.errors = 0
+        self.dead_letters = deque(maxlen=DEAD_LETTER_SIZE)
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def _queue(self, key, row, wait=False):
+        table = key[1]
+        outcome = {"ok" : False} if wait else None
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("Writer is closed")
+            while self._pending >= self.max_pending:
+                self._cond.wait()
+            index = self._last.get(table)
+            if (not wait and index is not None and self._groups[index][0] == key
+                    and self._groups[index][2] is None):
+                self._groups[index][1].append(row)
+            else:
+                self._last[table] = len(self._groups)
+                self._groups.append([key, [row], outcome])
+            self._pending += 1
+            if self._pending >= self.batch_size:
+                self._cond.notify_all()
+        return outcome
+
+    def _wait(self, outcome):
+        if outcome is None:
+            return True
+        self.flush()
+        return outcome["ok"]
+
+    def write(self, model, row, wait=False):
+        """
+        Queues one row (dict of column to value) to insert into `model`'s
+        table. With `wait`, writes it and everything queued before it on
+        the calling thread and returns whether this row was written.
+        """
+        return self._wait(self._queue((INSERT, model.__table__), row, wait))
+
+    def write_many(self, model, rows):
+        for row in rows:
+            self.write(model, row)
+
+    def update(self, model, key_column, key, values, wait=False):
+        """
+        Queues an update of `values` (dict of column to value) on the rows
+        of `model`'s table where `key_column` equals `key`. `wait` as for
+        write, except that it returns whether the update matched a row.
+        """
+        row = dict(values)
+        row["_key"] = key
+        return self._wait(self._queue(
+                (UPDATE, model.__table__, key_column, tuple(sorted(values))), row, wait))
+
+    def _take(self):
+        groups = self._groups
+        self._groups = []
+        self._last = {}
+        self._pending = 0
+        self._cond.notify_all()
+        return groups
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while not self._closed and self._pending < self.batch_size:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                closed = self._closed
+            self.flush()
+            if closed:
+                return
+
+    @staticmethod
+    def _statement(key):
+        if key[0] == INSERT:
+            return key[1].insert()
+        _, table, key_column, _ = key
+        return table.update().where(table.c[key_column] == bindparam("_key"))
+
+    @staticmethod
+    def _matched(key, batch, result):
+        """
+        Whether every update in a run matched a row. Inserts always do.
+        """
+        if key[0] == UPDATE and 0 <= result.rowcount < len(batch):
+            logger.warning(f"Update of {key[1].name} matched no row for some of "
+                    f"{sorted({row['_key'] for row in batch})}")
+            return False
+        return True
+
+    def _write(self, groups):
+        """
+        Writes the runs in one transaction. Returns the number of rows that
+        couldn't be written.
+        """
+        if not groups:
+            return 0
+        rows = sum(len(batch) for _, batch, _ in groups)
+        outcomes = []
+        try:
+            with METRICS.span("db_writer_flush_seconds"), self.engine.begin() as connection:
+                for key, batch, outcome in groups:
+                    result = connection.execute(self._statement(key), batch)
+                    matched = self._matched(key, batch, result)
+                    if outcome is not None:
+                        outcomes.append((outcome, matched))
+        except Exception as e:
+            logger.error(f"Failed to write {rows} rows, retrying them one at a time: {e}")
+            return self._write_each(groups)
+        for outcome, matched in outcomes:
+            outcome["ok"] = matched
+        self.rows_written += rows
+        self.flushes += 1
+        return 0
+
+    def _write_each(self, groups):
+        """
+        Writes rows one per transaction, dead-lettering the ones that fail.
+        """
+        failed = 0
+        for key, batch, outcome in groups:
+            statement = self._statement(key)
+            for row in batch:
+                try:
+                    with self.engine.begin() as connection:
+                        result = connection.execute(statement, [row])
+                    if outcome is not None:
+                        outcome["ok"] = self._matched(key, [row], result)
+                except Exception as e:
+                    failed += 1
+                    self.errors += 1
+                    self.dead_letters.append((key[1].name, row, str(e)))
+                    METRICS.counter("db_writer_dead_letters_total", table=key[1].name).inc()
+                    logger.error(f"Dropped row for {key[1].name} {row}: {e}")
+                else:
+                    self.rows_written += 1
+        self.flushes += 1
+        return failed
+
+    def flush(self):
+        """
+        Writes everything buffered so far on the calling thread. Returns
+        True if every row was written.
+        """
+        with self._write_lock:
+            with self._cond:
+                groups = self._take()
+            return self._write(groups) == 0
+
+    def close(self):
+        """
+        Stops the writer thread after a final flush.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread.is_alive():
+            self._thread.join()
+        else:
+            self.flush()
+
+    def stats(self):
+        with self._cond:
+            pending = self._pending
+        return {
+            "pending" : pending,
+            "rows_written" : self.rows_written,
+            "flushes" : self.flushes,
+            "errors" : self.errors,
+            "dead_letters" : len(self.dead_letters),
+        }
+
+_shared_writer = None
+_shared_lock = threading.Lock()
+
+def shared_writer():
+    """
+    The process wide writer for the session database, started on first
+    use and flushed at exit.
+    """
+    global _shared_writer
+    with _shared_lock:
+        if _shared_writer is None:
+            _shared_writer = WriteBehindWriter().start()
+            atexit.register(_shared_writer.close)
+        return _shared_writer
+
+def nan_to_none(value):
+    return None if isinstance(value, float) and math.isnan(value) else value
+
+class DatabaseLog():
+    """
+    Records quotes, orders and fills in the quote_log, order_log and
+    fill_log tables through a WriteBehindWriter. Has the same methods as
+    data.journal.AuditLog, so clients take either as their journal.
+    Requests are only kept in the binary journal.
+    """
+
+    def __init__(self, writer=None):
+        self.writer = writer if writer is not None else shared_writer()
+
+    def log_quote(self, symbol, quote):
+        get = quote.get
+        self.writer.write(bd.QuoteLog, {
+            "time" : int(time.time() * 1000),
+            "symbol" : symbol,
+            "bid" : nan_to_none(get("bidPrice")),
+            "ask" : nan_to_none(get("askPrice")),
+            "last" : nan_to_none(get("lastPrice")),
+            "volume" : nan_to_none(get("totalVolume")),
+        })
+
+    def log_request(self, method, url, status, elapsed, priority=-1, size=0):
+        pass
+
+    def log_order(self, event, order_id, symbol="", instruction="", order_type="",
+            quantity=math.nan, price=math.nan, status=""):
+        self.writer.write(bd.OrderLog, {
+            "time" : int(time.time() * 1000),
+            "order_id" : str(order_id),
+            "symbol" : symbol or None,
+            "instruction" : instruction or None,
+            "quantity" : nan_to_none(quantity),
+            "order_type" : order_type or None,
+            "price" : nan_to_none(price),
+            "status" : status or event.upper(),
+        })
+
+    def log_fill(self, order_id, symbol, quantity, price):
+        self.writer.write(bd.FillLog, {
+            "time" : int(time.time() * 1000),
+            "order_id" : str(order_id),
+            "symbol" : symbol,
+            "quantity" : quantity,
+            "price" : price,
+        })
+
+    def flush(self):
+        self.writer.flush()
+
+    def close(self):
+        self.writer.flush()